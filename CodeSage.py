@@ -1,20 +1,49 @@
 import os
 import json
+import time
+import uuid
 import logging
+import threading
 import nltk
 from datetime import datetime 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from SageLibs.config import EMBEDDINGS_FILE
-from SageLibs.config import load_settings, get_setting, update_settings
-from SageLibs.web_requests import get_embedding, summarize_content, get_chat_response
-from SageLibs.utilities import load_embeddings, count_tokens, get_relevant_documents, get_file_paths, read_file, hash_content, get_changed_files_in_diff, diff_between_branches
-from SageLibs.questions import get_all_questions, get_question_by_id, insert_question, delete_question, get_relevant_answers
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
+from SageLibs.config import load_settings, get_setting, update_settings, REVIEW_EXTENSIONS, ANN_NPROBE
+from SageLibs.web_requests import get_embedding, get_chat_response
+from SageLibs.utilities import count_tokens, get_relevant_documents
+from SageLibs.questions import get_all_questions, get_question_by_id, insert_question, delete_question, get_relevant_answers, find_cached_answer, get_sources
 from SageLibs.folders import get_all_folders, add_folder, delete_folder, get_selected_folders, update_selected_folders
-from SageLibs.Translator import translate_lines
+from SageLibs.indexer import refresh_folder
+from SageLibs.context_packer import get_context_budget, pack_context
+from SageLibs.change_analysis import analyze_changes as analyze_changes_in_folder
+from SageLibs.jobs import submit_job, get_job, list_jobs, cancel_job, wait_for_change
+from SageLibs.watcher import start_watcher, stop_watcher, sync_watched_folders, get_watcher_status
+from SageLibs.http_client import get_client_metrics
+from SageLibs.embedding_cache import get_cache_metrics
 
 app = Flask(__name__, template_folder='SageTemplate')
 app.secret_key = 'your_secret_key_here'
 
+# 답변 스트림 대기열: 질문 요청에서 등록하고 /stream_answer에서 한 번 꺼내 SSE로 보낸다
+ANSWER_STREAM_TTL = 600
+answer_streams = {}
+answer_streams_lock = threading.Lock()
+
+def start_answer_stream(question, produce, context_report=None, question_embedding=None, sources=None):
+    """ produce()는 답변 텍스트 조각의 이터레이터를 반환. 스트림이 끝나면 전체 답변을 question과 함께 저장한다.
+    context_report는 답변 화면에 보여줄 문맥 선택 보고서, question_embedding과 sources는 답변 캐시에 쓰도록 함께 저장한다 """
+    stream_id = uuid.uuid4().hex
+    now = time.time()
+    with answer_streams_lock:
+        for expired in [key for key, entry in answer_streams.items() if now - entry['created'] > ANSWER_STREAM_TTL]:
+            del answer_streams[expired]
+        answer_streams[stream_id] = {'question': question, 'produce': produce, 'context_report': context_report,
+                                     'question_embedding': question_embedding, 'sources': sources, 'created': now}
+    return stream_id
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -22,46 +51,35 @@ def index():
 
         logging.debug("질문 임베딩 생성 시작")
         try:
-            if get_setting('use_translator') == 'on':    
-                question_embedding = get_embedding(translate_lines(question))
-            else:
-                question_embedding = get_embedding(question)
+            # 번역 설정이 켜져 있으면 get_embedding이 번역한 뒤 임베딩한다 (캐시에 있으면 번역도 생략)
+            question_embedding = get_embedding(question)
             logging.debug("질문 임베딩 생성 완료")
         except Exception as e:
             logging.error(f"임베딩 생성 중 오류 발생: {str(e)}", exc_info=True)
             flash(f"임베딩 생성 중 오류 발생: {str(e)}", "error")
             return redirect(url_for('index'))
         
+        if get_setting('answer_cache') == 'on':
+            if request.form.get('refresh') == 'on':
+                logging.info("Answer cache skipped: refresh requested")
+            else:
+                cached, similarity = find_cached_answer(question_embedding, get_selected_folders())
+                if cached is not None:
+                    return redirect(url_for('show_question', question_id=cached['doc_id'], cached=f"{similarity:.3f}"))
+
         question_part_token_count = count_tokens(question)
-        relevant_answers = get_relevant_answers(question_embedding)
-        relevant_docs = get_relevant_documents(get_selected_folders(), question_embedding)
-
-        # 토큰 수 제한 및 선택 로직
-        max_tokens = 80000
-        remaining_tokens = max_tokens - question_part_token_count
-        selected_answers = []
-        selected_docs = []
-        
-        # relevant_answers와 relevant_docs를 유사도 순으로 정렬
-        all_items = relevant_answers + relevant_docs
-        all_items.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        for item in all_items:
-            if remaining_tokens - item['tokens'] >= 0:
-                if 'filename' in item:  # relevant_docs의 항목
-                    if get_setting('filter_content') == 'on':
-                        item['content'] = summarize_content(question, item['content'])
-                    selected_docs.append(item)
-
-                else:  # relevant_answers의 항목
-                    if get_setting('filter_content') == 'on':
-                        item['answer'] = summarize_content(question, item['answer'])
-                    selected_answers.append(item)
-
-                remaining_tokens -= item['tokens']
-           
-            if remaining_tokens <= 0:
-                break
+        budget = get_context_budget()
+        # 검색은 예산으로 자르지 않고 후보 전체를 넘긴다. 예산 안에서 고르고 자르는 것은 pack_context가 한다
+        relevant_answers = get_relevant_answers(question_embedding, max_tokens=None)
+        relevant_docs = get_relevant_documents(get_selected_folders(), question_embedding, max_tokens=None, question=question)
+
+        # 토큰당 가치 순으로 예산을 채우고, 다 들어가지 않는 문서는 관련 있는 구간만 넣는다
+        selected_items, context_report = pack_context(question, relevant_answers + relevant_docs, budget - question_part_token_count,
+                                                      filter_related=get_setting('filter_content') == 'on')
+
+        # relevant_docs의 항목은 filename을 가진다
+        selected_docs = [item for item in selected_items if 'filename' in item]
+        selected_answers = [item for item in selected_items if 'filename' not in item]
 
         user_message = f"Please reply in Korean.\n\nQuestion: {question}\n\nrelevant_docs:\n{json.dumps(selected_docs, ensure_ascii=False)}\n\nrelevant_answers: \n{json.dumps(selected_answers, ensure_ascii=False)}"
         if len(selected_answers) == 0:
@@ -70,16 +88,9 @@ def index():
         # with open('./prompt.txt', 'w', encoding='utf-8') as file:
         #     file.write(user_message)        
 
-        try:
-            answer = get_chat_response(user_message)
-            logging.debug(f"응답 길이: {len(answer)} 글자")
-        except Exception as e:
-            logging.error(f"API 호출 중 오류 발생: {str(e)}", exc_info=True)
-            flash(f"API 호출 중 오류 발생: {str(e)}", "error")
-            return redirect(url_for('index'))
-        
-        doc_id = insert_question(question, answer)
-        return redirect(url_for('show_question', question_id=doc_id))
+        stream_id = start_answer_stream(question, lambda: get_chat_response(user_message, stream=True), context_report,
+                                        question_embedding, get_sources(selected_docs))
+        return redirect(url_for('show_stream', stream_id=stream_id))
 
     questions = get_all_questions(revert=True)
     return render_template('index-multi.html', questions=questions)
@@ -115,49 +126,61 @@ Analyze the code changes provided in 'Diff:' and refer to the existing code in '
 
 For each item, please provide specific line numbers and suggestions for improvement. Focus primarily on the changes shown in 'Diff:', but refer to the existing code in 'Context:' when necessary for a comprehensive analysis."""
 
-    try:
-        file_names = get_changed_files_in_diff(folder, analysis_type)
-        combined_answer = ""
-        error_files = []
-
-        for file_name in file_names:
-            try:
-                logging.debug(f"Processing changes for file: {file_name}")
-                diff_output = diff_between_branches(folder, analysis_type, specific_file=file_name)
-                question_embedding = get_embedding(f"Filename:{file_name}\n\nDiff:\n{diff_output}")
-                relevant_docs = get_relevant_documents([folder], question_embedding)
-                user_message = f"Question: {question}\n\nFilename: {file_name}\n\nDiff:\n{diff_output}\n\nContext:\n{json.dumps(relevant_docs, ensure_ascii=False, indent=2)}"
-
-                answer = get_chat_response(user_message)
-                combined_answer += f"# File: {file_name}\n\n{answer}\n\n"
-
-            except Exception as e:
-                logging.error(f"Error processing file {file_name}: {str(e)}", exc_info=True)
-                error_files.append(file_name)
-
-        if combined_answer:
-            current_time = datetime.now()
-            doc_id = insert_question(f'Git diff ({analysis_type}) - {current_time}\n{folder}', combined_answer)
-            return redirect(url_for('show_question', question_id=doc_id))
+    def run(job):
+        doc_id = insert_question(title, analyze_changes_in_folder(folder, analysis_type, question, progress=job))
+        return {'doc_id': doc_id}
 
-        if error_files:
-            flash(f"Errors encountered in files: {', '.join(error_files)}", "warning")
-        else:
-            flash("No changes to analyze or error in processing all files.", "warning")
-        return redirect(url_for('index'))
+    title = f'Git diff ({analysis_type}) - {datetime.now()}\n{folder}'
+    job_id, created = submit_job('analyze', f'analyze:{analysis_type}:{folder}', f'Analyze {analysis_type} changes in {folder}', run)
+    return job_response([job_id], created)
 
-    except Exception as e:
-        logging.error(f"General error during analysis: {str(e)}", exc_info=True)
-        flash(f"General error during analysis: {str(e)}", "error")
+@app.route('/stream/<stream_id>')
+def show_stream(stream_id):
+    with answer_streams_lock:
+        entry = answer_streams.get(stream_id)
+    if entry is None:
+        flash("The answer stream has expired.", "error")
         return redirect(url_for('index'))
 
+    return render_template('result.html', question=entry['question'], answer='', stream_url=url_for('stream_answer', stream_id=stream_id),
+                           context_report=entry['context_report'], questions=get_all_questions(revert=True))
+
+@app.route('/stream_answer/<stream_id>')
+def stream_answer(stream_id):
+    """ 답변을 Server-Sent Events로 보낸다. 조각마다 data: {"text"}, 끝나면 event: done 에 저장된 질문 id """
+    with answer_streams_lock:
+        entry = answer_streams.pop(stream_id, None)
+
+    def generate():
+        if entry is None:
+            yield sse_event({'message': "The answer stream has expired."}, 'error')
+            return
+
+        answer = []
+        try:
+            for text in entry['produce']():
+                answer.append(text)
+                yield sse_event({'text': text})
+        except Exception as e:
+            logging.error(f"API 호출 중 오류 발생: {str(e)}", exc_info=True)
+            yield sse_event({'message': f"API 호출 중 오류 발생: {str(e)}"}, 'error')
+            return
+
+        answer = ''.join(answer)
+        logging.debug(f"응답 길이: {len(answer)} 글자")
+        doc_id = insert_question(entry['question'], answer, entry['question_embedding'], entry['sources'])
+        yield sse_event({'doc_id': doc_id, 'url': url_for('show_question', question_id=doc_id), 'title': entry['question'].split('\n')[0]}, 'done')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/question/<int:question_id>')
 def show_question(question_id):
     question_record = get_question_by_id(question_id)
     if not question_record:
         return redirect(url_for('index'))
     
-    return render_template('result.html', question=question_record['question'], answer=question_record['answer'], questions=get_all_questions(revert=True))
+    return render_template('result.html', question=question_record['question'], answer=question_record['answer'],
+                           cached_similarity=request.args.get('cached'), questions=get_all_questions(revert=True))
 
 @app.route('/delete_question/<int:question_id>', methods=['POST'])
 def delete_question_route(question_id):
@@ -178,47 +201,81 @@ def extract_embeddings():
     folders = get_selected_folders()
     logging.info(f"Selected folders: {folders}")
 
-    for folder in folders:
-        embedding_file = os.path.join(folder, EMBEDDINGS_FILE)
-        existing_embeddings = load_embeddings(embedding_file)
-        file_paths = get_file_paths(folder)
-        error_files = []
-
-        with open(embedding_file, 'w', encoding='utf-8') as f:
-            for file_path in file_paths:
-                try:
-                    relative_path = os.path.relpath(file_path, start=folder)
-                    logging.info(f"Processing {relative_path}")
-                    
-                    content = read_file(file_path)
-                    content_hash = hash_content(content)
-
-                    if relative_path in existing_embeddings and existing_embeddings[relative_path]['content_hash'] == content_hash:
-                        file_data = existing_embeddings[relative_path]
-                    else:
-                        logging.info(f"  - Changes detected or new file, generating new embedding")
-                        embedding = get_embedding(content)
-                        file_data = {
-                            "filename": relative_path, 
-                            "content": content,
-                            "content_hash": content_hash,
-                            "embedding": embedding
-                        }
-
-                    f.write(json.dumps(file_data, ensure_ascii=False) + '\n')
-                except Exception as e:
-                    logging.error(f"Error processing {file_path}: {str(e)}", exc_info=True)
-                    error_files.append(relative_path)
-
-        logging.info(f"Embedding extraction complete for folder {folder}. Results saved to {embedding_file}")
+    if not folders:
+        flash("임베딩을 추출할 폴더를 선택해주세요.", "error")
+        return redirect(url_for('index'))
+
+    def run(job, folder):
+        error_files, stats = refresh_folder(folder, progress=job)
+        logging.info(f"Embedding extraction complete for folder {folder}.")
         if error_files:
-            error_message = f"The following files encountered errors and were skipped in folder {folder}: {', '.join(error_files)}"
-            logging.warning(error_message)
-            flash(error_message, "warning")
-        else:
-            flash(f"임베딩 추출이 성공적으로 완료되었습니다 for folder {folder}.", "success")
+            logging.warning(f"The following files encountered errors and were skipped in folder {folder}: {', '.join(error_files)}")
+        return {'folder': folder, 'stats': stats, 'error_files': error_files}
 
-    return redirect(url_for('index'))
+    job_ids = []
+    created_any = False
+    for folder in folders:
+        # 같은 폴더의 갱신 작업이 이미 대기 중이거나 실행 중이면 그 작업을 그대로 쓴다
+        job_id, created = submit_job('refresh', f'refresh:{folder}', f'Refresh embeddings for {folder}', lambda job, folder=folder: run(job, folder))
+        job_ids.append(job_id)
+        created_any = created_any or created
+
+    return job_response(job_ids, created_any)
+
+def job_response(job_ids, created):
+    """ 작업을 등록한 요청의 응답. JSON을 원하면 작업 id를, 아니면 작업 진행 화면으로 보낸다 """
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+        return jsonify({'job_ids': job_ids, 'created': created}), 202
+    if not created:
+        flash("같은 작업이 이미 진행 중입니다.", "info")
+    return redirect(url_for('jobs_page', focus=job_ids[0]))
+
+@app.route('/jobs')
+def jobs_page():
+    return render_template('jobs.html', jobs=list_jobs(), focus=request.args.get('focus'))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'message': "Job not found."}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job_route(job_id):
+    if cancel_job(job_id):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'message': "Job is not running."}), 404
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """ 작업 진행 상태를 바뀔 때마다 event: progress 로, 작업이 내보낸 텍스트 조각(파일별 리뷰 등)을 event: output 으로 보내고,
+    끝나면 event: end 로 마무리 (Server-Sent Events) """
+    def generate():
+        job, output = get_job(job_id), []
+        output_offset, sent_version = 0, None
+        while job is not None:
+            if output:
+                yield sse_event(output, 'output')
+                output_offset += len(output)
+            if job['status'] not in ('queued', 'running'):
+                yield sse_event(job, 'end')
+                return
+            if job['version'] != sent_version:
+                yield sse_event(job, 'progress')
+                sent_version = job['version']
+            job, output = wait_for_change(job_id, job['version'], output_offset)
+        yield sse_event({'message': "Job not found."}, 'error')
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/indexer_status', methods=['GET'])
+def indexer_status():
+    return jsonify(get_watcher_status())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({'http': get_client_metrics(), 'embedding_cache': get_cache_metrics()})
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings_route():
@@ -228,14 +285,26 @@ def settings_route():
             'openai_api_key': request.form.get('apiKey', 'your_openai_api_key'),
             'filter_content': request.form.get('filterContent'),
             'use_question_history': request.form.get('useQuestionHistory'),
+            'answer_cache': request.form.get('answerCache'),
+            'symbol_context': request.form.get('symbolContext'),
             'extensions': request.form.get('extensions'),
+            'review_extensions': request.form.get('reviewExtensions'),
             'ignore_folders': request.form.get('ignoreFolders'),
             'ignore_files': request.form.get('ignoreFiles'),
-            'essential_files': request.form.get('essentialFiles')
+            'essential_files': request.form.get('essentialFiles'),
+            'embedding_dimensions': request.form.get('embeddingDimensions'),
+            'embedding_dtype': request.form.get('embeddingDtype'),
+            'ann_folders': request.form.get('annFolders'),
+            'ann_nprobe': request.form.get('annNprobe'),
+            'watch_folders': request.form.get('watchFolders')
         }
         
         logging.debug(f"새로운 설정: {new_settings}")
         update_settings(new_settings)
+        if get_setting('watch_folders') == 'on':
+            start_watcher(get_selected_folders())
+        else:
+            stop_watcher()
         flash('설정이 성공적으로 업데이트되었습니다.', 'success')
         return redirect(url_for('settings_route'))
     
@@ -243,10 +312,18 @@ def settings_route():
         'openai_api_key': get_setting('openai_api_key', ''),
         'filter_content': get_setting('filter_content', ''),
         'use_question_history': get_setting('use_question_history', ''),
+        'answer_cache': get_setting('answer_cache', ''),
+        'symbol_context': get_setting('symbol_context', ''),
         'extensions': ", ".join(get_setting('extensions', [])),
+        'review_extensions': ", ".join(get_setting('review_extensions', REVIEW_EXTENSIONS)),
         'ignore_folders': ", ".join(get_setting('ignore_folders', [])),
         'ignore_files': ", ".join(get_setting('ignore_files', [])),
-        'essential_files': ", ".join(get_setting('essential_files', []))
+        'essential_files': ", ".join(get_setting('essential_files', [])),
+        'embedding_dimensions': get_setting('embedding_dimensions', ''),
+        'embedding_dtype': get_setting('embedding_dtype', 'float32'),
+        'ann_folders': ", ".join(get_setting('ann_folders', [])),
+        'ann_nprobe': get_setting('ann_nprobe', ANN_NPROBE),
+        'watch_folders': get_setting('watch_folders', '')
     }
 
     return render_template('settings.html', **template_data)    
@@ -299,6 +376,7 @@ def update_selected_folders_route():
     try:
         success, message = update_selected_folders(selected_folders)
         if success:
+            sync_watched_folders(get_selected_folders())
             return jsonify({"success": True, "message": message})
         else:
             return jsonify({"success": False, "message": message}), 400
@@ -311,4 +389,7 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     nltk.download('punkt', quiet=True)
     load_settings()
+    # 디버그 리로더는 감시용 부모 프로세스에서도 이 블록을 실행하므로, 요청을 처리하는 자식 프로세스에서만 폴더 감시를 시작
+    if get_setting('watch_folders') == 'on' and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_watcher(get_selected_folders())
     app.run(debug=True, host='0.0.0.0', port=8080)
@@ -0,0 +1,96 @@
+""" ANN(IVF + PQ) 검색 벤치마크.
+
+정확 검색(모든 행과의 내적)과 ANN 검색(nprobe개 목록의 PQ 근사 점수 + 후보 정확 재정렬)의 recall@k와 질문당 시간을 비교한다.
+--folder를 주면 이미 색인한 폴더를, 주지 않으면 임시 폴더에 만든 군집형 합성 벡터를 쓴다.
+
+    python SageBench/bench_ann.py --rows 200000 --dim 768 --nprobe 4,8,16,32
+    python SageBench/bench_ann.py --folder /path/to/indexed/folder --queries 100
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SageLibs import config
+from SageLibs.embedding_store import StoreWriter
+from SageLibs.vector_index import get_folder_index
+from SageLibs.ann_index import update_ann_index
+
+def make_store(folder, rows, dim, clusters, seed=7):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    writer = StoreWriter(folder, 'float16')
+    for start in range(0, rows, 10000):
+        count = min(10000, rows - start)
+        vectors = centers[rng.integers(clusters, size=count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+        for i, vector in enumerate(vectors):
+            row = start + i
+            writer.add(f"file{row // 8}.py", f"chunk {row}", f"hash{row}", vector, chunk=row % 8)
+    writer.commit()
+
+def make_queries(index, count, seed=11):
+    """ 임의의 행에 잡음을 더한 질문 벡터 (정규화) """
+    rng = np.random.default_rng(seed)
+    vectors = index.get_vectors(np.sort(rng.choice(len(index), count, replace=False)))
+    vectors += 0.5 * rng.standard_normal(vectors.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def exact_search(index, query, k):
+    scores = index.score(query)
+    return set(np.argpartition(-scores, k - 1)[:k].tolist())
+
+def ann_search(index, ann, query, k, nprobe, factor, mask):
+    rows = ann.search(query, k * factor, nprobe, mask)
+    scores = index.score_rows(query, rows)
+    return set(rows[np.argpartition(-scores, min(k, len(rows)) - 1)[:k]].tolist())
+
+def timed(func, queries):
+    start = time.perf_counter()
+    results = [func(query) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--folder', help='already indexed folder (default: synthetic store in a temporary folder)')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=100)
+    parser.add_argument('--nprobe', default='4,8,16,32,64')
+    parser.add_argument('--rerank-factor', type=int, default=config.ANN_RERANK_FACTOR)
+    args = parser.parse_args()
+
+    temp_dir = None
+    folder = args.folder
+    if folder is None:
+        temp_dir = tempfile.mkdtemp(prefix='sage_ann_')
+        folder = temp_dir
+        start = time.perf_counter()
+        make_store(folder, args.rows, args.dim, args.clusters)
+        print(f"synthetic store      : {args.rows} rows x {args.dim} dims in {time.perf_counter() - start:.1f}s")
+
+    try:
+        index = get_folder_index(folder)
+        start = time.perf_counter()
+        ann = update_ann_index(index, force=True)
+        if ann is None:
+            sys.exit(f"{len(index)} rows is below ANN_MIN_ROWS ({config.ANN_MIN_ROWS}), exact search is used for this folder")
+        print(f"ANN build            : {time.perf_counter() - start:.1f}s, {len(ann.centroids)} lists, {len(ann.codebooks)} subvectors")
+
+        queries = make_queries(index, min(args.queries, len(index)))
+        mask = np.ones(len(index), dtype=bool)
+        exact, exact_ms = timed(lambda query: exact_search(index, query, args.k), queries)
+        print(f"exact                : recall@{args.k} 1.000, {exact_ms:8.2f} ms/query")
+        for nprobe in [int(value) for value in args.nprobe.split(',')]:
+            results, ann_ms = timed(lambda query: ann_search(index, ann, query, args.k, nprobe, args.rerank_factor, mask), queries)
+            recall = np.mean([len(result & truth) / len(truth) for result, truth in zip(results, exact)])
+            print(f"ann nprobe={nprobe:<9}: recall@{args.k} {recall:.3f}, {ann_ms:8.2f} ms/query ({exact_ms / ann_ms:.1f}x)")
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,66 @@
+""" 임베딩 생성 처리량 벤치마크 (스텁 서버 사용, 네트워크/API 키 불필요).
+
+파일 하나씩 순차 요청하는 방식(get_embedding)과 배치+동시 요청 파이프라인(embed_documents)을 비교한다.
+
+    python SageBench/bench_embeddings.py --files 2000 --latency 0.3 --rps 20
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SageLibs import config, web_requests
+from SageLibs.embedding_pipeline import embed_documents
+from stub_openai_server import start_server
+
+WORDS = ['def', 'class', 'return', 'import', 'self', 'value', 'index', 'request', 'response', 'folder', 'embedding', 'token']
+
+def make_documents(count, min_words=50, max_words=1500):
+    rng = random.Random(42)
+    return [(f"file_{i}.py", ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))) for i in range(count)]
+
+def bench_sequential(documents):
+    start = time.perf_counter()
+    for _, text in documents:
+        web_requests.get_embedding(text, use_cache=False)
+    return time.perf_counter() - start
+
+def bench_pipeline(documents, concurrency):
+    results = {'ok': 0, 'error': 0}
+
+    def on_result(key, embedding, error):
+        results['error' if error else 'ok'] += 1
+
+    start = time.perf_counter()
+    embed_documents(documents, on_result, max_concurrency=concurrency)
+    return time.perf_counter() - start, results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--sequential-sample', type=int, default=50, help='files to time sequentially (extrapolated)')
+    parser.add_argument('--concurrency', type=int, default=config.EMBEDDING_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--rps', type=int, default=20)
+    args = parser.parse_args()
+
+    server, state = start_server(latency=args.latency, rps=0)
+    config.settings.update({'openai_api_key': 'stub', 'use_translator': ''})
+    web_requests.API_URL = f"http://127.0.0.1:{server.server_address[1]}/v1/embeddings"
+
+    documents = make_documents(args.files)
+
+    sample = documents[:args.sequential_sample]
+    elapsed = bench_sequential(sample)
+    per_file = elapsed / len(sample)
+    print(f"sequential : {len(sample)} files in {elapsed:.2f}s ({per_file * 1000:.0f} ms/file, ~{per_file * len(documents):.1f}s for {len(documents)} files)")
+
+    state.rps = args.rps
+    elapsed, results = bench_pipeline(documents, args.concurrency)
+    print(f"pipeline   : {len(documents)} files in {elapsed:.2f}s ({len(documents) / elapsed:.0f} files/s), "
+          f"ok={results['ok']} error={results['error']}, requests={state.requests} rate_limited={state.rate_limited}")
+
+    server.shutdown()
@@ -0,0 +1,119 @@
+""" 짧은 임베딩(embedding_dimensions)과 int8/float16 저장의 recall 벤치마크.
+
+원래 차원의 float32 정확 검색 상위 k개를 기준으로, 차원(앞부분만 남겨 다시 정규화, text-embedding-3의 dimensions 요청과 같음)과
+저장 형식별 recall@k, 벡터 하나의 바이트 수와 질문당 점수 계산 시간을 비교한다.
+
+질문 벡터는 저장된 질문 집합을 쓴다: --queries로 준 .npy, 없으면 현재 디렉터리의 SageEmbeddingCache.db(질문 임베딩 캐시),
+그다음 SageQuestions.db(질문 기록). 모두 없으면 저장소의 행에 잡음을 더해 만든다. --save-queries로 쓴 집합을 저장해 두고 다시 쓸 수 있다.
+--folder를 주지 않으면 앞쪽 차원일수록 분산이 큰 합성 벡터로 임시 저장소를 만든다 (실제 모델 벡터의 차원 축소 결과와는 다르다).
+
+    python SageBench/bench_quantization.py --folder /path/to/indexed/folder --k 20 --dimensions 3072,1024,512,256
+    python SageBench/bench_quantization.py --rows 50000 --dim 1024 --dimensions 1024,512,256
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SageLibs.embedding_store import StoreWriter, QuantizedMatrix, quantize_int8
+from SageLibs.vector_index import get_folder_index, score_matrix
+from SageLibs.utilities import truncate_embeddings
+
+DTYPES = ['float32', 'float16', 'int8']
+
+def make_store(folder, rows, dim, seed=7):
+    rng = np.random.default_rng(seed)
+    decay = (1 / np.sqrt(1 + np.arange(dim) / 32)).astype(np.float32)
+    centers = rng.standard_normal((rows // 50 + 1, dim)).astype(np.float32) * decay
+    writer = StoreWriter(folder, 'float32')
+    for row in range(rows):
+        vector = centers[row // 50] + 0.5 * rng.standard_normal(dim).astype(np.float32) * decay
+        writer.add(f"file{row // 8}.py", f"chunk {row}", f"hash{row}", vector, chunk=row % 8)
+    writer.commit()
+
+def load_stored_queries(path, dimensions):
+    """ 저장된 질문 벡터 집합. 차원이 저장소와 같은 것만 쓴다 """
+    if path:
+        return np.load(path), path
+    for database, query in [('SageEmbeddingCache.db', 'SELECT embedding FROM embeddings'),
+                            ('SageQuestions.db', 'SELECT embedding FROM questions WHERE embedding IS NOT NULL')]:
+        if not os.path.exists(database):
+            continue
+        connection = sqlite3.connect(database)
+        try:
+            vectors = [np.frombuffer(blob, dtype=np.float32) for (blob,) in connection.execute(query)]
+        except sqlite3.Error:
+            continue
+        finally:
+            connection.close()
+        vectors = [vector for vector in vectors if len(vector) == dimensions]
+        if vectors:
+            return np.stack(vectors), database
+    return None, None
+
+def make_queries(vectors, count, seed=11):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), min(count, len(vectors)), replace=False)]
+    return queries + 0.5 * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+
+def build_matrix(vectors, dtype):
+    if dtype == 'int8':
+        return QuantizedMatrix(*quantize_int8(vectors))
+    return np.ascontiguousarray(vectors.astype(dtype))
+
+def top_k(scores, k):
+    return set(np.argpartition(-scores, k - 1)[:k].tolist())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--folder', help='already indexed folder (default: synthetic store in a temporary folder)')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--queries', help='stored query vectors (.npy)')
+    parser.add_argument('--save-queries', help='save the query vectors used to this .npy file')
+    parser.add_argument('--query-count', type=int, default=200)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--dimensions', help='comma separated dimensions to compare (default: full, 1/3, 1/6, 1/12)')
+    args = parser.parse_args()
+
+    temp_dir = None
+    folder = args.folder
+    if folder is None:
+        temp_dir = tempfile.mkdtemp(prefix='sage_quant_')
+        folder = temp_dir
+        make_store(folder, args.rows, args.dim)
+
+    try:
+        index = get_folder_index(folder)
+        vectors = index.get_vectors(np.arange(len(index)))
+        full = vectors.shape[1]
+        queries, source = load_stored_queries(args.queries, full)
+        if queries is None:
+            queries, source = make_queries(vectors, args.query_count), 'noisy store rows'
+        queries = truncate_embeddings(queries[:args.query_count], full)
+        if args.save_queries:
+            np.save(args.save_queries, queries)
+        print(f"{len(index)} rows x {full} dims, {len(queries)} queries from {source}, recall@{args.k} against float32 x {full}")
+
+        truth = [top_k(vectors @ query, args.k) for query in queries]
+        dimensions = [int(value) for value in args.dimensions.split(',')] if args.dimensions else sorted(set([full, full // 3, full // 6, full // 12]), reverse=True)
+        for dimension in dimensions:
+            shortened = truncate_embeddings(vectors, dimension)
+            shortened_queries = truncate_embeddings(queries, dimension)
+            for dtype in DTYPES:
+                matrix = build_matrix(shortened, dtype)
+                start = time.perf_counter()
+                results = [top_k(score_matrix(matrix, query), args.k) for query in shortened_queries]
+                elapsed = (time.perf_counter() - start) / len(queries) * 1000
+                recall = np.mean([len(result & expected) / args.k for result, expected in zip(results, truth)])
+                row_bytes = dimension * np.dtype(dtype).itemsize + (4 if dtype == 'int8' else 0)
+                print(f"{dimension:>5} dims {dtype:<8}: recall@{args.k} {recall:.3f}, {row_bytes:6d} bytes/vector ({full * 4 / row_bytes:5.1f}x smaller), {elapsed:7.2f} ms/query")
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,83 @@
+""" 파일 탐색과 읽기 벤치마크.
+
+이전 방식(os.walk + 항목마다 get_setting/any(endswith), 파일 전체에 chardet.detect 후 순차 읽기)과
+현재 방식(os.scandir + 미리 컴파일한 규칙, UTF-8 우선 디코딩, 스레드 풀 읽기)을 임시 폴더에서 비교한다.
+
+    python SageBench/bench_scan.py --files 100000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import chardet
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SageLibs import config
+from SageLibs.config import get_setting
+from SageLibs.utilities import get_file_paths, read_files
+
+EXTENSIONS = ['.py', '.js', '.md', '.png', '.lock', '.ts']
+
+def make_tree(root, count, lines):
+    rng = random.Random(7)
+    for i in range(count):
+        directory = os.path.join(root, f"pkg{i % 97}", f"mod{i % 13}", 'node_modules' if i % 50 == 0 else 'src')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"file{i}{rng.choice(EXTENSIONS)}"), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(f"value_{j} = '{rng.random()}'  # 설명 {j}" for j in range(lines)))
+
+def legacy_get_file_paths(folder_path):
+    file_paths = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs[:] = [d for d in dirs if d not in get_setting('ignore_folders') and d != config.EMBEDDINGS_DIR]
+        for file in files:
+            if file not in get_setting('ignore_files') and any(file.endswith(ext) for ext in get_setting('extensions')):
+                file_paths.append(os.path.join(root, file))
+    return file_paths
+
+def legacy_read_file(file_path):
+    with open(file_path, 'rb') as file:
+        raw_data = file.read()
+    detected = chardet.detect(raw_data)
+    for encoding in [detected['encoding'], 'utf-8', 'euc-kr', 'cp949']:
+        try:
+            return raw_data.decode(encoding)
+        except (UnicodeDecodeError, TypeError, LookupError):
+            continue
+    return raw_data.decode('utf-8', errors='replace')
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36}: {elapsed:8.2f} s")
+    return result, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--lines', type=int, default=40, help='lines per file')
+    parser.add_argument('--read', type=int, default=2000, help='files to read (reading is compared on a subset)')
+    args = parser.parse_args()
+
+    config.settings.update({'openai_api_key': 'stub'})
+    root = tempfile.mkdtemp(prefix='sage_scan_')
+    try:
+        print(f"creating {args.files} files in {root} ...")
+        make_tree(root, args.files, args.lines)
+
+        before, before_time = timed("before: os.walk + get_setting", lambda: legacy_get_file_paths(root))
+        after, after_time = timed("after: scandir + compiled matcher", lambda: get_file_paths(root))
+        assert before == after, "scan results differ"
+        print(f"matched files: {len(after)}, scan speedup: {before_time / max(after_time, 1e-9):.1f}x")
+
+        subset = after[:args.read]
+        _, read_before = timed("before: chardet + sequential read", lambda: [legacy_read_file(path) for path in subset])
+        _, read_after = timed("after: utf-8 first + thread pool", lambda: list(read_files(subset)))
+        print(f"read speedup: {read_before / max(read_after, 1e-9):.1f}x")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,63 @@
+""" 질문 하나당 토큰 계산 비용 마이크로벤치마크.
+
+이전 방식(호출마다 encoding_for_model + encode)과 현재 방식(캐시된 인코더, 내용 해시 메모이제이션,
+encode_batch 일괄 계산, 추출 시 저장된 토큰 수 사용)을 비교한다.
+
+    python SageBench/bench_tokens.py --docs 100 --lines 400
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tiktoken
+from SageLibs.config import TOKEN_COUNTER_MODEL
+from SageLibs import utilities
+
+WORDS = ['def', 'class', 'return', 'import', 'self', 'value', 'index', 'request', 'response', 'folder', '임베딩', '질문', '{', '}', '(', ')']
+
+def make_documents(count, lines):
+    rng = random.Random(7)
+    return [f"src/file_{i}.py\n\n" + '\n'.join(' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) for _ in range(lines)) for i in range(count)]
+
+def legacy_count_tokens(text):
+    encoding = tiktoken.encoding_for_model(TOKEN_COUNTER_MODEL)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def timed(label, func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<34}: {elapsed * 1000:8.1f} ms/query")
+    return elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=100, help='candidate documents per query')
+    parser.add_argument('--lines', type=int, default=400, help='lines per document')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    documents = make_documents(args.docs, args.lines)
+    stored_tokens = {i: None for i in range(len(documents))}
+    utilities.get_encoder()
+
+    before = timed("before: encoding_for_model+encode", lambda: [legacy_count_tokens(doc) for doc in documents], args.repeat)
+
+    def cold_batch():
+        utilities._token_cache.clear()
+        return utilities.count_tokens_batch(documents)
+    timed("after: encode_batch (cold cache)", cold_batch, args.repeat)
+
+    utilities.count_tokens_batch(documents)
+    timed("after: count_tokens (memoized)", lambda: [utilities.count_tokens(doc) for doc in documents], args.repeat)
+
+    for i, tokens in enumerate(utilities.count_tokens_batch(documents)):
+        stored_tokens[i] = tokens
+    after = timed("after: stored token counts", lambda: [stored_tokens[i] for i in range(len(documents))], args.repeat)
+
+    print(f"speedup (stored vs before): {before / max(after, 1e-9):.0f}x")
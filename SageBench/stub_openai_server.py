@@ -0,0 +1,181 @@
+""" 오프라인 벤치마크용 OpenAI 임베딩/채팅 API 스텁 서버.
+
+요청마다 고정 지연 + 입력 수에 비례한 지연을 주고, 초당 요청 수가 한도를 넘으면 429와 Retry-After를 반환한다.
+error_rate의 비율만큼은 무작위로 503을 반환한다.
+채팅 응답은 토큰마다 token_latency만큼 걸려 생성되며, "stream": true이면 SSE로 조각을 보낸다.
+
+    python SageBench/stub_openai_server.py --port 8765 --latency 0.3 --rps 20
+"""
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubState:
+    def __init__(self, dimensions, latency, per_input_latency, rps, chat_tokens=200, token_latency=0.02, error_rate=0.0):
+        self.dimensions = dimensions
+        self.error_rate = error_rate
+        self.errors = 0
+        self.chat_tokens = chat_tokens
+        self.token_latency = token_latency
+        self.latency = latency
+        self.per_input_latency = per_input_latency
+        self.rps = rps
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.inputs = 0
+        self.chat_requests = 0
+
+    def admit(self):
+        """ 1초 고정 윈도우로 요청 수를 제한. 한도를 넘으면 False """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start = now
+                self.window_count = 0
+            self.requests += 1
+            if self.rps and self.window_count >= self.rps:
+                self.rate_limited += 1
+                return False
+            self.window_count += 1
+            return True
+
+    def fail(self):
+        """ error_rate 확률로 True (503을 보낼 요청) """
+        with self.lock:
+            if self.error_rate and random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+def fake_embedding(text, dimensions):
+    seed = int.from_bytes(hashlib.md5(text.encode('utf-8', errors='replace')).digest()[:4], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def fake_answer_tokens(count):
+    words = ['코드', '변경', 'function', 'returns', '`value`', '입니다.', '\n\n', 'index', '설명', '- item\n']
+    return [words[i % len(words)] + ' ' for i in range(count)]
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+
+            if self.path.endswith('/chat/completions'):
+                self.chat(payload)
+                return
+
+            if not self.path.endswith('/embeddings'):
+                self.send_json(404, {'error': {'message': 'not found'}})
+                return
+
+            if not state.admit():
+                self.send_json(429, {'error': {'message': 'rate limited'}}, {'Retry-After': '1'})
+                return
+            if state.fail():
+                self.send_json(503, {'error': {'message': 'unavailable'}})
+                return
+
+            inputs = payload.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            dimensions = payload.get('dimensions') or state.dimensions
+
+            time.sleep(state.latency + state.per_input_latency * len(inputs))
+            with state.lock:
+                state.inputs += len(inputs)
+
+            self.send_json(200, {
+                'object': 'list',
+                'model': payload.get('model'),
+                'data': [{'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, dimensions)} for i, text in enumerate(inputs)],
+                'usage': {'prompt_tokens': sum(len(text.split()) for text in inputs), 'total_tokens': sum(len(text.split()) for text in inputs)}
+            })
+
+        def chat(self, payload):
+            if not state.admit():
+                self.send_json(429, {'error': {'message': 'rate limited'}}, {'Retry-After': '1'})
+                return
+            if state.fail():
+                self.send_json(503, {'error': {'message': 'unavailable'}})
+                return
+            with state.lock:
+                state.chat_requests += 1
+
+            time.sleep(state.latency)
+            tokens = fake_answer_tokens(state.chat_tokens)
+            if not payload.get('stream'):
+                time.sleep(state.token_latency * len(tokens))
+                self.send_json(200, {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}}],
+                                     'usage': {'completion_tokens': len(tokens)}})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for token in tokens:
+                time.sleep(state.token_latency)
+                chunk = {'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            if payload.get('stream_options', {}).get('include_usage'):
+                usage = {'choices': [], 'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens)}}
+                self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode('utf-8'))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return Handler
+
+def start_server(port=0, dimensions=3072, latency=0.3, per_input_latency=0.002, rps=0, chat_tokens=200, token_latency=0.02, error_rate=0.0):
+    """ 백그라운드 스레드에서 스텁 서버를 시작하고 (server, state)를 반환. port=0이면 빈 포트를 사용 """
+    state = StubState(dimensions, latency, per_input_latency, rps, chat_tokens, token_latency, error_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dimensions', type=int, default=3072)
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds per request')
+    parser.add_argument('--per-input-latency', type=float, default=0.002, help='extra seconds per input')
+    parser.add_argument('--rps', type=int, default=0, help='requests per second before 429 (0 = unlimited)')
+    parser.add_argument('--chat-tokens', type=int, default=200, help='tokens per chat answer')
+    parser.add_argument('--token-latency', type=float, default=0.02, help='seconds per generated chat token')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server, _ = start_server(args.port, args.dimensions, args.latency, args.per_input_latency, args.rps, args.chat_tokens, args.token_latency, args.error_rate)
+    print(f"Stub OpenAI server listening on http://127.0.0.1:{server.server_address[1]}/v1/embeddings and /v1/chat/completions")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
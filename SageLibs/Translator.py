@@ -1,8 +1,42 @@
+import re
+import hashlib
 import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from SageLibs.config import OLLAMA_MODEL, TRANSLATE_CONCURRENCY, TRANSLATE_BATCH_MAX_CHARS, TRANSLATE_BATCH_MAX_BLOCKS
 
-def translate_to_english(text):
-    from SageLibs.web_requests import get_chat_response_ollama 
+TRANSLATION_CACHE_FILE = 'SageTranslations.db'
+# 디스크 캐시의 최대 항목 수 (넘으면 오래된 것부터 삭제), 메모리 캐시의 항목 수
+TRANSLATION_CACHE_MAX_ENTRIES = 200000
+TRANSLATION_MEMORY_CACHE_SIZE = 20000
+
+# 영어/코드로 보는 문자: 출력 가능한 ASCII와 공백. 그 외 문자가 하나라도 있으면 번역 대상
+NON_ENGLISH = re.compile(r'[^\x20-\x7e\s]')
+BLOCK_MARKER = re.compile(r'^<<<(\d+)>>>[ \t]*$', re.MULTILINE)
+
+_executor = ThreadPoolExecutor(max_workers=TRANSLATE_CONCURRENCY, thread_name_prefix='SageTranslate')
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+class TranslationError(Exception):
+    pass
+
+def request_translation(message):
+    from SageLibs.web_requests import get_chat_response_ollama
+
+    result = get_chat_response_ollama(message)
+    # get_chat_response_ollama는 실패를 'Error: ...' 문자열로 돌려준다. 오류를 번역 결과로 캐시하지 않도록 예외로 바꾼다
+    if result.startswith("Error:") or result.startswith("Unexpected response structure"):
+        raise TranslationError(result)
+    return result
 
+def translate_to_english(text):
     message = f"""Translate all non-English text into English in the article below.
 Follow these rules strictly:
 1. Maintain the original text structure, including spaces and line breaks.
@@ -13,102 +47,188 @@ Follow these rules strictly:
 ---
 {text}
 """
-    
-    result = get_chat_response_ollama(message)
+
+    result = request_translation(message)
     result = '\n'.join(line for line in result.splitlines() if line.strip())
     return result
 
+def translate_packed(blocks):
+    """ 여러 블록을 구분 표시(<<<번호>>>)와 함께 한 번에 번역하고 블록별 결과를 반환.
+    응답에서 구분 표시가 빠지면 블록마다 따로 번역한다 """
+    if len(blocks) == 1:
+        return [translate_to_english(blocks[0])]
+
+    packed = '\n'.join(f"<<<{i}>>>\n{block}" for i, block in enumerate(blocks))
+    message = f"""Translate all non-English text into English in the sections below.
+Each section starts with a marker line such as <<<0>>>.
+Follow these rules strictly:
+1. Keep every marker line exactly as it is, on its own line, in the same order.
+2. Maintain the original text structure of each section, including spaces and line breaks.
+3. If you cannot translate any part, return that part unchanged.
+4. Do not add any explanations, comments, or notes about the translation.
+5. Only return the marker lines and the translated text, nothing else.
+---
+{packed}
+"""
+    result = request_translation(message)
+    parts = BLOCK_MARKER.split(result)
+    # split 결과: [머리말, 번호, 본문, 번호, 본문, ...]
+    translated = {}
+    for number, body in zip(parts[1::2], parts[2::2]):
+        translated[int(number)] = '\n'.join(line for line in body.splitlines() if line.strip())
+    if sorted(translated) != list(range(len(blocks))) or any(not translated[i] for i in translated):
+        logging.warning(f"Packed translation returned {len(translated)} of {len(blocks)} sections, translating blocks one by one")
+        return [translate_to_english(block) for block in blocks]
+    return [translated[i] for i in range(len(blocks))]
+
 def is_english_or_code(text):
-    for i, char in enumerate(text):
-        if char.isspace() or char in '.,;:!?-_()[]{}\'"`+*&^%$#@~<>|/\\=':
-            continue
-        if not (char.isascii() and char.isalnum()):
-            logging.info(f"Non-English character detected: '{char}' (Unicode: U+{ord(char):04X}) at position {i} in text: '{text}'")
-            return False
-    return True
+    match = NON_ENGLISH.search(text)
+    if match is None:
+        return True
+    char = match.group()
+    logging.debug(f"Non-English character detected: '{char}' (Unicode: U+{ord(char):04X}) at position {match.start()} in text: '{text}'")
+    return False
 
-def translate_lines(lines):
-    lines = lines.splitlines() if isinstance(lines, str) else lines
-    translated_content = []
-    lines_to_translate = []
-    leading_spaces = []
+def get_connection():
+    global _initialized
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(TRANSLATION_CACHE_FILE, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        _local.connection = connection
 
-    for line_number, line in enumerate(lines, 1):
-        stripped_line = line.strip()
-        if stripped_line:  # Process only non-empty lines
-            if is_english_or_code(stripped_line):
-                # If English or code, translate previously collected non-English lines
-                if lines_to_translate:
-                    try:
-                        translated_text = translate_to_english('\n'.join(lines_to_translate))
-                        translated_lines = translated_text.split('\n')
-                        for i, translated_line in enumerate(translated_lines):
-                            if i < len(leading_spaces):
-                                translated_content.append(leading_spaces[i] + translated_line)
-                            else:
-                                translated_content.append(translated_line)
-                        logging.debug(f"Lines {line_number-len(lines_to_translate)}-{line_number-1} (Translated):\n{translated_text}")
-                    except Exception as e:
-                        logging.error(f"Translation error: {str(e)}")
-                        # If an error occurs, add the original text
-                        for i, original_line in enumerate(lines_to_translate):
-                            translated_content.append(leading_spaces[i] + original_line)
-                        logging.debug(f"Lines {line_number-len(lines_to_translate)}-{line_number-1} (Original kept due to error)")
-                    logging.debug(f"Original:\n{chr(10).join(lines_to_translate)}")
-                    lines_to_translate = []
-                    leading_spaces = []
-                
-                translated_content.append(line)
-                logging.debug(f"Line {line_number} (Original): {line}")
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                with connection:
+                    connection.execute('CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT NOT NULL)')
+                _initialized = True
+    return connection
+
+def get_block_key(block):
+    return hashlib.sha256(f"{OLLAMA_MODEL}\0{block}".encode('utf-8', errors='replace')).hexdigest()
+
+def remember(key, translation):
+    with _memory_cache_lock:
+        _memory_cache[key] = translation
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > TRANSLATION_MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+def get_cached_translations(keys):
+    """ 메모리, 디스크 순으로 번역 결과를 찾아 {key: 번역}을 반환 """
+    found = {}
+    missing = []
+    with _memory_cache_lock:
+        for key in keys:
+            if key in _memory_cache:
+                _memory_cache.move_to_end(key)
+                found[key] = _memory_cache[key]
             else:
-                leading_space = line[:len(line) - len(line.lstrip())]
-                lines_to_translate.append(stripped_line)
-                leading_spaces.append(leading_space)
-        else:
-            # Translate collected non-English lines when encountering an empty line
-            if lines_to_translate:
-                try:
-                    translated_text = translate_to_english('\n'.join(lines_to_translate))
-                    translated_lines = translated_text.split('\n')
-                    for i, translated_line in enumerate(translated_lines):
-                        if i < len(leading_spaces):
-                            translated_content.append(leading_spaces[i] + translated_line)
-                        else:
-                            translated_content.append(translated_line)
-                    logging.debug(f"Lines {line_number-len(lines_to_translate)}-{line_number-1} (Translated):\n{translated_text}")
-                except Exception as e:
-                    logging.error(f"Translation error: {str(e)}")
-                    # If an error occurs, add the original text
-                    for i, original_line in enumerate(lines_to_translate):
-                        translated_content.append(leading_spaces[i] + original_line)
-                    logging.debug(f"Lines {line_number-len(lines_to_translate)}-{line_number-1} (Original kept due to error)")
-                logging.debug(f"Original:\n{chr(10).join(lines_to_translate)}")
-                lines_to_translate = []
-                leading_spaces = []
-            
-            translated_content.append(line)
-            logging.debug(f"Line {line_number} (Empty)")
-
-    # Handle any remaining non-English lines at the end
-    if lines_to_translate:
+                missing.append(key)
+
+    connection = get_connection()
+    for start in range(0, len(missing), 500):
+        part = missing[start:start + 500]
+        placeholders = ','.join('?' * len(part))
+        for key, translation in connection.execute(f'SELECT key, translation FROM translations WHERE key IN ({placeholders})', part):
+            found[key] = translation
+            remember(key, translation)
+    return found
+
+def cache_translations(translations):
+    connection = get_connection()
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO translations (key, translation) VALUES (?, ?)', translations.items())
+        count = connection.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        if count > TRANSLATION_CACHE_MAX_ENTRIES:
+            # rowid는 추가 순서이므로 가장 오래된 항목부터 지운다
+            connection.execute('DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY rowid LIMIT ?)', (count - TRANSLATION_CACHE_MAX_ENTRIES,))
+    for key, translation in translations.items():
+        remember(key, translation)
+
+def pack_blocks(blocks):
+    """ 번역할 블록들을 글자 수/블록 수 한도 안에서 묶는다 """
+    pack = []
+    pack_chars = 0
+    for block in blocks:
+        if pack and (pack_chars + len(block) > TRANSLATE_BATCH_MAX_CHARS or len(pack) >= TRANSLATE_BATCH_MAX_BLOCKS):
+            yield pack
+            pack = []
+            pack_chars = 0
+        pack.append(block)
+        pack_chars += len(block)
+    if pack:
+        yield pack
+
+def translate_blocks(blocks):
+    """ 블록(영어가 아닌 줄들을 '\\n'으로 이은 것)마다의 번역을 {블록: 번역}으로 반환.
+    캐시에 없는 블록만 묶어서 Ollama에 동시에 요청하고, 실패한 블록은 결과에 넣지 않는다 """
+    keys = {block: get_block_key(block) for block in set(blocks)}
+    cached = get_cached_translations(list(keys.values()))
+    results = {block: cached[key] for block, key in keys.items() if key in cached}
+    missing = [block for block in keys if block not in results]
+    if not missing:
+        return results
+
+    futures = [(pack, _executor.submit(translate_packed, pack)) for pack in pack_blocks(missing)]
+    translated = {}
+    for pack, future in futures:
         try:
-            translated_text = translate_to_english('\n'.join(lines_to_translate))
-            translated_lines = translated_text.split('\n')
-            for i, translated_line in enumerate(translated_lines):
-                if i < len(leading_spaces):
-                    translated_content.append(leading_spaces[i] + translated_line)
-                else:
-                    translated_content.append(translated_line)
-            logging.debug(f"Lines {line_number-len(lines_to_translate)+1}-{line_number} (Translated):\n{translated_text}")
+            for block, translation in zip(pack, future.result()):
+                translated[keys[block]] = translation
+                results[block] = translation
         except Exception as e:
             logging.error(f"Translation error: {str(e)}")
-            # If an error occurs, add the original text
-            for i, original_line in enumerate(lines_to_translate):
-                translated_content.append(leading_spaces[i] + original_line)
-            logging.debug(f"Lines {line_number-len(lines_to_translate)+1}-{line_number} (Original kept due to error)")
-        logging.debug(f"Original:\n{chr(10).join(lines_to_translate)}")
+    if translated:
+        cache_translations(translated)
+    logging.debug(f"Translated {len(missing)} blocks ({len(keys) - len(missing)} cached)")
+    return results
+
+def split_blocks(lines):
+    """ 줄 목록을 ('keep', 줄) 또는 ('translate', [(앞 공백, 내용)]) 항목으로 나눈다.
+    영어/코드 줄이나 빈 줄이 나오면 그때까지 모은 영어가 아닌 줄을 한 블록으로 묶는다 """
+    items = []
+    pending = []
+    for line in lines:
+        stripped_line = line.strip()
+        if stripped_line and not is_english_or_code(stripped_line):
+            pending.append((line[:len(line) - len(line.lstrip())], stripped_line))
+            continue
+        if pending:
+            items.append(('translate', pending))
+            pending = []
+        items.append(('keep', line))
+    if pending:
+        items.append(('translate', pending))
+    return items
+
+def translate_texts(texts):
+    """ 여러 텍스트를 한꺼번에 번역. 모든 텍스트의 블록을 모아 한 번에 캐시를 찾고 요청한다 """
+    split_texts = [split_blocks(text.splitlines() if isinstance(text, str) else text) for text in texts]
+    blocks = ['\n'.join(content for _, content in value) for items in split_texts for kind, value in items if kind == 'translate']
+    translations = translate_blocks(blocks) if blocks else {}
 
-    return '\n'.join(translated_content)
+    results = []
+    for items in split_texts:
+        translated_content = []
+        for kind, value in items:
+            if kind == 'keep':
+                translated_content.append(value)
+                continue
+            leading_spaces = [leading for leading, _ in value]
+            translation = translations.get('\n'.join(content for _, content in value))
+            if translation is None:
+                # 번역에 실패하면 원문을 그대로 둔다
+                translated_content.extend(leading + content for leading, content in value)
+                continue
+            for i, translated_line in enumerate(translation.split('\n')):
+                translated_content.append((leading_spaces[i] if i < len(leading_spaces) else '') + translated_line)
+        results.append('\n'.join(translated_content))
+    return results
+
+def translate_lines(lines):
+    return translate_texts([lines])[0]
 
 def translate_file(file_path):
     try:
@@ -117,4 +237,4 @@ def translate_file(file_path):
         return translate_lines(content)
     except IOError as e:
         logging.error(f"File reading error: {str(e)}")
-        return f"Error: Failed to read file - {str(e)}"
\ No newline at end of file
+        return f"Error: Failed to read file - {str(e)}"
@@ -1,6 +1,7 @@
 from .config import load_settings, get_settings, update_settings, EMBEDDINGS_FILE, SETTINGS_FILE
 from .web_requests import get_embedding, get_chat_response
-from .utilities import load_embeddings, get_relevant_documents, get_file_paths, read_file, hash_content, diff_between_branches
+from .utilities import load_embeddings, get_relevant_documents, get_file_paths, read_file, hash_content
+from .git_repo import diff_between_branches
 
 __all__ = [
     'load_settings',
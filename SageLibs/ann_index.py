@@ -0,0 +1,202 @@
+import os
+import logging
+import numpy as np
+from .config import get_setting, EMBEDDINGS_ANN_FILE, ANN_MIN_ROWS, ANN_NPROBE, ANN_PQ_SUBVECTORS, ANN_TRAIN_SAMPLE, ANN_RETRAIN_GROWTH
+from .embedding_store import get_store_dir, write_atomic
+
+KMEANS_ITERATIONS = 10
+# PQ 부분 벡터 하나의 코드 수 (uint8)
+PQ_CODES = 256
+MIN_LISTS = 16
+MAX_LISTS = 4096
+# 목록 하나에 학습 표본이 이 정도는 들어가도록 목록 수를 제한
+MIN_SAMPLES_PER_LIST = 32
+# 학습/인코딩에서 한 번에 float32로 올리는 행 수
+ENCODE_BLOCK_ROWS = 16384
+
+def get_ann_file(folder):
+    return os.path.join(get_store_dir(folder), EMBEDDINGS_ANN_FILE)
+
+def is_ann_enabled(folder):
+    """ 설정 ann_folders에 든 폴더인지 """
+    folder = os.path.normcase(os.path.abspath(folder))
+    return any(os.path.normcase(os.path.abspath(path)) == folder for path in get_setting('ann_folders', []) or [] if path)
+
+def get_nprobe():
+    try:
+        return max(1, int(get_setting('ann_nprobe', ANN_NPROBE) or ANN_NPROBE))
+    except (TypeError, ValueError):
+        return ANN_NPROBE
+
+def get_record_keys(records):
+    """ 레코드마다 (세그먼트 번호, 세그먼트 안의 행)을 int64 하나로 묶은 키. 저장소가 바뀌어도 같은 청크는 같은 키다 """
+    return np.array([(int(record['segment'].split('-')[1]) << 32) | record['row'] for record in records], dtype=np.int64)
+
+def match_keys(keys, record_keys):
+    """ 레코드 키마다 색인 항목 번호를 찾아 (항목 번호 배열, 찾았는지 마스크)를 반환 """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(len(record_keys), dtype=bool)
+    order = np.argsort(keys, kind='stable')
+    positions = np.minimum(np.searchsorted(keys[order], record_keys), len(keys) - 1)
+    found = keys[order][positions] == record_keys
+    return order[positions[found]], found
+
+def get_subvector_count(dimension):
+    """ 차원을 나누어떨어지게 하는 ANN_PQ_SUBVECTORS 이하의 가장 큰 부분 벡터 수 """
+    for count in range(min(ANN_PQ_SUBVECTORS, dimension), 0, -1):
+        if dimension % count == 0:
+            return count
+    return 1
+
+def assign(data, centroids):
+    """ 행마다 가장 가까운(L2) 센트로이드 번호 """
+    norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), ENCODE_BLOCK_ROWS):
+        distances = norms - 2 * (data[start:start + ENCODE_BLOCK_ROWS] @ centroids.T)
+        labels[start:start + ENCODE_BLOCK_ROWS] = distances.argmin(axis=1)
+    return labels
+
+def kmeans(data, k, rng):
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = assign(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        nonempty = counts > 0
+        # 번호순으로 정렬한 뒤 구간별 합으로 새 센트로이드를 구한다. 빈 센트로이드는 임의의 행으로 다시 뽑는다
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(data[order], starts, axis=0) / counts[nonempty, None]
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+def train(index, rng):
+    """ 표본 행으로 코스 센트로이드(IVF 목록)와 부분 벡터별 PQ 코드북을 학습 """
+    rows = np.sort(rng.choice(len(index), min(ANN_TRAIN_SAMPLE, len(index)), replace=False))
+    sample = index.get_vectors(rows)
+    list_count = int(np.clip(4 * np.sqrt(len(index)), MIN_LISTS, MAX_LISTS))
+    list_count = max(1, min(list_count, len(sample) // MIN_SAMPLES_PER_LIST))
+    centroids = kmeans(sample, list_count, rng)
+
+    subvectors = get_subvector_count(sample.shape[1])
+    width = sample.shape[1] // subvectors
+    codebooks = np.zeros((subvectors, PQ_CODES, width), dtype=np.float32)
+    for m in range(subvectors):
+        codebook = kmeans(np.ascontiguousarray(sample[:, m * width:(m + 1) * width]), PQ_CODES, rng)
+        codebooks[m, :len(codebook)] = codebook
+        # 표본이 PQ_CODES보다 적으면 남는 코드는 쓰이지 않도록 먼 곳에 둔다
+        codebooks[m, len(codebook):] = np.float32(1e6)
+    return centroids, codebooks
+
+def encode(index, rows, centroids, codebooks):
+    """ 행들의 IVF 목록 번호와 PQ 코드 """
+    subvectors, _, width = codebooks.shape
+    lists = np.empty(len(rows), dtype=np.int32)
+    codes = np.empty((len(rows), subvectors), dtype=np.uint8)
+    for start in range(0, len(rows), ENCODE_BLOCK_ROWS):
+        vectors = index.get_vectors(rows[start:start + ENCODE_BLOCK_ROWS])
+        lists[start:start + len(vectors)] = assign(vectors, centroids)
+        for m in range(subvectors):
+            codes[start:start + len(vectors), m] = assign(np.ascontiguousarray(vectors[:, m * width:(m + 1) * width]), codebooks[m])
+    return lists, codes
+
+def load_ann_arrays(folder):
+    try:
+        with np.load(get_ann_file(folder)) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Could not read ANN index for {folder}: {str(e)}")
+        return None
+
+def load_ann_index(index):
+    """ 폴더의 ANN 색인을 FolderIndex의 레코드에 맞춰 읽는다. 색인 파일이 없으면 None """
+    arrays = load_ann_arrays(index.folder)
+    if arrays is None:
+        return None
+    return AnnIndex(arrays, index.records)
+
+def update_ann_index(index, force=False):
+    """ FolderIndex의 ANN 색인을 만들거나 갱신해 저장하고 AnnIndex를 반환.
+    이미 색인에 있는 청크는 코드를 그대로 쓰고 새 청크만 인코딩한다. 처음이거나 행 수가 학습 때와 크게 달라졌으면 다시 학습한다 """
+    if len(index) < ANN_MIN_ROWS:
+        logging.debug(f"Skipping ANN index for {index.folder}: {len(index)} rows")
+        return None
+
+    record_keys = get_record_keys(index.records)
+    previous = None if force else load_ann_arrays(index.folder)
+    if previous is not None:
+        dimension = previous['centroids'].shape[1]
+        trained_rows = int(previous['trained_rows'])
+        if dimension != index.dimensions or not trained_rows / ANN_RETRAIN_GROWTH <= len(index) <= trained_rows * ANN_RETRAIN_GROWTH:
+            logging.info(f"Retraining ANN index for {index.folder}: {trained_rows} -> {len(index)} rows")
+            previous = None
+
+    rng = np.random.default_rng(0)
+    if previous is None:
+        centroids, codebooks = train(index, rng)
+        trained_rows = len(index)
+        entries, found = np.zeros(0, dtype=np.int64), np.zeros(len(index), dtype=bool)
+    else:
+        centroids, codebooks = previous['centroids'], previous['codebooks']
+        entries, found = match_keys(previous['keys'], record_keys)
+
+    lists = np.empty(len(index), dtype=np.int32)
+    codes = np.empty((len(index), codebooks.shape[0]), dtype=np.uint8)
+    if previous is not None:
+        lists[found] = previous['lists'][entries]
+        codes[found] = previous['codes'][entries]
+    missing = np.flatnonzero(~found)
+    if len(missing):
+        lists[missing], codes[missing] = encode(index, missing, centroids, codebooks)
+
+    arrays = {
+        'keys': record_keys,
+        'lists': lists,
+        'codes': codes,
+        'centroids': centroids,
+        'codebooks': codebooks,
+        'trained_rows': np.int64(trained_rows)
+    }
+    write_atomic(get_ann_file(index.folder), lambda f: np.savez(f, **arrays))
+    logging.info(f"ANN index saved: {index.folder} ({len(index)} rows, {len(missing)} encoded, {len(centroids)} lists, {codebooks.shape[0]} subvectors)")
+    return AnnIndex(arrays, index.records)
+
+class AnnIndex:
+    """ IVF + PQ 근사 검색. 코스 센트로이드로 나눈 목록마다 청크의 PQ 코드를 두고,
+    질문과 가까운 목록 nprobe개만 코드로 점수를 어림한다. 색인 이후에 추가된 청크(uncovered)는 항상 후보에 넣는다 """
+
+    def __init__(self, arrays, records):
+        self.centroids = arrays['centroids']
+        self.centroid_norms = (self.centroids ** 2).sum(axis=1)
+        self.codebooks = arrays['codebooks']
+        entries, found = match_keys(arrays['keys'], get_record_keys(records))
+        lists = arrays['lists'][entries]
+        order = np.argsort(lists, kind='stable')
+        # 목록 번호순으로 정렬한 항목의 레코드 행 번호와 PQ 코드, 목록별 시작 위치
+        self.rows = np.flatnonzero(found)[order]
+        self.codes = arrays['codes'][entries][order]
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=len(self.centroids)))))
+        self.uncovered = np.flatnonzero(~found)
+        self.coverage = float(found.mean()) if len(found) else 1.0
+
+    def search(self, query, count, nprobe, mask):
+        """ 정규화된 질문 벡터에 대해 근사 점수가 높은 후보 행 번호(최대 count개)와 색인에 없는 행 번호. 정확한 유사도로 다시 정렬해서 쓴다 """
+        nprobe = min(nprobe, len(self.centroids))
+        distances = self.centroid_norms - 2 * (self.centroids @ query)
+        probe = np.argpartition(distances, nprobe - 1)[:nprobe]
+        selected = np.concatenate([np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in probe])
+        selected = selected[mask[self.rows[selected]]]
+
+        if len(selected) > count:
+            # 부분 벡터별로 질문과 모든 코드의 내적표를 만든 뒤 코드로 찾아 더한다
+            subvectors = len(self.codebooks)
+            table = np.einsum('mkd,md->mk', self.codebooks, query.reshape(subvectors, -1))
+            approximate = table[np.arange(subvectors), self.codes[selected]].sum(axis=1)
+            selected = selected[np.argpartition(-approximate, count - 1)[:count]]
+
+        return np.concatenate([self.rows[selected], self.uncovered[mask[self.uncovered]]])
@@ -0,0 +1,105 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .config import get_setting, ANALYSIS_CONCURRENCY, ANALYSIS_BEFORE_MAX_TOKENS, EMBEDDING_MAX_INPUT_TOKENS
+from .web_requests import get_chat_response
+from .embedding_pipeline import embed_documents
+from .utilities import get_relevant_documents, truncate_tokens, count_tokens
+from .git_repo import get_base_branch, get_base_revision, get_file_diffs, read_file_at
+
+def embed_diffs(file_diffs):
+    """ 파일별 diff의 임베딩을 한 번에 배치로 만든다. {번호: (embedding, error)} """
+    results = {}
+
+    def on_result(key, embedding, error):
+        results[key] = (embedding, error)
+
+    # 아주 긴 diff도 검색 질의로 쓸 수 있도록 입력 한도에 맞춰 자른다
+    items = [(i, truncate_tokens(f"Filename:{file_diff['path']}\n\nDiff:\n{file_diff['text']}", EMBEDDING_MAX_INPUT_TOKENS))
+             for i, file_diff in enumerate(file_diffs)]
+    embed_documents(items, on_result)
+    return results
+
+def get_before_content(folder, base_revision, file_diff):
+    """ 변경 전 파일이 작으면 전체 내용을, 아니면 None (새 파일, 삭제된 파일은 diff에 이미 전체가 있다) """
+    if file_diff['status'] not in ('modified', 'renamed') or not file_diff['old_path']:
+        return None
+    content = read_file_at(folder, base_revision, file_diff['old_path'])
+    if content is None or count_tokens(content) > ANALYSIS_BEFORE_MAX_TOKENS:
+        return None
+    return content
+
+def review_file(folder, question, base_revision, file_diff, embedding, on_text=None):
+    """ 파일 하나의 리뷰. on_text를 주면 답변을 스트리밍으로 받아 조각마다 on_text(text)를 부른다 """
+    file_name = file_diff['path']
+    relevant_docs = get_relevant_documents([folder], embedding)
+    user_message = f"Question: {question}\n\nFilename: {file_name}\n\nDiff:\n{file_diff['text']}\n\nContext:\n{json.dumps(relevant_docs, ensure_ascii=False, indent=2)}"
+    before = get_before_content(folder, base_revision, file_diff)
+    if before is not None:
+        user_message += f"\n\nBefore (full file before the change):\n{before}"
+    if on_text is None:
+        return get_chat_response(user_message)
+    review = []
+    for text in get_chat_response(user_message, stream=True):
+        review.append(text)
+        on_text(text)
+    return ''.join(review)
+
+def analyze_changes(folder, analysis_type, question, progress=None):
+    """ 변경된 파일마다 리뷰를 만들어 파일 순서대로 이어 붙인 답변을 반환.
+    기준 브랜치는 한 번 확인하고, git diff는 한 번 실행해 파일별 hunk로 나누고, diff 임베딩은 한 번에 배치로 만든 뒤,
+    파일별 리뷰는 analysis_concurrency개까지 동시에 요청한다. 실패한 파일은 답변에 오류를 남기고, 모든 파일이 실패하면 ValueError.
+    progress(jobs.Job)를 주면 리뷰를 스트리밍으로 받아 생성되는 대로 progress.write()로 내보낸다 """
+    base_branch = get_base_branch(folder)
+    base_revision = get_base_revision(analysis_type, base_branch)
+    file_diffs = get_file_diffs(folder, analysis_type, base_branch)
+    if not file_diffs:
+        raise ValueError("No changes to analyze or error in processing all files.")
+    if progress is not None:
+        progress.set_total(len(file_diffs))
+
+    embeddings = embed_diffs(file_diffs)
+    parts = [None] * len(file_diffs)
+    max_workers = int(get_setting('analysis_concurrency', ANALYSIS_CONCURRENCY))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='SageReview')
+    try:
+        futures = {}
+        for i, file_diff in enumerate(file_diffs):
+            file_name = file_diff['path']
+            embedding, error = embeddings.get(i, (None, "Embedding was not generated"))
+            if error is not None:
+                logging.error(f"Error embedding diff of {file_name}: {error}")
+                parts[i] = (file_name, None, error)
+                if progress is not None:
+                    progress.advance(file_name, error)
+                continue
+            on_text = (lambda text, file_name=file_name: progress.write(file_name, text)) if progress is not None else None
+            futures[executor.submit(review_file, folder, question, base_revision, file_diff, embedding, on_text)] = i
+
+        for future in as_completed(futures):
+            i = futures[future]
+            file_name = file_diffs[i]['path']
+            try:
+                parts[i] = (file_name, future.result(), None)
+            except Exception as e:
+                logging.error(f"Error processing file {file_name}: {str(e)}", exc_info=True)
+                parts[i] = (file_name, None, str(e))
+            if progress is not None:
+                progress.advance(file_name, parts[i][2])
+    finally:
+        # 취소된 경우 아직 시작하지 않은 리뷰는 요청하지 않는다
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # 성공한 리뷰가 하나도 없으면 오류만 담긴 답변을 저장하지 않도록 작업을 실패로 끝낸다
+    failed = [(file_name, error) for file_name, _, error in parts if error is not None]
+    if len(failed) == len(parts):
+        raise ValueError(f"All {len(parts)} file reviews failed, first error ({failed[0][0]}): {failed[0][1]}")
+
+    answer = []
+    for file_name, review, error in parts:
+        if error is not None:
+            answer.append(f"# File: {file_name}\n\n> Error processing {file_name}: {error}\n\n")
+        else:
+            answer.append(f"# File: {file_name}\n\n{review}\n\n")
+    return ''.join(answer)
@@ -0,0 +1,145 @@
+import re
+import ast
+import logging
+from .config import CHUNK_MAX_TOKENS
+from .utilities import count_tokens, count_tokens_batch
+
+# 청크 분할 규칙이 바뀌면 올려서, 이전 규칙으로 만든 임베딩을 다시 생성하도록 한다
+CHUNKER_VERSION = 1
+
+MARKDOWN_EXTENSIONS = ('.md', '.markdown')
+BRACE_EXTENSIONS = ('.js', '.jsx', '.ts', '.tsx', '.vue', '.java', '.c', '.cpp', '.h', '.hpp', '.cs', '.swift', '.go', '.kt', '.php', '.m', '.mm', '.css', '.rs', '.scala', '.dart')
+MARKDOWN_HEADING = re.compile(r'^#{1,6}\s')
+LINE_PATTERN = re.compile(r'[^\n]*\n|[^\n]+$')
+
+def chunk_file(filename, content, max_tokens=CHUNK_MAX_TOKENS):
+    """ 파일을 임베딩 단위 청크로 나눈다. 각 청크는 {'chunk', 'start_line', 'end_line', 'content'} 이며
+    줄 번호는 1부터 시작하고, 모든 청크의 content를 이어 붙이면 원본과 같다 """
+    lines = split_lines(content)
+    if not lines:
+        return [{'chunk': 0, 'start_line': 1, 'end_line': 1, 'content': content}]
+
+    if count_tokens(content) <= max_tokens:
+        sections = [(0, len(lines))]
+    else:
+        sections = split_sections(filename, lines)
+
+    spans = []
+    for start, end in merge_sections(lines, sections, max_tokens):
+        spans.extend(split_oversized(lines, start, end, max_tokens))
+
+    return [{
+        'chunk': number,
+        'start_line': start + 1,
+        'end_line': end,
+        'content': ''.join(lines[start:end])
+    } for number, (start, end) in enumerate(spans)]
+
+def split_lines(content):
+    """ '\n' 기준으로만 줄을 나눈다 (줄 끝 문자 유지). str.splitlines와 달리 \f 등에서 나누지 않아 줄 번호가 편집기와 같다 """
+    return LINE_PATTERN.findall(content)
+
+def split_sections(filename, lines):
+    """ 파일 형식에 맞는 의미 단위 경계로 [start, end) 줄 구간 목록을 만든다 """
+    lower = filename.lower()
+    try:
+        if lower.endswith('.py'):
+            return python_sections(lines)
+        if lower.endswith('.pdf'):
+            # pdf_to_text는 페이지 사이에 '\f' 한 줄을 넣는다
+            return boundary_sections(lines, [i for i, line in enumerate(lines) if line.startswith('\f')])
+        if lower.endswith(MARKDOWN_EXTENSIONS):
+            return markdown_sections(lines)
+        if lower.endswith(BRACE_EXTENSIONS):
+            return brace_sections(lines)
+    except Exception as e:
+        logging.debug(f"Structured split failed for {filename}, using indentation: {str(e)}")
+    return indentation_sections(lines)
+
+def boundary_sections(lines, boundaries):
+    starts = sorted(set([0] + [b for b in boundaries if 0 < b < len(lines)]))
+    return [(start, end) for start, end in zip(starts, starts[1:] + [len(lines)])]
+
+def python_sections(lines):
+    """ 최상위 문장과 클래스의 메서드 단위로 나누고, 데코레이터와 바로 위 주석은 정의에 붙인다 """
+    tree = ast.parse(''.join(lines))
+    nodes = list(tree.body)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            nodes.extend(child for child in node.body if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)))
+
+    boundaries = []
+    for node in nodes:
+        start = node.lineno - 1
+        for decorator in getattr(node, 'decorator_list', []):
+            start = min(start, decorator.lineno - 1)
+        while start > 0 and lines[start - 1].lstrip().startswith('#'):
+            start -= 1
+        boundaries.append(start)
+    return boundary_sections(lines, boundaries)
+
+def markdown_sections(lines):
+    boundaries = []
+    in_code = False
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith('```'):
+            in_code = not in_code
+        elif not in_code and MARKDOWN_HEADING.match(line):
+            boundaries.append(i)
+    return boundary_sections(lines, boundaries)
+
+def brace_sections(lines):
+    """ 중괄호 깊이가 0으로 돌아오는 지점을 블록 끝으로 본다 (문자열/주석 안의 괄호는 근사적으로 무시) """
+    boundaries = []
+    depth = 0
+    for i, line in enumerate(lines):
+        stripped = re.sub(r'//.*|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', '', line)
+        before = depth
+        depth = max(0, depth + stripped.count('{') - stripped.count('}'))
+        if before > 0 and depth == 0:
+            boundaries.append(i + 1)
+    return boundary_sections(lines, boundaries)
+
+def indentation_sections(lines):
+    """ 들여쓰기 없는 줄이 빈 줄 다음에 나오면 새 블록의 시작으로 본다 """
+    boundaries = []
+    for i in range(1, len(lines)):
+        line = lines[i]
+        if line.strip() and not line[0].isspace() and not lines[i - 1].strip():
+            boundaries.append(i)
+    return boundary_sections(lines, boundaries)
+
+def merge_sections(lines, sections, max_tokens):
+    """ 작은 구간들을 토큰 예산 안에서 이웃과 합친다 """
+    merged = []
+    current_start, current_end, current_tokens = None, None, 0
+    section_tokens = count_tokens_batch([''.join(lines[start:end]) for start, end in sections])
+    for (start, end), tokens in zip(sections, section_tokens):
+        if current_start is not None and current_tokens + tokens <= max_tokens:
+            current_end = end
+            current_tokens += tokens
+            continue
+        if current_start is not None:
+            merged.append((current_start, current_end))
+        current_start, current_end, current_tokens = start, end, tokens
+    if current_start is not None:
+        merged.append((current_start, current_end))
+    return merged
+
+def split_oversized(lines, start, end, max_tokens):
+    """ 예산을 넘는 구간을 줄 단위로 나눈다 """
+    if end - start <= 1 or count_tokens(''.join(lines[start:end])) <= max_tokens:
+        return [(start, end)]
+
+    spans = []
+    span_start = start
+    span_tokens = 0
+    line_tokens = count_tokens_batch(lines[start:end])
+    for i, tokens in zip(range(start, end), line_tokens):
+        if i > span_start and span_tokens + tokens > max_tokens:
+            spans.append((span_start, i))
+            span_start = i
+            span_tokens = 0
+        span_tokens += tokens
+    spans.append((span_start, end))
+    return spans
@@ -2,6 +2,8 @@ import json
 import logging
 
 EMBEDDINGS_MODEL = 'text-embedding-3-large'
+# EMBEDDINGS_MODEL의 기본 차원. 설정 embedding_dimensions를 주면 API에 더 짧은 벡터를 요청한다
+EMBEDDINGS_DIMENSIONS = 3072
 CHAT_MODEL = 'gpt-4o-2024-08-06'
 # CHAT_MODEL = 'gpt-4o-mini-2024-07-18'
 TOKEN_COUNTER_MODEL = 'gpt-4'
@@ -12,24 +14,136 @@ CHAT_API_URL = "https://api.openai.com/v1/chat/completions"
 CLAUDE_API_URL = "https://api.anthropic.com/v1/messages"
 CLAUDE_MODEL = 'claude-3-sonnet-20240229' 
 
+# 번역(use_translator)에 쓰는 로컬 Ollama
+OLLAMA_API_URL = "http://localhost:11434/api/generate"
+OLLAMA_MODEL = 'gemma2'
+
 EMBEDDINGS_FILE = 'embeddings.jsonl'
+# 바이너리 임베딩 저장소: 폴더마다 EMBEDDINGS_DIR 아래에 매니페스트와 추가 전용 세그먼트(행렬 .npy + 본문 .bin)를 저장
+EMBEDDINGS_DIR = 'SageIndex'
+EMBEDDINGS_MANIFEST_FILE = 'manifest.json'
+# 세그먼트 도입 이전 형식의 파일 이름 (자동 변환용)
+EMBEDDINGS_MATRIX_FILE = 'embeddings.npy'
+EMBEDDINGS_METADATA_FILE = 'metadata.json'
+EMBEDDINGS_CONTENT_FILE = 'contents.bin'
+# 근사 최근접 이웃(ANN) 색인 파일. 저장소 디렉터리에 세그먼트와 함께 둔다
+EMBEDDINGS_ANN_FILE = 'ann.npz'
 SETTINGS_FILE = 'SageSettings.json'
 
 SIMILARITY_THRESHOLD = 0.30
+# 답변 캐시(answer_cache): 새 질문과 이전 질문의 임베딩 유사도가 이 값 이상이고 답변에 쓴 문서가 그대로면 저장된 답변을 쓴다
+ANSWER_CACHE_SIMILARITY = 0.97
+# 여러 폴더 검색: 폴더(샤드)별 점수 계산을 동시에 실행하는 스레드 수, 모든 폴더를 합쳐 남기는 후보 청크 수
+SEARCH_CONCURRENCY = 4
+SEARCH_TOP_K = 100
+# 하이브리드 검색: 검색어(BM25)로 고르는 청크 수, 벡터/검색어 순위를 합칠 때 쓰는 RRF 상수
+LEXICAL_TOP_K = 50
+RRF_K = 60
+# 심볼 문맥(symbol_context): 폴더마다 남기는 상위 청크 수, 상위 청크 하나에 붙이는 정의 청크 수,
+# 정의가 이보다 많은 곳에 있는 이름(흔한 메서드 이름 등)은 어느 것을 가리키는지 알 수 없으므로 따라가지 않는다
+SYMBOL_CONTEXT_TOP_K = 12
+SYMBOL_EXPAND_PER_HIT = 4
+SYMBOL_MAX_DEFINITIONS = 3
+# 근사 최근접 이웃 검색(ann_folders 설정에 넣은 폴더): 이보다 청크가 적은 폴더는 정확 검색을 쓴다, 기본으로 살펴보는 목록 수
+# (설정 ann_nprobe, 클수록 recall이 오르고 느려진다), 정확한 유사도로 다시 정렬할 후보 수(남길 청크 수의 배수),
+# PQ 부분 벡터 수, 학습 표본 행 수, 학습 때보다 행 수가 이 배수를 넘게 바뀌면 다시 학습, 색인에 든 청크 비율이 이보다 낮으면 정확 검색
+ANN_MIN_ROWS = 20000
+ANN_NPROBE = 16
+ANN_RERANK_FACTOR = 4
+ANN_PQ_SUBVECTORS = 64
+ANN_TRAIN_SAMPLE = 16384
+ANN_RETRAIN_GROWTH = 2.0
+ANN_MIN_COVERAGE = 0.8
+
+# 문맥 구성: 프롬프트에 넣을 문맥의 기본 토큰 예산(설정 context_max_tokens), 모델별 컨텍스트 크기와 그중 시스템 메시지/답변 몫,
+# 토큰당 가치를 계산할 때의 최소 토큰 수, 큰 문서의 일부 구간만 넣을 때의 최소 남은 예산
+CONTEXT_MAX_TOKENS = 80000
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o-2024-08-06': 128000,
+    'gpt-4o-mini-2024-07-18': 128000,
+    'claude-3-sonnet-20240229': 200000
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+CONTEXT_RESERVED_TOKENS = 8000
+CONTEXT_MIN_ITEM_TOKENS = 200
+CONTEXT_PARTIAL_MIN_TOKENS = 500
+
+# 파일을 나눠 임베딩할 때 청크 하나의 최대 토큰 수
+CHUNK_MAX_TOKENS = 1500
+
+# 임베딩 일괄 요청: 요청 하나에 담을 최대 토큰/입력 수, 입력 하나의 최대 토큰 수, 기본 동시 요청 수
+EMBEDDING_BATCH_MAX_TOKENS = 100000
+EMBEDDING_BATCH_MAX_INPUTS = 512
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_CONCURRENCY = 4
+
+# HTTP 클라이언트: 연결/응답 대기 시간(초, 스트리밍은 조각 사이의 대기 시간), 429/5xx/연결 오류의 최대 재시도 횟수, 재시도 대기 상한
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 180
+HTTP_MAX_RETRIES = 3
+HTTP_MAX_BACKOFF_SECONDS = 60.0
+
+# 관련성 필터(filter_content): 동시 판정 요청 수, 질문 하나의 판정에 쓰는 최대 시간(초), 캐시할 판정 수
+FILTER_CONCURRENCY = 8
+FILTER_DEADLINE_SECONDS = 15.0
+FILTER_CACHE_SIZE = 4096
+
+# 백그라운드 작업(임베딩 갱신, 변경 분석): 동시에 실행하는 작업 수, 진행 상태를 데이터베이스에 기록하는 최소 간격(초)
+JOB_WORKERS = 2
+JOB_PERSIST_INTERVAL = 1.0
+
+# 변경 분석: 파일별 리뷰를 동시에 요청하는 수, 리뷰 대상 확장자 기본값, 기준 브랜치 확인 결과를 기억하는 시간(초),
+# 변경 전 파일 전체를 리뷰 프롬프트에 넣는 최대 토큰 수
+ANALYSIS_CONCURRENCY = 4
+REVIEW_EXTENSIONS = ['.py', '.js', '.java', '.cs', '.c', '.cpp', '.h', '.hpp', '.ts', '.tsx', '.jsx', '.php', '.rb', '.go', '.rs', '.pas']
+GIT_BRANCH_CACHE_SECONDS = 300
+ANALYSIS_BEFORE_MAX_TOKENS = 2000
+
+# 질문 임베딩 캐시의 디스크 용량 상한 (바이트)
+EMBEDDING_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 번역: Ollama에 동시에 보내는 요청 수, 요청 하나에 묶는 블록의 최대 글자 수와 개수
+TRANSLATE_CONCURRENCY = 4
+TRANSLATE_BATCH_MAX_CHARS = 2000
+TRANSLATE_BATCH_MAX_BLOCKS = 16
+
+# 파일 읽기: 동시에 읽는 스레드 수, UTF-8 디코딩이 실패했을 때 인코딩 추정에 쓰는 앞부분 바이트 수
+READ_CONCURRENCY = 8
+READ_DETECT_SAMPLE_BYTES = 65536
+
+# 폴더 감시: 마지막 변경 후 이만큼 조용하면 모아서 처리, 변경이 계속돼도 최대 이 시간 안에는 처리, 폴링 방식의 검사 주기 (초)
+WATCH_DEBOUNCE_SECONDS = 1.0
+WATCH_MAX_DELAY_SECONDS = 10.0
+WATCH_POLL_INTERVAL = 2.0
 
 settings = {}
+# 설정이 바뀔 때마다 증가. 설정에서 파생된 캐시(필터 마스크 등)의 무효화에 사용
+settings_version = 0
 
 def load_settings():
-    global settings
+    global settings, settings_version
     
     default_settings = {
         'openai_api_key': 'your_openai_api_key', 
         'filter_content': '',
         'use_question_history': '',
+        'answer_cache': '',
         "use_translator": '',
+        'symbol_context': 'on',
+        'embedding_dtype': 'float32',
+        'embedding_dimensions': '',
+        'embedding_concurrency': EMBEDDING_CONCURRENCY,
+        'git_change_detection': '',
+        'watch_folders': '',
+        'read_concurrency': READ_CONCURRENCY,
+        'analysis_concurrency': ANALYSIS_CONCURRENCY,
+        'context_max_tokens': CONTEXT_MAX_TOKENS,
+        'ann_folders': [],
+        'ann_nprobe': ANN_NPROBE,
+        'review_extensions': REVIEW_EXTENSIONS,
         'extensions': ['.md', '.vue', '.js', '.json', '.css', '.html', '.py', '.pdf', '.java', '.ts', '.jsx', '.tsx', '.php', '.c', '.cpp', '.h', '.cs', '.swift', '.rb', '.go', '.kt', '.sql', '.hpp', '.m', '.mm'], 
-        'ignore_folders': ['node_modules', 'cypress', '.gradle', '.idea', 'build', 'test', 'bin', 'dist', '.vscode', '.git', '.github', '.expo'], 
-        'ignore_files': ['CodeSage.py', 'SageSettings.json', 'SageQuestions.json', 'SageFolders.json', 'embeddings.jsonl', 'package-lock.json'], 
+        'ignore_folders': ['node_modules', 'cypress', '.gradle', '.idea', 'build', 'test', 'bin', 'dist', '.vscode', '.git', '.github', '.expo', 'SageIndex'], 
+        'ignore_files': ['CodeSage.py', 'SageSettings.json', 'SageQuestions.json', 'SageQuestions.db', 'SageJobs.db', 'SageEmbeddingCache.db', 'SageTranslations.db', 'SageFolders.json', 'embeddings.jsonl', 'package-lock.json'], 
         'essential_files': ['JobFlow.md']
     }
     
@@ -41,12 +155,13 @@ def load_settings():
         with open(SETTINGS_FILE, 'w') as f:
             json.dump(settings, f, indent=2)
     
-    for key in ['extensions', 'ignore_folders', 'ignore_files', 'essential_files']:
-        if isinstance(settings[key], str):
+    for key in ['extensions', 'review_extensions', 'ignore_folders', 'ignore_files', 'essential_files', 'ann_folders']:
+        if isinstance(settings.get(key), str):
             settings[key] = [item.strip() for item in settings[key].split(',')]
-        elif isinstance(settings[key], list):
+        elif isinstance(settings.get(key), list):
             settings[key] = [item.strip() for item in settings[key]]
 
+    settings_version += 1
     logging.info("Settings loaded.")
     logging.info(f"API URL: {API_URL}")
     logging.info(f"EMBEDDINGS_MODEL: {EMBEDDINGS_MODEL}")
@@ -63,13 +178,17 @@ def get_settings():
 def get_setting(key, default=None):
     return get_settings().get(key, default)
 
+def get_settings_version():
+    return settings_version
+
 def update_settings(new_settings):
-    global settings
+    global settings, settings_version
     settings.update(new_settings)
     
-    for key in ['extensions', 'ignore_folders', 'ignore_files', 'essential_files']:
-        if isinstance(settings[key], str):
+    for key in ['extensions', 'review_extensions', 'ignore_folders', 'ignore_files', 'essential_files', 'ann_folders']:
+        if isinstance(settings.get(key), str):
             settings[key] = settings[key].split(', ')
+    settings_version += 1
     
     with open(SETTINGS_FILE, 'w') as f:
         json.dump(settings, f, indent=2)
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+from .config import get_setting, CONTEXT_MAX_TOKENS, CONTEXT_RESERVED_TOKENS, MODEL_CONTEXT_WINDOWS, DEFAULT_CONTEXT_WINDOW, CONTEXT_MIN_ITEM_TOKENS, CONTEXT_PARTIAL_MIN_TOKENS, FILTER_DEADLINE_SECONDS
+from .web_requests import get_chat_model
+from .utilities import count_tokens, count_tokens_batch, hash_content
+from .lexical_index import tokenize
+from .relevance_filter import get_item_text, judge_items
+
+def get_context_budget(model=None):
+    """ 프롬프트에 넣을 문맥의 전체 토큰 예산. 설정의 context_max_tokens와, 모델의 컨텍스트 크기에서
+    시스템 메시지와 답변 몫(CONTEXT_RESERVED_TOKENS)을 뺀 값 중 작은 쪽 """
+    model = model or get_chat_model()
+    try:
+        max_tokens = int(get_setting('context_max_tokens', CONTEXT_MAX_TOKENS) or CONTEXT_MAX_TOKENS)
+    except (TypeError, ValueError):
+        max_tokens = CONTEXT_MAX_TOKENS
+    return max(0, min(max_tokens, MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) - CONTEXT_RESERVED_TOKENS))
+
+def describe(item):
+    if 'filename' in item:
+        name = f"{item['filename']}:{item['lines']}"
+        return os.path.join(item['folder'], name) if item.get('folder') else name
+    return item['title']
+
+def get_relevance(item):
+    return item.get('score', item['similarity'])
+
+def get_density(item):
+    """ 토큰당 가치. 아주 작은 항목이 앞서지 않도록 토큰 수는 CONTEXT_MIN_ITEM_TOKENS 이상으로 본다 """
+    return max(get_relevance(item), 0) / max(item['tokens'], CONTEXT_MIN_ITEM_TOKENS)
+
+def best_region(question, item, max_tokens):
+    """ 문서에서 max_tokens 안에 들어가는 연속된 줄 구간 중 질문의 검색어가 가장 많이 나오는 구간을 잘라낸 (항목, 검색어 점수).
+    검색어가 하나도 없으면 앞부분을 쓴다. 들어갈 구간이 없으면 None """
+    header_tokens = count_tokens(item['filename'] + "\n\n")
+    lines = item['content'].splitlines(keepends=True)
+    if not lines or max_tokens <= header_tokens:
+        return None
+    terms = set(tokenize(question))
+    line_scores = [len(terms.intersection(tokenize(line))) for line in lines]
+    line_tokens = count_tokens_batch(lines)
+
+    # 토큰 합이 예산 안인 창을 밀면서 검색어 점수의 합이 가장 큰 구간을 찾는다. 점수가 같으면 더 긴 구간, 그다음 앞쪽 구간
+    best = None
+    start = 0
+    window_tokens = 0
+    window_score = 0
+    for end in range(len(lines)):
+        window_tokens += line_tokens[end]
+        window_score += line_scores[end]
+        while window_tokens > max_tokens - header_tokens and start <= end:
+            window_tokens -= line_tokens[start]
+            window_score -= line_scores[start]
+            start += 1
+        if start > end:
+            continue
+        if best is None or (window_score, end + 1 - start) > (best[0], best[2] - best[1]):
+            best = (window_score, start, end + 1)
+    if best is None:
+        return None
+    score, start, end = best
+    if score > 0:
+        # 검색어가 나온 줄들을 가운데에 두도록 그 범위에서부터 위아래로 번갈아 넓힌다
+        matched = [i for i in range(start, end) if line_scores[i]]
+        start, end = matched[0], matched[-1] + 1
+        window_tokens = sum(line_tokens[start:end])
+        grown = True
+        while grown:
+            grown = False
+            if start > 0 and window_tokens + line_tokens[start - 1] <= max_tokens - header_tokens:
+                start -= 1
+                window_tokens += line_tokens[start]
+                grown = True
+            if end < len(lines) and window_tokens + line_tokens[end] <= max_tokens - header_tokens:
+                window_tokens += line_tokens[end]
+                end += 1
+                grown = True
+
+    first_line = int(str(item['lines']).split('-')[0])
+    content = ''.join(lines[start:end])
+    return dict(item, content=content, tokens=count_tokens(item['filename'] + "\n\n" + content),
+                lines=f"{first_line + start}-{first_line + end - 1}", partial=True), score
+
+def choose(question, candidates, budget):
+    """ 토큰당 가치가 높은 순으로 예산에 담는다. 다 들어가지 않는 문서는 가장 관련 있는 구간만 넣는다 """
+    chosen = []
+    remaining = budget
+    for item, entry in sorted(candidates, key=lambda candidate: -get_density(candidate[0])):
+        if item['tokens'] <= remaining:
+            chosen.append((item, item, entry, 'selected', f"value/token {get_density(item):.2e}"))
+            remaining -= item['tokens']
+            continue
+        if 'filename' in item and remaining >= CONTEXT_PARTIAL_MIN_TOKENS:
+            region = best_region(question, item, remaining)
+            if region is not None:
+                part, score = region
+                reason = f"only lines {part['lines']} of {item['lines']} fit; region with {score} question term matches"
+                chosen.append((item, part, entry, 'partial', reason))
+                remaining -= part['tokens']
+                continue
+        chosen.append((item, None, entry, 'over_budget', f"{item['tokens']} tokens, {remaining} left"))
+    return chosen
+
+def pack_context(question, items, budget, filter_related=False, deadline=FILTER_DEADLINE_SECONDS):
+    """ 답변/문서 후보에서 budget 안에 넣을 항목을 골라 (선택한 항목, 보고서)를 반환. 선택한 항목은 관련도순이다.
+    여러 폴더에서 내용이 같은 항목은 관련도가 가장 높은 하나만 남긴다.
+    filter_related가 켜져 있으면 선택한 항목(일부만 넣는 문서는 넣는 구간)의 관련 여부를 판정해 관련 없는 항목을 빼고 남는 예산을 다시 채우며,
+    deadline이 지나면 판정 없이 포함한다. 보고서에는 항목마다 결정(selected/partial/duplicate/unrelated/over_budget)과 이유가 있다 """
+    end = time.monotonic() + deadline
+    entries = []
+    candidates = []
+    seen = {}
+    for item in sorted(items, key=lambda item: -get_relevance(item)):
+        entry = {
+            'kind': 'document' if 'filename' in item else 'answer',
+            'name': describe(item),
+            'tokens': item['tokens'],
+            'relevance': round(float(get_relevance(item)), 4)
+        }
+        entries.append(entry)
+        key = hash_content(get_item_text(item))
+        if key in seen:
+            entry.update(decision='duplicate', reason=f"same content as {seen[key]}")
+            continue
+        seen[key] = entry['name']
+        candidates.append((item, entry))
+
+    # 항목마다 (판정한 본문, 판정). 일부만 넣는 문서는 넣는 구간을 판정하고, 구간이 바뀌면 다시 판정한다
+    judged = {}
+
+    def get_verdict(item):
+        return judged.get(id(item), (None, None))[1]
+
+    while True:
+        chosen = choose(question, [(item, entry) for item, entry in candidates if get_verdict(item) is not False], budget)
+        if not filter_related:
+            break
+        unjudged = [(item, part) for item, part, _, _, _ in chosen
+                    if part is not None and judged.get(id(item), (None, None))[0] != get_item_text(part)]
+        if not unjudged:
+            break
+        results = judge_items(question, [part for _, part in unjudged], end - time.monotonic())
+        for (item, part), related in zip(unjudged, results):
+            judged[id(item)] = (get_item_text(part), related)
+        if False not in results:
+            break
+
+    selected = []
+    used_tokens = 0
+    for item, part, entry, decision, reason in chosen:
+        entry.update(decision=decision, reason=reason)
+        if part is not None:
+            if filter_related and get_verdict(item) is None:
+                entry['reason'] += '; relevance not judged before the deadline'
+            entry['tokens'] = part['tokens']
+            selected.append(part)
+            used_tokens += part['tokens']
+    for item, entry in candidates:
+        if get_verdict(item) is False:
+            entry.update(decision='unrelated', reason="judged unrelated to the question")
+
+    selected.sort(key=lambda item: -get_relevance(item))
+    report = {
+        'model': get_chat_model(),
+        'budget': budget,
+        'used_tokens': used_tokens,
+        'items': entries
+    }
+    counts = {}
+    for entry in entries:
+        counts[entry['decision']] = counts.get(entry['decision'], 0) + 1
+    logging.info(f"Context packed: {used_tokens}/{budget} tokens, {counts}")
+    for entry in entries:
+        logging.debug(f"  {entry['decision']}: {entry['name']} ({entry['tokens']} tokens, relevance {entry['relevance']}) - {entry['reason']}")
+    return selected, report
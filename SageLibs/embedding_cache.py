@@ -0,0 +1,108 @@
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import numpy as np
+from .config import EMBEDDING_CACHE_MAX_BYTES
+
+EMBEDDING_CACHE_FILE = 'SageEmbeddingCache.db'
+# 용량을 넘으면 이 비율까지 오래 안 쓴 항목부터 지운다
+EMBEDDING_CACHE_TRIM_RATIO = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+WHITESPACE = re.compile(r'\s+')
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'bytes': 0, 'entries': 0}
+
+def get_connection():
+    """ 스레드마다 하나의 SQLite 연결. 처음 호출될 때 테이블을 만들고 현재 용량을 읽는다 """
+    global _initialized
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(EMBEDDING_CACHE_FILE, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        _local.connection = connection
+
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                with connection:
+                    connection.execute(SCHEMA)
+                    connection.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+                entries, size = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings').fetchone()
+                with _stats_lock:
+                    _stats['entries'], _stats['bytes'] = entries, size
+                _initialized = True
+    return connection
+
+def normalize_text(text):
+    """ 앞뒤 공백을 없애고 연속된 공백을 하나로 줄인다. 공백만 다른 질문은 같은 키가 된다 """
+    return WHITESPACE.sub(' ', text).strip()
+
+def get_cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode('utf-8', errors='replace')).hexdigest()
+
+def get_cached_embedding(key):
+    connection = get_connection()
+    row = connection.execute('SELECT embedding FROM embeddings WHERE key = ?', (key,)).fetchone()
+    with _stats_lock:
+        _stats['hits' if row else 'misses'] += 1
+    if row is None:
+        return None
+    with connection:
+        connection.execute('UPDATE embeddings SET last_used = ? WHERE key = ?', (time.time(), key))
+    return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+def cache_embedding(key, model, embedding):
+    blob = np.asarray(embedding, dtype=np.float32).tobytes()
+    connection = get_connection()
+    with connection:
+        previous = connection.execute('SELECT size FROM embeddings WHERE key = ?', (key,)).fetchone()
+        connection.execute('INSERT OR REPLACE INTO embeddings (key, model, embedding, size, last_used) VALUES (?, ?, ?, ?, ?)',
+                           (key, model, blob, len(blob), time.time()))
+    with _stats_lock:
+        _stats['bytes'] += len(blob) - (previous[0] if previous else 0)
+        _stats['entries'] += 0 if previous else 1
+        over_limit = _stats['bytes'] > EMBEDDING_CACHE_MAX_BYTES
+    if over_limit:
+        evict()
+
+def evict():
+    """ 용량 상한을 넘으면 마지막 사용 시각이 오래된 항목부터 지운다 """
+    connection = get_connection()
+    target = EMBEDDING_CACHE_MAX_BYTES * EMBEDDING_CACHE_TRIM_RATIO
+    with connection:
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM embeddings').fetchone()[0]
+        removed = 0
+        for key, size in connection.execute('SELECT key, size FROM embeddings ORDER BY last_used').fetchall():
+            if total <= target:
+                break
+            connection.execute('DELETE FROM embeddings WHERE key = ?', (key,))
+            total -= size
+            removed += 1
+        entries = connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+    with _stats_lock:
+        _stats['bytes'], _stats['entries'] = total, entries
+    logging.info(f"Evicted {removed} entries from the embedding cache")
+
+def get_cache_metrics():
+    get_connection()
+    with _stats_lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return dict(_stats, hit_rate=_stats['hits'] / lookups if lookups else 0.0, max_bytes=EMBEDDING_CACHE_MAX_BYTES)
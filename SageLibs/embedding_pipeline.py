@@ -0,0 +1,132 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from .config import get_setting, EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_INPUTS, EMBEDDING_MAX_INPUT_TOKENS, EMBEDDING_CONCURRENCY
+from .web_requests import get_embeddings, RateLimitError
+from .http_client import get_backoff
+from .utilities import count_tokens
+
+MAX_RATE_LIMIT_RETRIES = 8
+
+class AdaptiveLimiter:
+    """ 동시에 진행 중인 요청 수를 제한. 429를 받으면 한도를 절반으로 줄이고,
+    성공이 이어지면 최대치까지 하나씩 다시 늘린다 (AIMD) """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        with self.condition:
+            self.successes += 1
+            if self.limit < self.max_concurrency and self.successes >= self.limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def on_rate_limited(self):
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            logging.warning(f"Embedding concurrency reduced to {self.limit}")
+
+def pack_batches(items, max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS, max_batch_inputs=EMBEDDING_BATCH_MAX_INPUTS, on_error=None):
+    """ (key, text) 항목을 토큰 예산 안에서 묶어 배치로 만든다. 입력 하나의 한도를 넘는 항목은 on_error로 보고 """
+    batch = []
+    batch_tokens = 0
+    for key, text in items:
+        tokens = count_tokens(text)
+        if tokens > EMBEDDING_MAX_INPUT_TOKENS:
+            if on_error:
+                on_error(key, f"Input too long for embedding ({tokens} tokens > {EMBEDDING_MAX_INPUT_TOKENS})")
+            continue
+
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_inputs):
+            yield batch
+            batch = []
+            batch_tokens = 0
+
+        batch.append((key, text))
+        batch_tokens += max(tokens, 1)
+
+    if batch:
+        yield batch
+
+def _request_batch(texts, limiter):
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        limiter.acquire()
+        try:
+            embeddings = get_embeddings(texts)
+        except RateLimitError as e:
+            limiter.on_rate_limited()
+            if attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            backoff = get_backoff(attempt, e.retry_after)
+            logging.info(f"Rate limited, retrying batch of {len(texts)} in {backoff:.1f}s")
+            time.sleep(backoff)
+            continue
+        finally:
+            limiter.release()
+
+        limiter.on_success()
+        return embeddings
+
+def _embed_batch(batch, limiter):
+    """ 배치를 요청하고 [(key, embedding, error)]를 반환. 배치 전체가 실패하면 항목별로 다시 요청해 실패 파일을 가려낸다 """
+    try:
+        embeddings = _request_batch([text for _, text in batch], limiter)
+        return [(key, embedding, None) for (key, _), embedding in zip(batch, embeddings)]
+    except Exception as e:
+        if len(batch) == 1:
+            return [(batch[0][0], None, str(e))]
+        logging.warning(f"Batch of {len(batch)} failed ({str(e)}), retrying items individually")
+
+    results = []
+    for key, text in batch:
+        try:
+            results.append((key, _request_batch([text], limiter)[0], None))
+        except Exception as e:
+            results.append((key, None, str(e)))
+    return results
+
+def embed_documents(items, on_result, max_concurrency=None, max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS):
+    """ (key, text) 항목들의 임베딩을 배치 단위로 동시에 생성.
+    on_result(key, embedding, error)는 호출한 스레드에서 결과가 나오는 순서대로 호출된다 """
+    max_concurrency = max_concurrency or int(get_setting('embedding_concurrency', EMBEDDING_CONCURRENCY))
+    limiter = AdaptiveLimiter(max_concurrency)
+
+    def report_error(key, message):
+        on_result(key, None, message)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = set()
+
+        def drain(return_when):
+            nonlocal in_flight
+            done, in_flight = wait(in_flight, return_when=return_when)
+            for future in done:
+                for key, embedding, error in future.result():
+                    on_result(key, embedding, error)
+
+        for batch in pack_batches(items, max_batch_tokens, on_error=report_error):
+            # 입력을 미리 모두 읽어두지 않도록 진행 중인 배치 수를 제한
+            if len(in_flight) >= max_concurrency * 2:
+                drain(FIRST_COMPLETED)
+            in_flight.add(executor.submit(_embed_batch, batch, limiter))
+
+        drain(ALL_COMPLETED)
@@ -0,0 +1,369 @@
+import os
+import re
+import sys
+import json
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .lexical_index import SegmentBuilder
+from .symbol_index import SymbolBuilder
+from .config import get_setting, EMBEDDINGS_FILE, EMBEDDINGS_DIR, EMBEDDINGS_MANIFEST_FILE, EMBEDDINGS_MATRIX_FILE, EMBEDDINGS_METADATA_FILE, EMBEDDINGS_CONTENT_FILE
+
+STORE_VERSION = 2
+SUPPORTED_DTYPES = ('float32', 'float16', 'int8')
+
+# 죽은 행 비율이 이 값을 넘거나 세그먼트 수가 이 값을 넘으면 백그라운드에서 세그먼트 하나로 압축
+COMPACTION_DEAD_RATIO = 0.3
+COMPACTION_MAX_SEGMENTS = 8
+
+SEGMENT_PATTERN = re.compile(r'^seg-\d{6}\.(npy|bin|lex|sym|scl)(\.tmp)?$')
+
+# 폴더별 쓰기 잠금. 임베딩 갱신과 압축이 같은 저장소를 동시에 바꾸지 않도록 한다
+_folder_locks = {}
+_folder_locks_lock = threading.Lock()
+_compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='SageCompaction')
+
+def get_store_dir(folder):
+    return os.path.join(folder, EMBEDDINGS_DIR)
+
+def get_manifest_file(folder):
+    return os.path.join(get_store_dir(folder), EMBEDDINGS_MANIFEST_FILE)
+
+def store_exists(folder):
+    store_dir = get_store_dir(folder)
+    return os.path.exists(get_manifest_file(folder)) or os.path.exists(os.path.join(store_dir, EMBEDDINGS_METADATA_FILE))
+
+def get_store_dtype():
+    dtype = get_setting('embedding_dtype', 'float32') or 'float32'
+    if dtype not in SUPPORTED_DTYPES:
+        logging.warning(f"Unsupported embedding_dtype '{dtype}', falling back to float32")
+        return 'float32'
+    return dtype
+
+def get_folder_lock(folder):
+    folder = os.path.abspath(folder)
+    with _folder_locks_lock:
+        return _folder_locks.setdefault(folder, threading.RLock())
+
+def get_segment_path(folder, segment, extension):
+    return os.path.join(get_store_dir(folder), f"{segment}.{extension}")
+
+def write_atomic(path, write):
+    """ 임시 파일에 쓰고 fsync한 뒤 rename으로 교체. 읽는 쪽은 이전 파일이나 완성된 새 파일만 보게 된다 """
+    with open(path + '.tmp', 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+def empty_manifest():
+    return {'version': STORE_VERSION, 'generation': 0, 'segments': [], 'records': [], 'files': {}}
+
+def read_manifest(folder):
+    upgrade_store(folder)
+    with open(get_manifest_file(folder), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(folder, manifest):
+    data = json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+    write_atomic(get_manifest_file(folder), lambda f: f.write(data))
+
+class StoreWriter:
+    """ 임베딩 저장소를 갱신한다. 새로 임베딩한 청크만 새 세그먼트(정규화된 행렬 .npy + 본문 .bin)에 추가하고,
+    바뀌지 않은 청크는 keep()으로 기존 세그먼트의 행을 그대로 참조한다.
+    새 세그먼트에는 같은 본문으로 만든 검색어 역색인(.lex)과 심볼 정의/참조 목록(.sym)도 함께 쓰므로, 이들도 바뀐 청크만큼만 새로 만든다.
+    세그먼트는 한 번 쓰면 바뀌지 않으며, commit()은 세그먼트를 다 쓴 뒤 매니페스트를 원자적으로 교체한다.
+    생성부터 commit()/abort()까지 폴더 잠금을 잡고 있다 """
+
+    def __init__(self, folder, dtype=None):
+        self.folder = folder
+        self.dtype = dtype or get_store_dtype()
+        self.store_dir = get_store_dir(folder)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        self.lock = get_folder_lock(folder)
+        self.lock.acquire()
+        try:
+            self.base = read_manifest(folder) if store_exists(folder) else empty_manifest()
+        except Exception:
+            self.lock.release()
+            raise
+
+        self.generation = self.base['generation'] + 1
+        self.segment = f"seg-{self.generation:06d}"
+        self.records = []
+        self.vectors = []
+        self.files = {}
+        self.lexical = SegmentBuilder()
+        self.symbols = SymbolBuilder()
+        self.content_file = None
+        self.content_offset = 0
+
+    def add(self, filename, content, content_hash, embedding, mtime=0, tokens=None, chunk=0, start_line=1, end_line=None, chunker=None):
+        """ 청크 하나를 새 세그먼트의 한 행으로 추가. content는 청크 본문이고 content_hash는 파일 전체의 해시 """
+        if self.content_file is None:
+            self.content_file = open(get_segment_path(self.folder, self.segment, 'bin') + '.tmp', 'wb')
+
+        data = content.encode('utf-8', errors='replace')
+        self.content_file.write(data)
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        self.vectors.append(vector / norm if norm > 0 else vector)
+        self.lexical.add(len(self.vectors) - 1, filename, content)
+        self.symbols.add(len(self.vectors) - 1, filename, content)
+
+        self.records.append({
+            'filename': filename,
+            'content_hash': content_hash,
+            'mtime': mtime,
+            'segment': self.segment,
+            'row': len(self.vectors) - 1,
+            'chunk': chunk,
+            'start_line': start_line,
+            'end_line': end_line if end_line is not None else start_line + max(len(content.splitlines()) - 1, 0),
+            'chunker': chunker,
+            'tokens': tokens,
+            'norm': norm,
+            'offset': self.content_offset,
+            'length': len(data)
+        })
+        self.content_offset += len(data)
+
+    def keep(self, record, mtime=None):
+        """ 기존 세그먼트의 청크를 본문이나 벡터 복사 없이 다음 세대로 넘긴다 """
+        record = dict(record)
+        if mtime is not None:
+            record['mtime'] = mtime
+        self.records.append(record)
+
+    def set_file_state(self, filename, state):
+        """ 다음 갱신 때 파일을 열지 않고 변경 여부를 판단할 수 있도록 stat 정보와 content_hash를 기록 """
+        self.files[filename] = state
+
+    def commit(self):
+        written = False
+        try:
+            segments = list(self.base['segments'])
+            if self.vectors:
+                self.content_file.flush()
+                os.fsync(self.content_file.fileno())
+                self.content_file.close()
+                matrix = np.stack(self.vectors)
+                if self.dtype == 'int8':
+                    matrix, scales = quantize_int8(matrix)
+                    write_atomic(get_segment_path(self.folder, self.segment, 'scl'), lambda f: np.save(f, scales))
+                else:
+                    matrix = matrix.astype(self.dtype)
+                write_atomic(get_segment_path(self.folder, self.segment, 'npy'), lambda f: np.save(f, matrix))
+                write_atomic(get_segment_path(self.folder, self.segment, 'lex'), self.lexical.save)
+                write_atomic(get_segment_path(self.folder, self.segment, 'sym'), self.symbols.save)
+                os.replace(get_segment_path(self.folder, self.segment, 'bin') + '.tmp', get_segment_path(self.folder, self.segment, 'bin'))
+                segments.append({'name': self.segment, 'rows': len(self.vectors), 'dtype': self.dtype})
+
+            # 매니페스트를 마지막에 교체한다. 그 전까지 읽는 쪽은 이전 세대를 그대로 본다
+            used = set(record['segment'] for record in self.records)
+            manifest = {
+                'version': STORE_VERSION,
+                'generation': self.generation,
+                'segments': [segment for segment in segments if segment['name'] in used],
+                'records': self.records,
+                'files': self.files
+            }
+            write_manifest(self.folder, manifest)
+            written = True
+            remove_unused_segments(self.folder, manifest)
+            logging.info(f"Embedding store committed: {self.store_dir} (generation {self.generation}, {len(self.vectors)} new rows, {len(self.records)} records)")
+        except Exception:
+            # 매니페스트를 교체하기 전에 실패했으면 (디스크 부족, 권한 등) 이 세그먼트에 쓴 파일을 모두 지운다
+            if not written:
+                self.discard_segment()
+            raise
+        finally:
+            self.lock.release()
+
+        if needs_compaction(manifest):
+            schedule_compaction(self.folder)
+
+    def abort(self):
+        try:
+            self.discard_segment()
+        finally:
+            self.lock.release()
+
+    def discard_segment(self):
+        """ 열린 본문 파일을 닫고 이 세그먼트의 임시 파일과 데이터 파일을 지운다 """
+        if self.content_file is not None:
+            self.content_file.close()
+        for extension in ('bin', 'npy', 'scl', 'lex', 'sym'):
+            path = get_segment_path(self.folder, self.segment, extension)
+            for name in (path, path + '.tmp'):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+
+def remove_unused_segments(folder, manifest):
+    """ 매니페스트가 참조하지 않는 세그먼트 파일을 지운다. 다른 곳에서 열려 있어 지우지 못하면 다음 커밋 때 다시 시도 """
+    used = set(segment['name'] for segment in manifest['segments'])
+    for name in os.listdir(get_store_dir(folder)):
+        if SEGMENT_PATTERN.match(name) and name.split('.', 1)[0] not in used:
+            try:
+                os.remove(os.path.join(get_store_dir(folder), name))
+            except OSError as e:
+                logging.debug(f"Could not remove unused segment {name}: {str(e)}")
+
+def needs_compaction(manifest):
+    total_rows = sum(segment['rows'] for segment in manifest['segments'])
+    if total_rows == 0:
+        return False
+    dead_ratio = 1 - len(manifest['records']) / total_rows
+    return dead_ratio > COMPACTION_DEAD_RATIO or len(manifest['segments']) > COMPACTION_MAX_SEGMENTS
+
+def schedule_compaction(folder):
+    logging.info(f"Scheduling background compaction: {folder}")
+    return _compaction_executor.submit(compact_store, folder)
+
+def compact_store(folder, force=False, dtype=None):
+    """ 살아 있는 청크만 새 세그먼트 하나로 다시 써서 죽은 행과 세그먼트 수를 정리. dtype을 주면 그 형식으로 다시 쓴다 """
+    try:
+        writer = StoreWriter(folder, dtype)
+        try:
+            if not force and not needs_compaction(writer.base):
+                writer.abort()
+                return False
+
+            _, matrices = open_segments(folder, writer.base)
+            for record in writer.base['records']:
+                embedding = np.asarray(matrices[record['segment']][record['row']], dtype=np.float32) * record['norm']
+                writer.add(record['filename'], read_content(folder, record), record['content_hash'], embedding, record['mtime'], record.get('tokens'),
+                           record.get('chunk', 0), record['start_line'], record['end_line'], record.get('chunker'))
+            writer.files = writer.base['files']
+        except Exception:
+            writer.abort()
+            raise
+
+        writer.commit()
+        logging.info(f"Compacted embedding store: {folder} ({len(writer.records)} records)")
+        return True
+    except Exception as e:
+        logging.error(f"Compaction failed for {folder}: {str(e)}", exc_info=True)
+        return False
+
+def quantize_int8(matrix):
+    """ 행마다 최댓값 절댓값이 127이 되도록 int8로 양자화해 (코드, 행별 배율)을 반환 """
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+class QuantizedMatrix:
+    """ int8 세그먼트 행렬(np.memmap)과 행별 배율. 행을 읽으면 배율을 곱한 float32를 돌려주므로 다른 dtype의 행렬처럼 쓸 수 있다 """
+
+    dtype = np.dtype(np.int8)
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return self.codes[rows].astype(np.float32) * self.scales[rows][..., None]
+
+def open_segments(folder, manifest):
+    """ 매니페스트의 세그먼트 행렬을 np.memmap으로 연다. int8 세그먼트는 배율과 함께 QuantizedMatrix로 감싼다 """
+    matrices = {}
+    for segment in manifest['segments']:
+        matrix = np.load(get_segment_path(folder, segment['name'], 'npy'), mmap_mode='r')
+        if segment.get('dtype') == 'int8':
+            matrix = QuantizedMatrix(matrix, np.load(get_segment_path(folder, segment['name'], 'scl')))
+        matrices[segment['name']] = matrix
+    return manifest, matrices
+
+def load_store(folder):
+    """ 매니페스트와 세그먼트 이름 -> 임베딩 행렬(np.memmap) dict를 반환 """
+    return open_segments(folder, read_manifest(folder))
+
+def read_content(folder, record):
+    with open(get_segment_path(folder, record['segment'], 'bin'), 'rb') as f:
+        f.seek(record['offset'])
+        return f.read(record['length']).decode('utf-8', errors='replace')
+
+def upgrade_store(folder):
+    """ 세그먼트 도입 이전 형식(embeddings.npy + contents.bin + metadata.json)을 세그먼트 하나짜리 저장소로 변환 """
+    store_dir = get_store_dir(folder)
+    metadata_file = os.path.join(store_dir, EMBEDDINGS_METADATA_FILE)
+    if os.path.exists(get_manifest_file(folder)) or not os.path.exists(metadata_file):
+        return
+
+    with get_folder_lock(folder):
+        if os.path.exists(get_manifest_file(folder)):
+            return
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+
+        manifest = empty_manifest()
+        if metadata['records']:
+            segment = 'seg-000000'
+            os.replace(os.path.join(store_dir, EMBEDDINGS_MATRIX_FILE), get_segment_path(folder, segment, 'npy'))
+            os.replace(os.path.join(store_dir, EMBEDDINGS_CONTENT_FILE), get_segment_path(folder, segment, 'bin'))
+            manifest['segments'] = [{'name': segment, 'rows': len(metadata['records']), 'dtype': metadata['dtype']}]
+            manifest['records'] = [dict(record, segment=segment) for record in metadata['records']]
+        manifest['files'] = metadata.get('files', {})
+
+        write_manifest(folder, manifest)
+        os.remove(metadata_file)
+        logging.info(f"Upgraded embedding store to segments: {store_dir}")
+
+def load_legacy_embeddings(file_path):
+    embeddings = {}
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    embeddings[data['filename']] = data
+    return embeddings
+
+def migrate_jsonl(folder, dtype=None):
+    """ 기존 embeddings.jsonl을 바이너리 저장소로 변환. 원본 jsonl 파일은 그대로 남겨둔다.
+    파일 전체가 하나의 청크로 들어가며, chunker가 없으므로 다음 임베딩 갱신 때 청크 단위로 다시 생성된다 """
+    from .utilities import count_tokens
+
+    legacy_file = os.path.join(folder, EMBEDDINGS_FILE)
+    if not os.path.exists(legacy_file):
+        logging.warning(f"No {EMBEDDINGS_FILE} to migrate in {folder}")
+        return False
+
+    logging.info(f"Migrating {legacy_file} to binary embedding store")
+    writer = StoreWriter(folder, dtype)
+    try:
+        for filename, data in load_legacy_embeddings(legacy_file).items():
+            file_path = os.path.join(folder, filename)
+            mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else 0
+            tokens = count_tokens(filename + "\n\n" + data['content'])
+            writer.add(filename, data['content'], data['content_hash'], data['embedding'], mtime, tokens)
+    except Exception:
+        writer.abort()
+        raise
+
+    writer.commit()
+    return True
+
+if __name__ == "__main__":
+    # 사용법: python -m SageLibs.embedding_store <folder> [<folder> ...] [--float16|--int8] [--compact]
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = sys.argv[1:]
+    dtype = 'float16' if '--float16' in args else 'int8' if '--int8' in args else None
+    for folder in [arg for arg in args if not arg.startswith('--')]:
+        if '--compact' in args:
+            compact_store(folder, force=True, dtype=dtype)
+        else:
+            migrate_jsonl(folder, dtype)
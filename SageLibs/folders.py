@@ -1,33 +1,64 @@
-from tinydb import TinyDB, Query
+import json
 import logging
+import threading
+from .embedding_store import write_atomic
 
-db = TinyDB('SageFolders.json')
-folders_table = db.table('folders')
+FOLDERS_FILE = 'SageFolders.json'
+# 이전에 TinyDB로 쓰던 파일 형식을 그대로 쓴다: {"folders": {"<doc id>": {"path": ..., "selected": ...}}}
+FOLDERS_TABLE = 'folders'
+_lock = threading.Lock()
+
+def load_data():
+    try:
+        with open(FOLDERS_FILE, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def save_data(data):
+    write_atomic(FOLDERS_FILE, lambda file: file.write(json.dumps(data, ensure_ascii=False).encode('utf-8')))
+
+def load_folders():
+    """ 등록 순서대로의 폴더 목록 [{'path', 'selected'}] """
+    table = load_data().get(FOLDERS_TABLE, {})
+    return [table[doc_id] for doc_id in sorted(table, key=int)]
 
 def get_all_folders():
-    return sorted([folder['path'] for folder in folders_table.all()])
+    with _lock:
+        return sorted([folder['path'] for folder in load_folders()])
 
 def add_folder(folder_path):
     logging.info(f"Attempting to add folder: {folder_path}")
-    
+
     try:
-        existing = folders_table.get(Query().path == folder_path)
-        if existing:
-            logging.info(f"Folder already exists in the list: {folder_path}")
-            return False, "Folder already exists in the list"
-        
-        folders_table.insert({'path': folder_path, 'selected': False})
+        with _lock:
+            data = load_data()
+            table = data.setdefault(FOLDERS_TABLE, {})
+            if any(folder['path'] == folder_path for folder in table.values()):
+                logging.info(f"Folder already exists in the list: {folder_path}")
+                return False, "Folder already exists in the list"
+
+            doc_id = max((int(doc_id) for doc_id in table), default=0) + 1
+            table[str(doc_id)] = {'path': folder_path, 'selected': False}
+            save_data(data)
         logging.info(f"Folder added successfully: {folder_path}")
         return True, "Folder added successfully"
-    
+
     except Exception as e:
         logging.error(f"Unexpected error in add_folder: {str(e)}")
         return False, f"Unexpected error: {str(e)}"
 
 def delete_folder(folder_path):
     try:
-        result = folders_table.remove(Query().path == folder_path)
-        if result:
+        with _lock:
+            data = load_data()
+            table = data.get(FOLDERS_TABLE, {})
+            removed = [doc_id for doc_id, folder in table.items() if folder['path'] == folder_path]
+            for doc_id in removed:
+                del table[doc_id]
+            if removed:
+                save_data(data)
+        if removed:
             logging.info(f"Folder removed successfully: {folder_path}")
             return True, "Folder removed successfully"
         logging.warning(f"Folder not found in the list: {folder_path}")
@@ -35,11 +66,14 @@ def delete_folder(folder_path):
     except Exception as e:
         logging.error(f"Error in delete_folder: {str(e)}")
         return False, f"Error deleting folder: {str(e)}"
-    
+
 def update_selected_folders(selected_folders):
     try:
-        for folder in folders_table.all():
-            folders_table.update({'selected': folder['path'] in selected_folders}, Query().path == folder['path'])
+        with _lock:
+            data = load_data()
+            for folder in data.get(FOLDERS_TABLE, {}).values():
+                folder['selected'] = folder['path'] in selected_folders
+            save_data(data)
         logging.info(f"Updated selected folders: {selected_folders}")
         return True, "Selected folders updated successfully"
     except Exception as e:
@@ -48,9 +82,10 @@ def update_selected_folders(selected_folders):
 
 def get_selected_folders():
     try:
-        selected_folders = [folder['path'] for folder in folders_table.search(Query().selected == True)]
+        with _lock:
+            selected_folders = [folder['path'] for folder in load_folders() if folder['selected']]
         logging.info(f"Retrieved selected folders: {selected_folders}")
         return selected_folders
     except Exception as e:
         logging.error(f"Error retrieving selected folders: {str(e)}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,281 @@
+import os
+import re
+import time
+import atexit
+import codecs
+import chardet
+import logging
+import threading
+import subprocess
+from .config import get_setting, get_settings_version, REVIEW_EXTENSIONS, GIT_BRANCH_CACHE_SECONDS
+from .scanner import PathMatcher
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$')
+
+_branch_cache = {}
+_branch_cache_lock = threading.Lock()
+
+_review_matcher = None
+_review_matcher_version = None
+_review_matcher_lock = threading.Lock()
+
+_cat_files = {}
+_cat_files_lock = threading.Lock()
+
+def run_git(folder, *args):
+    return subprocess.check_output(['git', '-C', folder, '-c', 'core.quotepath=off', *args], stderr=subprocess.PIPE)
+
+def get_git_branches(folder):
+    try:
+        return run_git(folder, 'branch', '--list').decode('utf-8', errors='replace').split()
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise Exception(f"{folder}에서 Git 명령을 실행하는데 실패했습니다.") from e
+
+def get_base_branch(folder):
+    """ 비교 기준 브랜치(main, 없으면 master). 폴더마다 GIT_BRANCH_CACHE_SECONDS 동안 결과를 기억한다 """
+    now = time.monotonic()
+    with _branch_cache_lock:
+        cached = _branch_cache.get(folder)
+        if cached is not None and now - cached[1] < GIT_BRANCH_CACHE_SECONDS:
+            return cached[0]
+
+    branches = get_git_branches(folder)
+    logging.debug(f"Branches found: {branches}")
+    base_branch = 'main' if 'main' in branches else 'master' if 'master' in branches else None
+    if not base_branch:
+        raise Exception(f"{folder}에서 필요한 브랜치(main 또는 master)가 존재하지 않습니다.")
+
+    with _branch_cache_lock:
+        _branch_cache[folder] = (base_branch, now)
+    return base_branch
+
+def get_diff_range(analysis_type, base_branch):
+    if analysis_type == 'main':
+        return [f'{base_branch}..HEAD']
+    elif analysis_type == 'recent':
+        return ['HEAD^', 'HEAD']
+    raise Exception("분석 유형이 잘못 지정되었습니다.")
+
+def get_base_revision(analysis_type, base_branch):
+    """ 변경 전 내용을 읽을 리비전 """
+    return base_branch if analysis_type == 'main' else 'HEAD^'
+
+def get_review_matcher():
+    """ 설정의 review_extensions/ignore_files/ignore_folders로 컴파일한 변경 분석 대상 규칙. 설정이 바뀐 경우에만 다시 만든다 """
+    global _review_matcher, _review_matcher_version
+    version = get_settings_version()
+    with _review_matcher_lock:
+        if _review_matcher is None or _review_matcher_version != version:
+            _review_matcher = PathMatcher(get_setting('review_extensions', REVIEW_EXTENSIONS), get_setting('ignore_files', []), get_setting('ignore_folders', []))
+            _review_matcher_version = version
+        return _review_matcher
+
+def is_reviewable_file(file):
+    if not get_review_matcher().accept_path(file):
+        logging.debug(f"File ignored by review rules: {file}")
+        return False
+    return True
+
+def decode_diff(raw_output):
+    try:
+        return raw_output.decode('utf-8')
+    except UnicodeDecodeError:
+        encoding = chardet.detect(raw_output)['encoding'] or 'utf-8'
+        logging.debug(f"Detected encoding: {encoding}")
+        return raw_output.decode(encoding, errors='replace')
+
+def unquote_git_path(path):
+    """ git이 특수 문자가 든 경로를 감싸는 "..."(C 스타일 이스케이프)를 푼다 """
+    if not (path.startswith('"') and path.endswith('"')):
+        return path
+    return codecs.escape_decode(path[1:-1].encode('utf-8'))[0].decode('utf-8', errors='replace')
+
+def strip_prefix(path):
+    path = unquote_git_path(path.rstrip('\t'))
+    return None if path == '/dev/null' else path[2:]
+
+def get_header_path(header):
+    """ 'a/<old> b/<new>' 헤더의 새 경로. 특수 문자가 든 경로는 git이 따옴표로 감싼다 """
+    index = header.rfind(' "b/') if header.endswith('"') else header.rfind(' b/')
+    return strip_prefix(header[index + 1:]) if index >= 0 else None
+
+def parse_file_diff(text):
+    """ 'diff --git'으로 시작하는 파일 하나의 diff를 한 번 훑어 경로, 상태, hunk 목록으로 나눈다.
+    hunk는 {'old_start', 'old_lines', 'new_start', 'new_lines', 'header', 'lines'} """
+    lines = text.split('\n')
+    if lines[-1] == '':
+        # 마지막 줄바꿈 뒤의 빈 문자열은 hunk의 줄이 아니다
+        lines.pop()
+    header = lines[0][len('diff --git '):]
+    # 바이너리나 모드만 바뀐 파일은 ---/+++ 줄이 없으므로 헤더의 경로를 쓴다
+    old_path = new_path = get_header_path(header)
+    status = 'modified'
+    hunks = []
+    hunk = None
+
+    for line in lines[1:]:
+        if hunk is not None:
+            if line.startswith(('+', '-', ' ', '\\')) or line == '':
+                hunk['lines'].append(line)
+                continue
+            hunk = None
+
+        match = HUNK_HEADER.match(line) if line.startswith('@@') else None
+        if match:
+            hunk = {
+                'old_start': int(match.group(1)),
+                'old_lines': int(match.group(2) or 1),
+                'new_start': int(match.group(3)),
+                'new_lines': int(match.group(4) or 1),
+                'header': match.group(5),
+                'lines': []
+            }
+            hunks.append(hunk)
+        elif line.startswith('--- '):
+            old_path = strip_prefix(line[4:])
+        elif line.startswith('+++ '):
+            new_path = strip_prefix(line[4:])
+        elif line.startswith('new file mode'):
+            status = 'added'
+        elif line.startswith('deleted file mode'):
+            status = 'deleted'
+        elif line.startswith('rename from '):
+            old_path, status = unquote_git_path(line[len('rename from '):]), 'renamed'
+        elif line.startswith('rename to '):
+            new_path = unquote_git_path(line[len('rename to '):])
+        elif line.startswith('Binary files '):
+            status = 'binary'
+
+    if status == 'added':
+        old_path = None
+    elif status == 'deleted':
+        new_path = None
+    return {
+        'path': new_path or old_path,
+        'old_path': old_path,
+        'status': status,
+        'hunks': hunks,
+        'text': text
+    }
+
+def parse_diff(raw_output):
+    """ 전체 git diff 출력(bytes)을 파일 단위로 나눠 diff 순서대로 파싱. 파일마다 따로 디코딩한다 """
+    file_diffs = []
+    for chunk in raw_output.split(b'\ndiff --git '):
+        if not chunk.strip():
+            continue
+        if not chunk.startswith(b'diff --git '):
+            chunk = b'diff --git ' + chunk
+        file_diffs.append(parse_file_diff(decode_diff(chunk.rstrip(b'\n') + b'\n')))
+    return file_diffs
+
+def get_file_diffs(folder, analysis_type, base_branch=None):
+    """ git diff를 한 번 실행해 분석 대상 파일의 diff 목록을 반환 """
+    base_branch = base_branch or get_base_branch(folder)
+    try:
+        raw_output = run_git(folder, 'diff', *get_diff_range(analysis_type, base_branch))
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise Exception(f"{folder}에서 {analysis_type}에 해당하는 diff 계산 실패.") from e
+
+    file_diffs = [file_diff for file_diff in parse_diff(raw_output) if is_reviewable_file(file_diff['path'])]
+    logging.debug(f"Found {len(file_diffs)} changed files in {folder} for {analysis_type} analysis.")
+    return file_diffs
+
+def get_changed_files_in_diff(folder, analysis_type):
+    return [file_diff['path'] for file_diff in get_file_diffs(folder, analysis_type)]
+
+def diff_between_branches(folder, analysis_type, specific_file=None):
+    base_branch = get_base_branch(folder)
+    if specific_file is None:
+        return decode_diff(run_git(folder, 'diff', *get_diff_range(analysis_type, base_branch)))
+    specific_file = specific_file.replace(os.sep, '/')
+    for file_diff in parse_diff(run_git(folder, 'diff', *get_diff_range(analysis_type, base_branch))):
+        if specific_file in (file_diff['path'], file_diff['old_path']):
+            return file_diff['text']
+    return ''
+
+class CatFileProcess:
+    """ 저장소 하나에 대한 'git cat-file --batch' 프로세스. 파일 내용을 요청마다 새 프로세스 없이 읽는다 """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(['git', '-C', self.folder, 'cat-file', '--batch'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def read(self, revision, path):
+        """ revision:path의 내용(bytes). 없는 파일이면 None """
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.process is None or self.process.poll() is not None:
+                        self.start()
+                    self.process.stdin.write(f"{revision}:{path}\n".encode('utf-8'))
+                    self.process.stdin.flush()
+                    header = self.process.stdout.readline().decode('utf-8', errors='replace').split()
+                    if len(header) != 3:
+                        return None
+                    content = self.process.stdout.read(int(header[2]))
+                    self.process.stdout.read(1)
+                    return content
+                except (OSError, ValueError):
+                    # 프로세스가 끝났으면 한 번 다시 띄운다
+                    self.close()
+                    if attempt == 1:
+                        raise
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+            self.process = None
+
+def read_file_at(folder, revision, path):
+    """ 변경 전 파일 내용 등, 특정 리비전의 파일을 텍스트로 읽는다. 저장소마다 하나의 cat-file 프로세스를 재사용하고,
+    cat-file을 쓸 수 없으면 git show로 읽는다 """
+    with _cat_files_lock:
+        cat_file = _cat_files.get(folder)
+        if cat_file is None:
+            cat_file = _cat_files[folder] = CatFileProcess(folder)
+    try:
+        content = cat_file.read(revision, path)
+    except (OSError, ValueError) as e:
+        logging.debug(f"git cat-file failed in {folder}, falling back to git show: {str(e)}")
+        try:
+            content = run_git(folder, 'show', f"{revision}:{path}")
+        except (subprocess.CalledProcessError, OSError):
+            content = None
+    return None if content is None else decode_diff(content)
+
+@atexit.register
+def close_cat_files():
+    with _cat_files_lock:
+        for cat_file in _cat_files.values():
+            cat_file.close()
+        _cat_files.clear()
+
+def get_git_blob_hashes(folder):
+    """ git 인덱스의 파일별 blob 해시와, 작업 트리에서 수정된 파일 목록을 반환 (경로는 folder 기준, '/' 구분).
+    git 저장소가 아니면 (None, set()) """
+    try:
+        staged = subprocess.check_output(['git', '-C', folder, 'ls-files', '-s', '-z'], stderr=subprocess.DEVNULL)
+        modified = subprocess.check_output(['git', '-C', folder, 'ls-files', '-m', '-z'], stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        logging.debug(f"{folder} is not a git repository, using stat-based change detection")
+        return None, set()
+
+    blobs = {}
+    for entry in staged.decode('utf-8', errors='replace').split('\0'):
+        if not entry:
+            continue
+        # <mode> <blob> <stage>\t<path>
+        info, path = entry.split('\t', 1)
+        blobs[path] = info.split()[1]
+    modified_files = set(path for path in modified.decode('utf-8', errors='replace').split('\0') if path)
+    return blobs, modified_files
@@ -0,0 +1,155 @@
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from .config import get_setting, EMBEDDING_CONCURRENCY, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_MAX_BACKOFF_SECONDS
+
+BASE_BACKOFF_SECONDS = 1.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+# 지연 시간 히스토그램의 구간 상한 (초). 마지막 구간은 그 이상 전부
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 제공자별 연결 풀 크기. 'openai'는 임베딩 동시 요청 수에 따라 늘어난다
+POOL_SIZES = {'openai': 16, 'claude': 8, 'ollama': 4}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def get_pool_size(provider):
+    size = POOL_SIZES.get(provider, 4)
+    if provider == 'openai':
+        # 임베딩 요청과 채팅/필터 요청이 같은 풀을 쓴다
+        size = max(size, int(get_setting('embedding_concurrency', EMBEDDING_CONCURRENCY)) * 2)
+    return size
+
+def get_session(provider):
+    """ 제공자마다 하나의 keep-alive Session을 공유. 재시도는 post()에서 직접 처리하므로 어댑터 재시도는 끈다 """
+    with _sessions_lock:
+        session = _sessions.get(provider)
+        if session is None:
+            size = get_pool_size(provider)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=0, pool_block=False)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[provider] = session
+        return session
+
+def parse_retry_after(value):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def get_backoff(attempt, retry_after=None):
+    if retry_after is not None:
+        return min(retry_after, HTTP_MAX_BACKOFF_SECONDS)
+    # 지수 백오프 + full jitter
+    return random.uniform(0, min(BASE_BACKOFF_SECONDS * (2 ** attempt), HTTP_MAX_BACKOFF_SECONDS))
+
+def get_provider_metrics(provider):
+    metrics = _metrics.get(provider)
+    if metrics is None:
+        metrics = _metrics[provider] = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'status_codes': {},
+            'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'latency_total': 0.0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0
+        }
+    return metrics
+
+def record_request(provider, elapsed, status_code=None):
+    with _metrics_lock:
+        metrics = get_provider_metrics(provider)
+        metrics['requests'] += 1
+        metrics['latency_total'] += elapsed
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if elapsed <= bound), len(LATENCY_BUCKETS))
+        metrics['latency_buckets'][bucket] += 1
+        key = str(status_code) if status_code is not None else 'error'
+        metrics['status_codes'][key] = metrics['status_codes'].get(key, 0) + 1
+        if status_code is None or status_code >= 400:
+            metrics['errors'] += 1
+
+def record_retry(provider):
+    with _metrics_lock:
+        get_provider_metrics(provider)['retries'] += 1
+
+def record_usage(provider, usage):
+    """ 응답의 usage를 토큰 사용량에 더한다. OpenAI(prompt/completion_tokens), Claude(input/output_tokens),
+    Ollama(prompt_eval_count/eval_count) 형식을 모두 받는다 """
+    if not usage:
+        return
+    prompt = usage.get('prompt_tokens', usage.get('input_tokens', usage.get('prompt_eval_count', 0))) or 0
+    completion = usage.get('completion_tokens', usage.get('output_tokens', usage.get('eval_count', 0))) or 0
+    with _metrics_lock:
+        metrics = get_provider_metrics(provider)
+        metrics['prompt_tokens'] += prompt
+        metrics['completion_tokens'] += completion
+
+def get_client_metrics():
+    """ 제공자별 요청 수, 재시도 수, 지연 시간 히스토그램, 토큰 사용량 """
+    with _metrics_lock:
+        result = {}
+        for provider, metrics in _metrics.items():
+            labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+            result[provider] = {
+                'requests': metrics['requests'],
+                'errors': metrics['errors'],
+                'retries': metrics['retries'],
+                'status_codes': dict(metrics['status_codes']),
+                'latency_histogram': dict(zip(labels, metrics['latency_buckets'])),
+                'average_latency': metrics['latency_total'] / metrics['requests'] if metrics['requests'] else 0.0,
+                'prompt_tokens': metrics['prompt_tokens'],
+                'completion_tokens': metrics['completion_tokens']
+            }
+        return result
+
+def is_unsent(error):
+    """ 요청을 보내기 전(연결 단계)에 난 오류인지. 이때는 서버가 요청을 받지 않았으므로 다시 보내도 안전하다 """
+    if isinstance(error, ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    return isinstance(reason, MaxRetryError) and isinstance(reason.reason, NewConnectionError)
+
+def post(provider, url, headers=None, data=None, stream=False, timeout=None, max_retries=HTTP_MAX_RETRIES, retry_rate_limit=True, idempotent=True):
+    """ 제공자의 공유 Session으로 POST. 연결 오류, 시간 초과, 429/5xx는 Retry-After를 따르거나 지터 백오프 후 재시도한다.
+    재시도 후에도 실패한 응답은 그대로 반환하므로 상태 코드 처리는 호출한 쪽에서 한다.
+    retry_rate_limit=False이면 429는 바로 반환 (자체 속도 조절을 하는 임베딩 파이프라인용).
+    idempotent=False이면 (채팅/스트리밍) 연결 단계 오류만 재시도한다. 읽기 시간 초과 뒤에 다시 보내면 프롬프트가 중복 처리·과금될 수 있다 """
+    session = get_session(provider)
+    timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            response = session.post(url, headers=headers, data=data, stream=stream, timeout=timeout)
+        except (ConnectionError, Timeout) as e:
+            record_request(provider, time.perf_counter() - start)
+            if attempt == max_retries or not (idempotent or is_unsent(e)):
+                raise
+            backoff = get_backoff(attempt)
+            logging.warning(f"{provider} request failed ({str(e)}), retrying in {backoff:.1f}s")
+            record_retry(provider)
+            time.sleep(backoff)
+            continue
+
+        record_request(provider, time.perf_counter() - start, response.status_code)
+        retryable = response.status_code in RETRY_STATUS_CODES and (retry_rate_limit or response.status_code != 429)
+        if not retryable or attempt == max_retries:
+            return response
+
+        backoff = get_backoff(attempt, parse_retry_after(response.headers.get('Retry-After')))
+        logging.warning(f"{provider} returned {response.status_code}, retrying in {backoff:.1f}s")
+        response.close()
+        record_retry(provider)
+        time.sleep(backoff)
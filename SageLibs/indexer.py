@@ -0,0 +1,198 @@
+import os
+import logging
+from .config import get_setting
+from .utilities import count_tokens_batch, get_file_paths, is_indexed_path, read_files, hash_content
+from .git_repo import get_git_blob_hashes
+from .vector_index import get_folder_index, invalidate_folder_index, schedule_ann_update
+from .ann_index import is_ann_enabled
+from .embedding_store import StoreWriter
+from .embedding_pipeline import embed_documents
+from .web_requests import get_embedding_dimensions
+from .chunker import chunk_file, CHUNKER_VERSION
+
+def get_file_state(stat, content_hash, git_blob=None):
+    return {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'inode': stat.st_ino,
+        'content_hash': content_hash,
+        'git_blob': git_blob
+    }
+
+def stat_unchanged(state, stat):
+    return (state.get('mtime_ns') == stat.st_mtime_ns
+            and state.get('size') == stat.st_size
+            and state.get('inode') == stat.st_ino)
+
+def keep_untouched(writer, existing_index, changed_paths):
+    """ 변경 목록에 없는 파일의 청크와 파일 상태를 그대로 다음 세대로 넘긴다 """
+    if existing_index is None:
+        return
+    for filename, rows in existing_index.files.items():
+        if filename in changed_paths:
+            continue
+        for row in rows:
+            writer.keep(existing_index.get_record(row))
+        file_state = existing_index.get_file_state(filename)
+        if file_state is not None:
+            writer.set_file_state(filename, file_state)
+
+def refresh_folder(folder, changed_paths=None, progress=None):
+    """ 폴더의 임베딩 저장소를 최신 상태로 갱신하고 오류가 난 파일 목록과 처리 통계를 반환.
+    changed_paths(폴더 기준 상대 경로 목록)를 주면 그 파일만 확인하고 나머지는 그대로 둔다.
+    progress(jobs.Job)를 주면 전체 파일 수와 파일마다의 완료/오류를 알리고, 작업이 취소되면 저장하지 않고 멈춘다.
+
+    파일을 열지 않고 먼저 stat(mtime, 크기, inode)을 이전 상태와 비교하고, git_change_detection 설정이 켜져 있으면
+    git 인덱스의 blob 해시가 같고 작업 트리에서 수정되지 않은 파일도 변경 없음으로 본다.
+    그 외 파일만 읽어서 content_hash를 비교하며, 사라진 파일은 저장소에서 빠진다.
+    변경 없는 청크는 기존 세그먼트를 그대로 참조하므로 디스크 쓰기는 바뀐 파일 수에 비례한다 """
+    # 이전 형식 변환이 필요하면 먼저 끝내고, 쓰기 잠금을 잡은 뒤의 인덱스를 기준으로 삼는다
+    get_folder_index(folder)
+    writer = StoreWriter(folder)
+    try:
+        existing_index = get_folder_index(folder)
+        dimensions = get_embedding_dimensions()
+        if existing_index is not None and existing_index.dimensions not in (None, dimensions):
+            # 차원이 다른 벡터는 한 저장소에 섞을 수 없으므로 모든 파일을 다시 임베딩한다
+            logging.info(f"Embedding dimensions changed ({existing_index.dimensions} -> {dimensions}), re-embedding all files in {folder}")
+            existing_index = None
+            changed_paths = None
+        if changed_paths is None:
+            file_paths = get_file_paths(folder)
+        else:
+            changed_paths = set(changed_paths)
+            file_paths = [os.path.join(folder, path) for path in sorted(changed_paths)
+                          if is_indexed_path(path) and os.path.isfile(os.path.join(folder, path))]
+            keep_untouched(writer, existing_index, changed_paths)
+        if progress is not None:
+            progress.set_total(len(file_paths))
+    except BaseException:
+        writer.abort()
+        raise
+    error_files = []
+    stats = {'files': len(file_paths), 'unchanged_stat': 0, 'unchanged_git': 0, 'unchanged_hash': 0, 'embedded': 0, 'deleted': 0}
+    pending = {}
+
+    def file_done(relative_path, error=None):
+        if error is not None:
+            error_files.append(relative_path)
+        if progress is not None:
+            progress.advance(relative_path, error)
+
+    git_blobs, git_modified = None, set()
+    # 변경 목록이 주어진 경우는 대부분 실제로 바뀐 파일이라 git 조회를 생략
+    if get_setting('git_change_detection') == 'on' and changed_paths is None:
+        git_blobs, git_modified = get_git_blob_hashes(folder)
+
+    def reuse_existing(relative_path, content_hash, file_state):
+        """ 내용과 청크 규칙이 그대로인 파일은 기존 세그먼트의 청크를 그대로 참조한다 """
+        if existing_index is None or existing_index.get_hash(relative_path) != content_hash:
+            return False
+        rows = existing_index.get_file_rows(relative_path)
+        if any(existing_index.records[row].get('chunker') != CHUNKER_VERSION for row in rows):
+            return False
+        for row in rows:
+            writer.keep(existing_index.get_record(row), file_state['mtime_ns'] / 1e9)
+        writer.set_file_state(relative_path, file_state)
+        return True
+
+    def files_to_read(to_read):
+        """ stat이나 git blob만으로 변경 없음이 확인된 파일은 바로 저장하고, 나머지는 읽을 파일로 넘긴다 """
+        for file_path in file_paths:
+            relative_path = os.path.relpath(file_path, start=folder)
+            try:
+                stat = os.stat(file_path)
+                git_path = relative_path.replace(os.sep, '/')
+                git_blob = git_blobs.get(git_path) if git_blobs is not None and git_path not in git_modified else None
+                previous = existing_index.get_file_state(relative_path) if existing_index is not None else None
+
+                if previous is not None:
+                    if stat_unchanged(previous, stat):
+                        if reuse_existing(relative_path, previous['content_hash'], get_file_state(stat, previous['content_hash'], previous.get('git_blob') or git_blob)):
+                            stats['unchanged_stat'] += 1
+                            file_done(relative_path)
+                            continue
+                    elif git_blob is not None and previous.get('git_blob') == git_blob:
+                        if reuse_existing(relative_path, previous['content_hash'], get_file_state(stat, previous['content_hash'], git_blob)):
+                            stats['unchanged_git'] += 1
+                            file_done(relative_path)
+                            continue
+
+                to_read[file_path] = (relative_path, stat, git_blob)
+            except Exception as e:
+                logging.error(f"Error processing {file_path}: {str(e)}", exc_info=True)
+                file_done(relative_path, e)
+                continue
+            yield file_path
+
+    def changed_files():
+        """ 파일을 스레드 풀에서 읽어 내용이 바뀐 파일만 청크로 나눠 넘겨준다 """
+        to_read = {}
+        for file_path, content, error in read_files(files_to_read(to_read)):
+            relative_path, stat, git_blob = to_read.pop(file_path)
+            try:
+                if error is not None:
+                    raise error
+                logging.info(f"Processing {relative_path}")
+                content_hash = hash_content(content)
+                file_state = get_file_state(stat, content_hash, git_blob)
+
+                if reuse_existing(relative_path, content_hash, file_state):
+                    stats['unchanged_hash'] += 1
+                    file_done(relative_path)
+                    continue
+
+                logging.info("  - Changes detected or new file, generating new embedding")
+                chunks = chunk_file(relative_path, content)
+                pending[relative_path] = {'chunks': chunks, 'file_state': file_state, 'embeddings': {}, 'error': None}
+            except Exception as e:
+                logging.error(f"Error processing {file_path}: {str(e)}", exc_info=True)
+                file_done(relative_path, e)
+                continue
+            for chunk in chunks:
+                yield (relative_path, chunk['chunk']), f"{relative_path}\n\n{chunk['content']}"
+
+    def on_embedded(key, embedding, error):
+        relative_path, chunk_number = key
+        state = pending[relative_path]
+        state['embeddings'][chunk_number] = embedding
+        if error:
+            state['error'] = error
+        if len(state['embeddings']) < len(state['chunks']):
+            return
+
+        del pending[relative_path]
+        if state['error']:
+            logging.error(f"Error embedding {relative_path}: {state['error']}")
+            file_done(relative_path, state['error'])
+            return
+        file_state = state['file_state']
+        # 임베딩 입력과 같은 텍스트라 배치 구성 때 센 토큰 수가 캐시에서 바로 나온다
+        chunk_tokens = count_tokens_batch([f"{relative_path}\n\n{chunk['content']}" for chunk in state['chunks']])
+        for chunk, tokens in zip(state['chunks'], chunk_tokens):
+            writer.add(relative_path, chunk['content'], file_state['content_hash'], state['embeddings'][chunk['chunk']], file_state['mtime_ns'] / 1e9,
+                       tokens, chunk['chunk'], chunk['start_line'], chunk['end_line'], CHUNKER_VERSION)
+        writer.set_file_state(relative_path, file_state)
+        stats['embedded'] += 1
+        file_done(relative_path)
+
+    try:
+        embed_documents(changed_files(), on_embedded)
+    except BaseException:
+        writer.abort()
+        raise
+
+    if existing_index is not None:
+        seen = set(os.path.relpath(file_path, start=folder) for file_path in file_paths)
+        candidates = existing_index.files if changed_paths is None else [path for path in changed_paths if path in existing_index]
+        stats['deleted'] = len([filename for filename in candidates if filename not in seen])
+        if stats['deleted']:
+            logging.info(f"Pruned {stats['deleted']} deleted files from the embedding store")
+
+    writer.commit()
+    invalidate_folder_index(folder)
+    if is_ann_enabled(folder):
+        # 새 청크를 ANN 색인에 넣는다. 다음 질문까지 끝나지 않으면 그동안은 새 청크만 정확히 계산한다
+        schedule_ann_update(folder)
+    logging.info(f"Embedding refresh stats for {folder}: {stats}")
+    return error_files, stats
@@ -0,0 +1,280 @@
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .config import JOB_WORKERS, JOB_PERSIST_INTERVAL
+
+JOBS_DB_FILE = 'SageJobs.db'
+# 끝난 작업 기록은 최근 이 개수만 남긴다
+MAX_JOB_COUNT = 200
+ACTIVE_STATUSES = ('queued', 'running')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    total INTEGER,
+    done INTEGER NOT NULL DEFAULT 0,
+    current TEXT,
+    errors TEXT NOT NULL DEFAULT '[]',
+    result TEXT,
+    message TEXT
+)
+"""
+
+class JobCancelled(BaseException):
+    """ 작업이 취소됐을 때 진행 보고 지점에서 발생. 파일 단위의 except Exception에 잡히지 않도록 BaseException을 상속 """
+
+class Job:
+    """ 실행 중인 작업의 진행 상태. 작업 함수는 set_total()/advance()로 진행을 알리고, 취소되면 advance()에서 JobCancelled가 난다.
+    write()로 내보낸 텍스트 조각은 진행 이벤트와 함께 SSE로 전달된다 """
+
+    def __init__(self, kind, key, title):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.title = title
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.total = None
+        self.done = 0
+        self.current = None
+        self.errors = []
+        self.result = None
+        self.message = None
+        # write()로 내보낸 {'item', 'text'} 조각. 진행 상태와 달리 기록하지 않고 SSE로만 보낸다
+        self.output = []
+        # 상태가 바뀔 때마다 증가. 진행 이벤트(SSE)는 이 값이 바뀔 때 보낸다
+        self.version = 0
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.changed = threading.Condition(self.lock)
+        self.persisted_at = 0.0
+
+    def set_total(self, total):
+        with self.lock:
+            self.total = total
+            self.version += 1
+            self.changed.notify_all()
+        self.persist(force=True)
+
+    def advance(self, item=None, error=None):
+        """ 항목 하나가 끝났음을 기록. error가 있으면 오류 목록에 남긴다 """
+        self.check_cancelled()
+        with self.lock:
+            self.done += 1
+            self.current = item
+            if error is not None:
+                self.errors.append({'item': item, 'error': str(error)})
+            self.version += 1
+            self.changed.notify_all()
+        self.persist()
+
+    def write(self, item, text):
+        """ 항목(파일 등)의 출력 텍스트 조각을 내보낸다. version은 바꾸지 않으므로 진행 이벤트는 보내지 않는다 """
+        self.check_cancelled()
+        with self.lock:
+            self.output.append({'item': item, 'text': text})
+            self.changed.notify_all()
+
+    def set_current(self, item):
+        self.check_cancelled()
+        with self.lock:
+            self.current = item
+            self.version += 1
+            self.changed.notify_all()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def finish(self, status, result=None, message=None):
+        with self.lock:
+            self.status = status
+            self.finished_at = time.time()
+            self.result = result
+            self.message = message
+            self.version += 1
+            self.changed.notify_all()
+        self.persist(force=True)
+
+    def to_dict(self):
+        with self.lock:
+            return self.snapshot()
+
+    def snapshot(self):
+        eta = None
+        if self.status == 'running' and self.total and self.done:
+            elapsed = time.time() - self.started_at
+            eta = elapsed / self.done * max(self.total - self.done, 0)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'key': self.key,
+            'title': self.title,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'total': self.total,
+            'done': self.done,
+            'current': self.current,
+            'errors': list(self.errors),
+            'eta_seconds': eta,
+            'result': self.result,
+            'message': self.message,
+            'version': self.version
+        }
+
+    def persist(self, force=False):
+        """ 진행 중에는 JOB_PERSIST_INTERVAL마다, 상태가 바뀔 때는 바로 기록 """
+        now = time.monotonic()
+        if not force and now - self.persisted_at < JOB_PERSIST_INTERVAL:
+            return
+        self.persisted_at = now
+        save_job(self.to_dict())
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='SageJob')
+# 대기 중이거나 실행 중인 작업. 끝난 작업의 기록은 데이터베이스에서 읽는다
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def get_connection():
+    """ 스레드마다 하나의 SQLite 연결. 처음 호출될 때, 이전 실행에서 끝나지 못한 작업을 'interrupted'로 표시한다 """
+    global _initialized
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(JOBS_DB_FILE, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        _local.connection = connection
+
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                with connection:
+                    connection.execute(SCHEMA)
+                    connection.execute("UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE status IN ('queued', 'running')", (time.time(),))
+                _initialized = True
+    return connection
+
+def save_job(job):
+    connection = get_connection()
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO jobs (id, kind, key, title, status, created_at, started_at, finished_at, total, done, current, errors, result, message) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job['id'], job['kind'], job['key'], job['title'], job['status'], job['created_at'], job['started_at'], job['finished_at'],
+             job['total'], job['done'], job['current'], json.dumps(job['errors'], ensure_ascii=False),
+             json.dumps(job['result'], ensure_ascii=False) if job['result'] is not None else None, job['message']))
+
+def row_to_job(row):
+    job = dict(row)
+    job['errors'] = json.loads(job['errors'] or '[]')
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['eta_seconds'] = None
+    job['version'] = 0
+    return job
+
+def trim_jobs():
+    connection = get_connection()
+    with connection:
+        row = connection.execute('SELECT created_at FROM jobs ORDER BY created_at DESC LIMIT 1 OFFSET ?', (MAX_JOB_COUNT - 1,)).fetchone()
+        if row is not None:
+            connection.execute(f"DELETE FROM jobs WHERE created_at < ? AND status NOT IN {ACTIVE_STATUSES}", (row['created_at'],))
+
+def run_job(job, run):
+    try:
+        with job.lock:
+            cancelled = job.cancel_event.is_set()
+            if not cancelled:
+                job.status = 'running'
+                job.started_at = time.time()
+                job.version += 1
+                job.changed.notify_all()
+        if cancelled:
+            job.finish('cancelled', message='Cancelled before start')
+            return
+        job.persist(force=True)
+
+        logging.info(f"Job {job.id} started: {job.title}")
+        result = run(job)
+    except JobCancelled:
+        logging.info(f"Job {job.id} cancelled")
+        job.finish('cancelled', message='Cancelled')
+    except Exception as e:
+        logging.error(f"Job {job.id} failed: {str(e)}", exc_info=True)
+        job.finish('failed', message=str(e))
+    else:
+        job.finish('done', result=result)
+        logging.info(f"Job {job.id} finished: {job.title}")
+    finally:
+        with _jobs_lock:
+            _jobs.pop(job.id, None)
+        trim_jobs()
+
+def submit_job(kind, key, title, run):
+    """ run(job)을 작업 풀에서 실행하고 (job_id, created)를 반환.
+    같은 key의 작업이 대기 중이거나 실행 중이면 새로 만들지 않고 그 작업의 id를 돌려준다 """
+    with _jobs_lock:
+        for job in _jobs.values():
+            if job.key == key and job.status in ACTIVE_STATUSES and not job.cancel_event.is_set():
+                return job.id, False
+        job = Job(kind, key, title)
+        _jobs[job.id] = job
+    job.persist(force=True)
+    _executor.submit(run_job, job, run)
+    return job.id, True
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    row = get_connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return row_to_job(row) if row else None
+
+def list_jobs(limit=20):
+    """ 최근 작업 목록 (최신순). 실행 중인 작업은 메모리의 최신 진행 상태를 쓴다 """
+    rows = get_connection().execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+    with _jobs_lock:
+        active = dict(_jobs)
+    return [active[row['id']].to_dict() if row['id'] in active else row_to_job(row) for row in rows]
+
+def cancel_job(job_id):
+    """ 작업 취소를 요청. 실행 중인 작업은 다음 진행 보고 지점에서 멈춘다 """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return False
+    job.cancel_event.set()
+    with job.lock:
+        job.version += 1
+        job.changed.notify_all()
+    return True
+
+def wait_for_change(job_id, version, output_offset=0, timeout=15.0):
+    """ 작업의 version이 바뀌거나, output_offset 뒤에 새 출력이 생기거나, timeout이 지날 때까지 기다린 뒤
+    (최신 상태, output_offset 이후의 출력 조각)을 반환 (SSE용). 끝나서 메모리에 없는 작업의 출력은 남아 있지 않다 """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return get_job(job_id), []
+    with job.lock:
+        job.changed.wait_for(lambda: job.version != version or len(job.output) > output_offset, timeout=timeout)
+        return job.snapshot(), job.output[output_offset:]
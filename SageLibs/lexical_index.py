@@ -0,0 +1,138 @@
+import re
+import math
+import logging
+import numpy as np
+from array import array
+
+# 식별자(영문/숫자/_), 숫자, 그 외 문자(한글 등)의 단어를 토큰으로 본다
+TOKEN_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|[0-9]+|[^\W\d_]+')
+# camelCase/PascalCase/snake_case 식별자를 이루는 단어
+IDENTIFIER_PART = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+MAX_FREQUENCY = np.iinfo(np.uint16).max
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text):
+    """ 소문자로 바꾼 검색어 목록. 식별자는 전체와 함께 이루는 단어들도 넣어서
+    'get_relevant_documents'나 'FolderIndex'를 전체로도, 'relevant'나 'folder'로도 찾을 수 있게 한다 """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if len(token) < MIN_TERM_LENGTH or len(token) > MAX_TERM_LENGTH:
+            continue
+        terms.append(token.lower())
+        if token.isascii() and not token.islower() or '_' in token:
+            parts = IDENTIFIER_PART.findall(token)
+            if len(parts) > 1:
+                terms.extend(part.lower() for part in parts if len(part) >= MIN_TERM_LENGTH)
+    return terms
+
+class SegmentBuilder:
+    """ 세그먼트 하나의 역색인(검색어 -> 행 번호, 빈도)과 행별 문서 길이를 모은다 """
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = array('i')
+
+    def add(self, row, filename, content):
+        while len(self.lengths) <= row:
+            self.lengths.append(0)
+        terms = tokenize(filename + '\n' + content)
+        self.lengths[row] = len(terms)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            rows, frequencies = self.postings.setdefault(term, (array('i'), array('H')))
+            rows.append(row)
+            frequencies.append(min(count, MAX_FREQUENCY))
+
+    def build(self):
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self.postings[term][0])
+        return {
+            'vocabulary': np.frombuffer('\n'.join(terms).encode('utf-8'), dtype=np.uint8),
+            'offsets': offsets,
+            'rows': np.frombuffer(b''.join(self.postings[term][0].tobytes() for term in terms), dtype=np.int32),
+            'frequencies': np.frombuffer(b''.join(self.postings[term][1].tobytes() for term in terms), dtype=np.uint16),
+            'lengths': np.frombuffer(self.lengths.tobytes(), dtype=np.int32)
+        }
+
+    def save(self, f):
+        np.savez(f, **self.build())
+
+    def finish(self):
+        return LexicalSegment(self.build())
+
+class LexicalSegment:
+    def __init__(self, arrays):
+        vocabulary = bytes(arrays['vocabulary']).decode('utf-8')
+        self.terms = {term: i for i, term in enumerate(vocabulary.split('\n'))} if vocabulary else {}
+        self.offsets = arrays['offsets']
+        self.rows = arrays['rows']
+        self.frequencies = arrays['frequencies']
+        self.lengths = arrays['lengths']
+
+    def get_postings(self, term):
+        i = self.terms.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rows[start:end], self.frequencies[start:end]
+
+def load_segment(path):
+    with np.load(path) as arrays:
+        return LexicalSegment({name: arrays[name] for name in arrays.files})
+
+class LexicalIndex:
+    """ 한 폴더의 세그먼트별 역색인을 묶어 BM25 점수를 계산.
+    세그먼트 순서와 행 위치는 FolderIndex의 점수 배열과 같고, 문서 빈도와 평균 길이는 살아 있는 행만으로 센다 """
+
+    def __init__(self, segments, positions, total):
+        self.segments = segments
+        self.positions = positions
+        self.lengths = np.zeros(total, dtype=np.float32)
+        for offset, segment in segments:
+            self.lengths[offset:offset + len(segment.lengths)] = segment.lengths
+        self.live = np.zeros(total, dtype=bool)
+        self.live[positions] = True
+        live_lengths = self.lengths[positions]
+        self.average_length = float(live_lengths.mean()) if len(live_lengths) and live_lengths.mean() > 0 else 1.0
+
+    def score(self, query):
+        """ 질문의 검색어별 BM25 점수를 더한 행(레코드) 순서의 배열. 검색어가 하나도 없으면 None """
+        terms = set(tokenize(query))
+        if not terms or not len(self.positions):
+            return None
+
+        scores = np.zeros(len(self.lengths), dtype=np.float32)
+        document_count = len(self.positions)
+        matched = False
+        for term in terms:
+            postings = []
+            for offset, segment in self.segments:
+                found = segment.get_postings(term)
+                if found is None:
+                    continue
+                rows, frequencies = found
+                rows = rows.astype(np.int64) + offset
+                live = self.live[rows]
+                postings.append((rows[live], frequencies[live].astype(np.float32)))
+            frequency = sum(len(rows) for rows, _ in postings)
+            if frequency == 0:
+                continue
+            matched = True
+            idf = math.log(1 + (document_count - frequency + 0.5) / (frequency + 0.5))
+            for rows, frequencies in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[rows] / self.average_length)
+                scores[rows] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+
+        if not matched:
+            logging.debug(f"No lexical matches for terms: {sorted(terms)}")
+            return None
+        return scores[self.positions]
@@ -1,53 +1,209 @@
-from tinydb import TinyDB, Query
-from flask import flash
+import os
 import re
-from sklearn.metrics.pairwise import cosine_similarity
+import json
+import logging
+import sqlite3
+import threading
 import numpy as np
-from .config import SIMILARITY_THRESHOLD, get_setting
+from flask import flash, has_request_context
+from .config import SIMILARITY_THRESHOLD, ANSWER_CACHE_SIMILARITY, get_setting
 from .web_requests import get_embedding
-from .utilities import hash_content, count_tokens
+from .utilities import hash_content, count_tokens, truncate_embeddings
+from .vector_index import get_folder_index
 
-db = TinyDB('SageQuestions.json')
-MAX_HISTORY_COUNT = 512 
+QUESTIONS_DB_FILE = 'SageQuestions.db'
+# TinyDB를 쓰던 이전 형식. 데이터베이스가 처음 만들어질 때 한 번 옮겨 온다
+LEGACY_QUESTIONS_FILE = 'SageQuestions.json'
+MAX_HISTORY_COUNT = 512
+# 유사한 이전 답변 후보는 이 개수까지만 골라서 정렬
+HISTORY_TOP_K = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    content_hash TEXT,
+    tokens INTEGER,
+    embedding BLOB,
+    question_embedding BLOB,
+    sources TEXT
+)
+"""
+# 답변 캐시를 위해 나중에 추가한 열. 이전 데이터베이스에는 처음 연결할 때 추가한다
+ADDED_COLUMNS = {'question_embedding': 'BLOB', 'sources': 'TEXT'}
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+# 질문 이력 임베딩 캐시: id 순서로 정렬된 정규화 행렬과, 같은 행 순서의 id/토큰 수 배열
+_history_lock = threading.Lock()
+_history = None
+# 답변 캐시용 질문 임베딩 캐시: 차원이 같은 질문만 id 순서로 담은 정규화 행렬. 같은 잠금을 쓴다
+_question_cache = None
+
+def get_connection():
+    """ 스레드마다 하나의 SQLite 연결을 사용. 처음 호출될 때 테이블을 만들고 이전 JSON 이력을 옮긴다 """
+    global _initialized
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(QUESTIONS_DB_FILE, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        _local.connection = connection
+
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                with connection:
+                    connection.execute(SCHEMA)
+                    columns = set(row['name'] for row in connection.execute('PRAGMA table_info(questions)'))
+                    for name, kind in ADDED_COLUMNS.items():
+                        if name not in columns:
+                            connection.execute(f'ALTER TABLE questions ADD COLUMN {name} {kind}')
+                migrate_tinydb(connection)
+                _initialized = True
+    return connection
+
+def migrate_tinydb(connection):
+    if not os.path.exists(LEGACY_QUESTIONS_FILE):
+        return
+    if connection.execute('SELECT 1 FROM questions LIMIT 1').fetchone() is not None:
+        return
+
+    with open(LEGACY_QUESTIONS_FILE, 'r', encoding='utf-8') as f:
+        documents = json.load(f).get('_default', {})
+
+    with connection:
+        for doc_id, document in sorted(documents.items(), key=lambda item: int(item[0])):
+            connection.execute(
+                'INSERT INTO questions (id, title, question, answer, content_hash, tokens, embedding) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (int(doc_id), document['title'], document['question'], document['answer'], document.get('content_hash'),
+                 count_tokens(document['title'] + "\n\n" + document['answer']), to_blob(document.get('embedding'))))
+    logging.info(f"Migrated {len(documents)} questions from {LEGACY_QUESTIONS_FILE} to {QUESTIONS_DB_FILE}")
+
+def to_blob(embedding):
+    return None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
 
 def get_all_questions(revert=False):
-    questions = db.all()
-    if revert:
-        questions.reverse()
-    return questions
+    """ 사이드바용 (doc_id, title) 목록. 본문과 임베딩은 읽지 않는다 """
+    order = 'DESC' if revert else 'ASC'
+    rows = get_connection().execute(f'SELECT id, title FROM questions ORDER BY id {order}').fetchall()
+    return [{'doc_id': row['id'], 'title': row['title']} for row in rows]
 
 def get_question_by_id(question_id):
-    question_record = db.get(doc_id=question_id)
-    if not question_record:
+    row = get_connection().execute('SELECT id, title, question, answer, content_hash FROM questions WHERE id = ?', (question_id,)).fetchone()
+    if not row:
         flash("Requested question does not exist.", "error")
         return None
-    return question_record
+    return dict(row, doc_id=row['id'])
 
-def insert_question(question, answer):
+def insert_question(question, answer, question_embedding=None, sources=None):
+    """ 질문과 답변을 저장. 답변 캐시에 쓸 수 있도록 질문만의 임베딩과 답변에 쓴 문서 목록(get_sources)을 함께 받는다 """
     title = extract_first_sentence(question)
     combined_content = f"{question}\n\n{answer}"
     content_hash = hash_content(combined_content)
-    
+    tokens = count_tokens(title + "\n\n" + answer)
+
     try:
         embedding = get_embedding(combined_content)
     except Exception as e:
-        flash(f"Error generating embedding: {str(e)}", "error")
+        logging.error(f"Error generating embedding: {str(e)}")
+        # 백그라운드 작업에서 저장할 때는 요청 컨텍스트가 없다
+        if has_request_context():
+            flash(f"Error generating embedding: {str(e)}", "error")
         embedding = None
 
-    doc_id = db.insert({
-        'question': question, 
-        'answer': answer, 
-        'title': title,
-        'content_hash': content_hash,
-        'embedding': embedding
-    })
+    connection = get_connection()
+    with connection:
+        doc_id = connection.execute(
+            'INSERT INTO questions (title, question, answer, content_hash, tokens, embedding, question_embedding, sources) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (title, question, answer, content_hash, tokens, to_blob(embedding), to_blob(question_embedding),
+             None if sources is None else json.dumps(sources, ensure_ascii=False))).lastrowid
+    if embedding is not None:
+        add_history_embedding(doc_id, embedding, tokens)
+    if question_embedding is not None:
+        add_question_embedding(doc_id, question_embedding)
     maintain_history_limit()
     return doc_id
 
+def get_sources(docs):
+    """ 답변에 쓴 문서마다 폴더, 파일명과 지금의 content_hash """
+    sources = []
+    seen = set()
+    for doc in docs:
+        key = (doc.get('folder'), doc['filename'])
+        if key in seen or not doc.get('folder'):
+            continue
+        seen.add(key)
+        index = get_folder_index(doc['folder'])
+        sources.append({'folder': doc['folder'], 'filename': doc['filename'], 'content_hash': index.get_hash(doc['filename']) if index else None})
+    return sources
+
+def check_sources(sources, folders):
+    """ 저장된 답변에 쓴 문서가 지금도 선택한 폴더에 그대로 있으면 None, 아니면 그 이유 """
+    if sources is None:
+        return "documents used for the answer were not recorded"
+    sources = json.loads(sources)
+    if not sources:
+        # 문서 없이 만든 답변은 어떤 폴더를 선택했을 때의 답인지 알 수 없다
+        return "the answer used no documents"
+    selected = set(os.path.abspath(folder) for folder in folders)
+    for source in sources:
+        if os.path.abspath(source['folder']) not in selected:
+            return f"folder {source['folder']} is not selected"
+        index = get_folder_index(source['folder'])
+        content_hash = index.get_hash(source['filename']) if index else None
+        if content_hash is None:
+            return f"{source['filename']} is no longer indexed"
+        if content_hash != source['content_hash']:
+            return f"{source['filename']} has changed"
+    return None
+
+def find_cached_answer(question_embedding, folders, threshold=ANSWER_CACHE_SIMILARITY):
+    """ 질문 임베딩과의 유사도가 threshold 이상인 이전 질문 중, 답변에 쓴 문서가 그대로인 가장 비슷한 질문의 (레코드, 유사도).
+    없으면 (None, 이유). 적중과 실패 이유를 로그에 남긴다 """
+    query = truncate_embeddings(question_embedding, len(question_embedding))
+    # 임베딩 차원이 바뀌기 전에 저장한 질문은 비교하지 않는다
+    cache = get_question_cache(len(query))
+    if cache['matrix'] is None:
+        stored = get_connection().execute('SELECT 1 FROM questions WHERE question_embedding IS NOT NULL LIMIT 1').fetchone()
+        reason = "no stored questions with the same embedding dimensions" if stored else "no stored questions"
+        logging.info(f"Answer cache miss: {reason}")
+        return None, reason
+
+    ids = cache['ids']
+    similarities = cache['matrix'] @ query
+    candidates = np.flatnonzero(similarities >= threshold)
+    if not len(candidates):
+        reason = f"no similar question (best similarity {similarities.max():.3f} < {threshold})"
+        logging.info(f"Answer cache miss: {reason}")
+        return None, reason
+
+    # 유사도 내림차순, 같은 유사도는 최근 질문 먼저
+    reasons = []
+    for row in candidates[np.lexsort((-ids[candidates], -similarities[candidates]))]:
+        record = get_connection().execute('SELECT id, title, question, answer, sources FROM questions WHERE id = ?', (int(ids[row]),)).fetchone()
+        if record is None:
+            continue
+        reason = check_sources(record['sources'], folders)
+        if reason is None:
+            logging.info(f"Answer cache hit: question {record['id']} (similarity {similarities[row]:.3f})")
+            return dict(record, doc_id=record['id']), float(similarities[row])
+        reasons.append(f"question {record['id']} (similarity {similarities[row]:.3f}): {reason}")
+
+    reason = '; '.join(reasons) or "similar questions were deleted"
+    logging.info(f"Answer cache miss: {reason}")
+    return None, reason
+
 def delete_question(question_id):
-    question = db.get(doc_id=question_id)
-    if question:
-        db.remove(doc_ids=[question_id])
+    connection = get_connection()
+    with connection:
+        deleted = connection.execute('DELETE FROM questions WHERE id = ?', (question_id,)).rowcount
+    if deleted:
+        remove_history_embeddings(lambda ids: ids == question_id)
         return True
     return False
 
@@ -56,53 +212,151 @@ def extract_first_sentence(text):
     return first_sentence if first_sentence else text
 
 def maintain_history_limit():
-    """ 이력의 최대 개수를 유지하기 위해 필요한 경우 가장 오래된 이력을 제거 """
-    all_questions = db.all()
-    if len(all_questions) > MAX_HISTORY_COUNT:
-        number_to_delete = len(all_questions) - MAX_HISTORY_COUNT
-        # TinyDB는 도큐먼트 추가 순으로 ID가 부여되므로, ID가 작은 것부터 삭제
-        for _ in range(number_to_delete):
-            min_id = min(question.doc_id for question in all_questions)
-            db.remove(doc_ids=[min_id])
-            all_questions = db.all()  # 재조회 필요
+    """ 이력의 최대 개수를 유지하기 위해 필요한 경우 가장 오래된 이력을 한 번의 DELETE로 제거 """
+    connection = get_connection()
+    with connection:
+        # id는 추가 순으로 증가하므로, 최근 MAX_HISTORY_COUNT개보다 id가 작은 것을 모두 삭제
+        row = connection.execute('SELECT id FROM questions ORDER BY id DESC LIMIT 1 OFFSET ?', (MAX_HISTORY_COUNT - 1,)).fetchone()
+        if row is None:
+            return
+        deleted = connection.execute('DELETE FROM questions WHERE id < ?', (row['id'],)).rowcount
+    if deleted:
+        remove_history_embeddings(lambda ids: ids < row['id'])
 
-def get_relevant_answers(question_embedding, similarity_threshold=SIMILARITY_THRESHOLD, max_tokens=80000):
-    if get_setting('use_question_history') != 'on':
-        return []
+def load_history():
+    rows = get_connection().execute('SELECT id, tokens, embedding FROM questions WHERE embedding IS NOT NULL ORDER BY id').fetchall()
+    if not rows:
+        return {'ids': np.zeros(0, dtype=np.int64), 'tokens': np.zeros(0, dtype=np.int64), 'matrix': None}
+    vectors = [np.frombuffer(row['embedding'], dtype=np.float32) for row in rows]
+    # embedding_dimensions를 바꾸기 전후의 질문이 섞여 있으면 가장 짧은 차원에 맞춘다
+    dimensions = min(len(vector) for vector in vectors)
+    matrix = np.stack([vector[:dimensions] for vector in vectors])
+    return {
+        'ids': np.array([row['id'] for row in rows], dtype=np.int64),
+        'tokens': np.array([row['tokens'] or 0 for row in rows], dtype=np.int64),
+        'matrix': normalize(matrix)
+    }
 
-    all_questions = db.all()
-    all_questions.reverse()
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
 
-    relevant_questions = []
-    total_tokens = 0
+def get_history():
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = load_history()
+        return _history
 
-    # 모든 질문의 임베딩을 numpy 배열로 변환
-    all_embeddings = np.array([q['embedding'] for q in all_questions if q['embedding'] is not None])
-    
-    if len(all_embeddings) > 0:
-        # 코사인 유사도 계산
-        similarities = cosine_similarity([question_embedding], all_embeddings)[0]
+def load_question_cache(dimensions):
+    rows = get_connection().execute('SELECT id, question_embedding FROM questions WHERE length(question_embedding) = ? ORDER BY id',
+                                    (dimensions * 4,)).fetchall()
+    return {
+        'dimensions': dimensions,
+        'ids': np.array([row['id'] for row in rows], dtype=np.int64),
+        'matrix': normalize(np.stack([np.frombuffer(row['question_embedding'], dtype=np.float32) for row in rows])) if rows else None
+    }
 
-        # 유사도가 높은 순으로 정렬
-        sorted_indices = np.argsort(similarities)[::-1]
+def get_question_cache(dimensions):
+    """ 차원이 dimensions인 질문 임베딩 캐시. 설정한 차원이 바뀌었으면 다시 읽는다 """
+    global _question_cache
+    with _history_lock:
+        if _question_cache is None or _question_cache['dimensions'] != dimensions:
+            _question_cache = load_question_cache(dimensions)
+        return _question_cache
 
-        for idx in sorted_indices:
-            if similarities[idx] < similarity_threshold:
-                break
+def add_question_embedding(doc_id, question_embedding):
+    global _question_cache
+    with _history_lock:
+        cache = _question_cache
+        if cache is None or cache['dimensions'] != len(question_embedding) or (len(cache['ids']) and cache['ids'][-1] >= doc_id):
+            return
+        vector = normalize(np.asarray([question_embedding], dtype=np.float32))
+        _question_cache = {
+            'dimensions': cache['dimensions'],
+            'ids': np.append(cache['ids'], doc_id),
+            'matrix': vector if cache['matrix'] is None else np.concatenate([cache['matrix'], vector])
+        }
 
-            question = all_questions[idx]
-            answer_tokens = count_tokens(question['title'] + "\n\n" + question['answer'])
+def add_history_embedding(doc_id, embedding, tokens):
+    """ 새 질문의 정규화된 임베딩을 캐시 행렬 끝에 붙인다 (id가 가장 크므로 정렬 유지) """
+    global _history
+    with _history_lock:
+        # 캐시가 아직 없거나, 커밋 직후 다른 스레드가 이미 이 행까지 읽어 들인 경우
+        if _history is None or (len(_history['ids']) and _history['ids'][-1] >= doc_id):
+            return
+        if _history['matrix'] is not None and _history['matrix'].shape[1] != len(embedding):
+            # 차원이 바뀌었으면 다음에 다시 읽는다
+            _history = None
+            return
+        vector = normalize(np.asarray([embedding], dtype=np.float32))
+        matrix = vector if _history['matrix'] is None else np.concatenate([_history['matrix'], vector])
+        _history = {
+            'ids': np.append(_history['ids'], doc_id),
+            'tokens': np.append(_history['tokens'], tokens),
+            'matrix': matrix
+        }
 
-            if total_tokens + answer_tokens > max_tokens:
-                break
+def remove_history_embeddings(select):
+    """ select(ids)가 True인 행을 이력 캐시와 질문 임베딩 캐시에서 뺀다 """
+    global _history, _question_cache
+    with _history_lock:
+        if _history is not None and _history['matrix'] is not None:
+            keep = ~select(_history['ids'])
+            _history = {
+                'ids': _history['ids'][keep],
+                'tokens': _history['tokens'][keep],
+                'matrix': np.ascontiguousarray(_history['matrix'][keep]) if keep.any() else None
+            }
+        if _question_cache is not None and _question_cache['matrix'] is not None:
+            keep = ~select(_question_cache['ids'])
+            _question_cache = {
+                'dimensions': _question_cache['dimensions'],
+                'ids': _question_cache['ids'][keep],
+                'matrix': np.ascontiguousarray(_question_cache['matrix'][keep]) if keep.any() else None
+            }
+
+def get_relevant_answers(question_embedding, similarity_threshold=SIMILARITY_THRESHOLD, max_tokens=80000):
+    if get_setting('use_question_history') != 'on':
+        return []
 
-            relevant_questions.append({
-                "tokens": answer_tokens,
-                "title": question['title'],
-                "similarity": float(similarities[idx]),  # numpy.float32를 Python float으로 변환
-                "answer": question['answer']
-            })
+    history = get_history()
+    if history['matrix'] is None:
+        return []
+
+    matrix = history['matrix']
+    dimensions = min(matrix.shape[1], len(question_embedding))
+    if matrix.shape[1] > dimensions:
+        matrix = truncate_embeddings(matrix, dimensions)
+    query = truncate_embeddings(question_embedding, dimensions)
+    similarities = matrix @ query
+
+    candidates = np.flatnonzero(similarities >= similarity_threshold)
+    if len(candidates) > HISTORY_TOP_K:
+        candidates = candidates[np.argpartition(-similarities[candidates], HISTORY_TOP_K - 1)[:HISTORY_TOP_K]]
+    # 유사도 내림차순, 같은 유사도는 최근 질문 먼저
+    candidates = candidates[np.lexsort((-history['ids'][candidates], -similarities[candidates]))]
+
+    selected = []
+    total_tokens = 0
+    for row in candidates:
+        answer_tokens = int(history['tokens'][row])
+        if max_tokens is not None and total_tokens + answer_tokens > max_tokens:
+            break
+        selected.append((int(history['ids'][row]), answer_tokens, float(similarities[row])))
+        total_tokens += answer_tokens
+
+    if not selected:
+        return []
 
-            total_tokens += answer_tokens
+    placeholders = ','.join('?' * len(selected))
+    rows = get_connection().execute(f'SELECT id, title, answer FROM questions WHERE id IN ({placeholders})', [doc_id for doc_id, _, _ in selected]).fetchall()
+    answers = {row['id']: row for row in rows}
 
-    return relevant_questions
\ No newline at end of file
+    return [{
+        "tokens": tokens,
+        "title": answers[doc_id]['title'],
+        "similarity": similarity,
+        "answer": answers[doc_id]['answer']
+    } for doc_id, tokens, similarity in selected if doc_id in answers]
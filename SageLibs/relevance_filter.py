@@ -0,0 +1,69 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from .config import FILTER_CONCURRENCY, FILTER_CACHE_SIZE
+from .web_requests import summarize_content
+from .utilities import hash_content
+
+_executor = ThreadPoolExecutor(max_workers=FILTER_CONCURRENCY, thread_name_prefix='SageFilter')
+
+# (질문 해시, 본문 해시) -> 관련 여부. 최근에 쓴 것부터 FILTER_CACHE_SIZE개를 유지
+_verdicts = OrderedDict()
+_verdicts_lock = threading.Lock()
+
+def get_item_text(item):
+    return item['content'] if 'filename' in item else item['answer']
+
+def parse_verdict(text):
+    """ 'Related'/'Unrelated' 응답을 True/False로. 응답이 없거나 알 수 없으면 None """
+    verdict = (text or '').strip().strip('\'".').lower()
+    if verdict.startswith('unrelated') or verdict.startswith('not related'):
+        return False
+    if verdict.startswith('related'):
+        return True
+    return None
+
+def get_cached_verdict(key):
+    with _verdicts_lock:
+        if key in _verdicts:
+            _verdicts.move_to_end(key)
+            return _verdicts[key]
+        return None
+
+def cache_verdict(key, related):
+    with _verdicts_lock:
+        _verdicts[key] = related
+        _verdicts.move_to_end(key)
+        while len(_verdicts) > FILTER_CACHE_SIZE:
+            _verdicts.popitem(last=False)
+
+def judge(question, text, key):
+    related = parse_verdict(summarize_content(question, text))
+    # 요청이 실패한 경우(None)는 캐시하지 않고 다음 질문에서 다시 판정
+    if related is not None:
+        cache_verdict(key, related)
+    return related
+
+def judge_items(question, items, timeout):
+    """ 항목들의 관련 여부를 동시에 판정해 같은 순서의 [True/False/None]을 반환.
+    timeout 안에 끝나지 않은 판정은 None이며, 요청은 계속 진행돼 결과가 캐시에 남는다 """
+    question_hash = hash_content(question)
+    verdicts = [None] * len(items)
+    futures = {}
+    for i, item in enumerate(items):
+        text = get_item_text(item)
+        key = (question_hash, hash_content(text))
+        cached = get_cached_verdict(key)
+        if cached is not None:
+            verdicts[i] = cached
+        elif timeout > 0:
+            futures[_executor.submit(judge, question, text, key)] = i
+
+    if futures:
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            verdicts[futures[future]] = future.result()
+        if not_done:
+            logging.warning(f"Relevance filter deadline reached, keeping {len(not_done)} unjudged items")
+    return verdicts
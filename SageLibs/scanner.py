@@ -0,0 +1,134 @@
+import os
+import re
+import logging
+import threading
+from .config import get_setting, get_settings_version, EMBEDDINGS_DIR
+
+GLOB_CHARACTERS = re.compile(r'[*?\[]')
+
+_matcher = None
+_matcher_version = None
+_matcher_lock = threading.Lock()
+
+def glob_to_regex(pattern):
+    """ gitignore 방식의 glob을 정규식으로 바꾼다. '*'와 '?'는 '/'를 넘지 않고, '**'는 여러 단계의 디렉터리와 일치 """
+    regex = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+            continue
+
+        c = pattern[i]
+        if c == '*':
+            regex.append('[^/]*')
+        elif c == '?':
+            regex.append('[^/]')
+        elif c == '[' and pattern.find(']', i + 1) > i + 1:
+            end = pattern.find(']', i + 1)
+            body = pattern[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex.append(f"[{body}]")
+            i = end + 1
+            continue
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return ''.join(regex)
+
+def compile_patterns(patterns):
+    """ 무시 목록을 (정확한 이름 set, 이름 glob 정규식, 경로 glob 정규식)으로 나눠 미리 컴파일.
+    '/'가 들어간 패턴은 폴더 기준 상대 경로 전체와, 그 외 패턴은 이름과 비교한다 """
+    names = set()
+    name_globs = []
+    path_globs = []
+    for pattern in patterns:
+        pattern = pattern.strip().rstrip('/')
+        if not pattern:
+            continue
+        if '/' in pattern:
+            path_globs.append(glob_to_regex(pattern.lstrip('/')))
+        elif GLOB_CHARACTERS.search(pattern):
+            name_globs.append(glob_to_regex(pattern))
+        else:
+            names.add(pattern)
+
+    name_regex = re.compile('^(?:' + '|'.join(name_globs) + ')$') if name_globs else None
+    # 디렉터리 경로와 일치하는 패턴은 그 안의 모든 파일과도 일치
+    path_regex = re.compile('^(?:' + '|'.join(path_globs) + ')(?:/.*)?$') if path_globs else None
+    return names, name_regex, path_regex
+
+class PathMatcher:
+    """ 설정의 확장자/무시 파일/무시 폴더 규칙을 미리 컴파일해 둔 것. 상대 경로는 '/'로 구분한다 """
+
+    def __init__(self, extensions, ignore_files, ignore_folders):
+        self.extensions = tuple(extensions)
+        self.file_names, self.file_name_regex, self.file_path_regex = compile_patterns(ignore_files)
+        self.folder_names, self.folder_name_regex, self.folder_path_regex = compile_patterns(ignore_folders)
+        self.folder_names.add(EMBEDDINGS_DIR)
+
+    def skip_folder(self, name, relative_path):
+        return (name in self.folder_names
+                or (self.folder_name_regex is not None and self.folder_name_regex.match(name) is not None)
+                or (self.folder_path_regex is not None and self.folder_path_regex.match(relative_path) is not None))
+
+    def accept_file(self, name, relative_path):
+        return (name.endswith(self.extensions)
+                and name not in self.file_names
+                and (self.file_name_regex is None or self.file_name_regex.match(name) is None)
+                and (self.file_path_regex is None or self.file_path_regex.match(relative_path) is None))
+
+    def accept_path(self, relative_path):
+        """ 상위 폴더까지 포함해 상대 경로 하나를 검사 (폴더 감시 이벤트 등 개별 파일용) """
+        parts = relative_path.replace(os.sep, '/').split('/')
+        for depth in range(len(parts) - 1):
+            if self.skip_folder(parts[depth], '/'.join(parts[:depth + 1])):
+                return False
+        return self.accept_file(parts[-1], '/'.join(parts))
+
+def get_path_matcher():
+    """ 현재 설정으로 컴파일된 PathMatcher. 설정이 바뀐 경우에만 다시 만든다 """
+    global _matcher, _matcher_version
+    version = get_settings_version()
+    with _matcher_lock:
+        if _matcher is None or _matcher_version != version:
+            _matcher = PathMatcher(get_setting('extensions', []), get_setting('ignore_files', []), get_setting('ignore_folders', []))
+            _matcher_version = version
+        return _matcher
+
+def scan_files(folder, matcher=None):
+    """ os.scandir로 폴더를 훑어 임베딩 대상 파일 경로 목록을 반환. 순서는 os.walk(top-down)와 같다 """
+    matcher = matcher or get_path_matcher()
+    file_paths = []
+    stack = [(folder, '')]
+    while stack:
+        directory, relative = stack.pop()
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name
+                    relative_path = f"{relative}/{name}" if relative else name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not matcher.skip_folder(name, relative_path):
+                                subdirectories.append((entry.path, relative_path))
+                            continue
+                        # os.walk처럼 디렉터리를 가리키는 심볼릭 링크는 따라가지 않는다
+                        if entry.is_symlink() and entry.is_dir():
+                            continue
+                    except OSError:
+                        continue
+                    if matcher.accept_file(name, relative_path):
+                        file_paths.append(entry.path)
+        except OSError as e:
+            logging.debug(f"Cannot scan {directory}: {str(e)}")
+            continue
+        stack.extend(reversed(subdirectories))
+    return file_paths
@@ -0,0 +1,173 @@
+import re
+import ast
+import json
+import logging
+import textwrap
+
+PYTHON_EXTENSIONS = ('.py',)
+JS_EXTENSIONS = ('.js', '.jsx', '.ts', '.tsx')
+JAVA_EXTENSIONS = ('.java', '.cs')
+GO_EXTENSIONS = ('.go',)
+
+KEYWORDS = set('''
+if else elif for foreach while do switch case catch try finally return throw throws new delete typeof instanceof sizeof
+function func class interface struct enum record type def lambda yield await async import from package using namespace
+public private protected internal static final abstract override virtual readonly const let var void super this self
+'''.split())
+
+# 정의: 첫 번째 그룹이 정의한 이름인 정규식
+JS_DEFINITIONS = [
+    re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)', re.MULTILINE),
+    re.compile(r'^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?(?:class|interface|enum|type)\s+([A-Za-z_$][\w$]*)', re.MULTILINE),
+    re.compile(r'^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*(?::[^=]+)?=\s*(?:async\s+)?(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|[A-Za-z_$][\w$]*\s*=>)', re.MULTILINE),
+    re.compile(r'^\s*(?:(?:public|private|protected|static|async|get|set|readonly)\s+)*([A-Za-z_$][\w$]*)\s*\([^()]*\)\s*(?::\s*[^{=;]+)?\{', re.MULTILINE)
+]
+JAVA_DEFINITIONS = [
+    re.compile(r'\b(?:class|interface|enum|record|struct)\s+([A-Za-z_]\w*)'),
+    re.compile(r'^\s*(?:(?:public|private|protected|internal|static|final|abstract|override|virtual|async|sealed|synchronized|partial)\s+)*[\w<>\[\],.?]+\s+([A-Za-z_]\w*)\s*\([^;{]*\)\s*(?:throws\s+[\w.,\s]+)?\s*\{?\s*$', re.MULTILINE)
+]
+GO_DEFINITIONS = [
+    re.compile(r'^func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)', re.MULTILINE),
+    re.compile(r'^type\s+([A-Za-z_]\w*)', re.MULTILINE),
+    re.compile(r'^\s*(?:var|const)\s+([A-Za-z_]\w*)', re.MULTILINE)
+]
+# 참조: 호출, new, 대문자로 시작하는 타입 이름, import로 가져온 이름
+CALL_PATTERN = re.compile(r'\b([A-Za-z_$][\w$]*)\s*\(')
+NEW_PATTERN = re.compile(r'\bnew\s+([A-Za-z_$][\w$]*)')
+TYPE_PATTERN = re.compile(r'\b([A-Z][\w$]*)\b')
+IMPORT_PATTERNS = [
+    re.compile(r'\bimport\s+\{([^}]*)\}'),
+    re.compile(r'\bimport\s+([A-Za-z_$][\w$]*)\s+from\b'),
+    re.compile(r'^\s*import\s+(?:static\s+)?[\w.]*\.([A-Za-z_]\w*)\s*;', re.MULTILINE),
+    re.compile(r'^\s*using\s+(?:static\s+)?[\w.]*\.([A-Za-z_]\w*)\s*;', re.MULTILINE)
+]
+PYTHON_DEFINITION = re.compile(r'^\s*(?:async\s+)?(?:def|class)\s+([A-Za-z_]\w*)', re.MULTILINE)
+NAME_PATTERN = re.compile(r'[A-Za-z_$][\w$]*')
+
+def get_language(filename):
+    lower = filename.lower()
+    if lower.endswith(PYTHON_EXTENSIONS):
+        return 'python'
+    if lower.endswith(JS_EXTENSIONS):
+        return 'js'
+    if lower.endswith(JAVA_EXTENSIONS):
+        return 'java'
+    if lower.endswith(GO_EXTENSIONS):
+        return 'go'
+    return None
+
+def extract_symbols(filename, content):
+    """ 청크 하나에서 정의한 이름과 참조하는 이름(호출, import, 타입)의 목록을 (definitions, references)로 반환.
+    Python은 ast로, 그 외 지원 언어는 정규식으로 찾으며 지원하지 않는 형식은 빈 목록 """
+    language = get_language(filename)
+    if language is None:
+        return [], []
+    if language == 'python':
+        try:
+            definitions, references = python_symbols(content)
+        except (SyntaxError, ValueError):
+            # 줄 단위로 잘린 청크 등 ast로 읽을 수 없으면 정규식으로 찾는다
+            definitions = set(PYTHON_DEFINITION.findall(content))
+            references = set(CALL_PATTERN.findall(content)) | set(TYPE_PATTERN.findall(content))
+    else:
+        definitions, references = regex_symbols(language, content)
+
+    definitions = set(name for name in definitions if name not in KEYWORDS)
+    references = set(name for name in references if name not in KEYWORDS and name not in definitions)
+    return sorted(definitions), sorted(references)
+
+def python_symbols(content):
+    tree = ast.parse(textwrap.dedent(content))
+    definitions = set()
+    references = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            definitions.add(node.name)
+            if isinstance(node, ast.ClassDef):
+                references.update(base.id if isinstance(base, ast.Name) else base.attr for base in node.bases if isinstance(base, (ast.Name, ast.Attribute)))
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name):
+                references.add(node.func.id)
+            elif isinstance(node.func, ast.Attribute):
+                references.add(node.func.attr)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            references.update(alias.name.split('.')[-1] for alias in node.names if alias.name != '*')
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id[:1].isupper():
+            # 대문자로 시작하는 이름은 클래스나 상수로 본다
+            references.add(node.id)
+    # 최상위 대입(상수, 설정값 등)도 정의로 본다
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            definitions.update(target.id for target in node.targets if isinstance(target, ast.Name))
+    return definitions, references
+
+def regex_symbols(language, content):
+    patterns = {'js': JS_DEFINITIONS, 'java': JAVA_DEFINITIONS, 'go': GO_DEFINITIONS}[language]
+    definitions = set()
+    for pattern in patterns:
+        definitions.update(pattern.findall(content))
+
+    references = set(CALL_PATTERN.findall(content)) | set(NEW_PATTERN.findall(content)) | set(TYPE_PATTERN.findall(content))
+    for pattern in IMPORT_PATTERNS:
+        for match in pattern.findall(content):
+            for item in match.split(','):
+                # 'a as b'는 원래 이름 a를 참조한다
+                names = NAME_PATTERN.findall(item.split(' as ')[0])
+                if names:
+                    references.add(names[-1])
+    return definitions, references
+
+class SymbolBuilder:
+    """ 세그먼트 하나의 행별 정의/참조 이름 목록을 모은다 """
+
+    def __init__(self):
+        self.definitions = []
+        self.references = []
+
+    def add(self, row, filename, content):
+        while len(self.definitions) <= row:
+            self.definitions.append([])
+            self.references.append([])
+        try:
+            self.definitions[row], self.references[row] = extract_symbols(filename, content)
+        except Exception as e:
+            logging.debug(f"Symbol extraction failed for {filename}: {str(e)}")
+
+    def save(self, f):
+        f.write(json.dumps({'definitions': self.definitions, 'references': self.references}, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    def finish(self):
+        return SymbolSegment(self.definitions, self.references)
+
+class SymbolSegment:
+    def __init__(self, definitions, references):
+        self.definitions = definitions
+        self.references = references
+
+    def get(self, row):
+        if row >= len(self.definitions):
+            return [], []
+        return self.definitions[row], self.references[row]
+
+def load_symbol_segment(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return SymbolSegment(data['definitions'], data['references'])
+
+class SymbolIndex:
+    """ 한 폴더의 이름 -> 정의한 청크(행 번호) 목록과, 청크별로 참조하는 이름 목록 """
+
+    def __init__(self, records, segments):
+        self.definitions = {}
+        self.references = []
+        for row, record in enumerate(records):
+            definitions, references = segments[record['segment']].get(record['row'])
+            for name in definitions:
+                self.definitions.setdefault(name, []).append(row)
+            self.references.append(references)
+
+    def get_definitions(self, name):
+        return self.definitions.get(name, [])
+
+    def get_references(self, row):
+        return self.references[row]
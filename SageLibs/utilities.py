@@ -1,65 +1,195 @@
-import os
-import json
+import codecs
 import hashlib
 import chardet
 import PyPDF2
 import logging
 import tiktoken
-import subprocess
-from sklearn.metrics.pairwise import cosine_similarity
-from .config import get_setting, TOKEN_COUNTER_MODEL, EMBEDDINGS_FILE, SIMILARITY_THRESHOLD
+import heapq
+import functools
+import threading
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .config import get_setting, TOKEN_COUNTER_MODEL, SIMILARITY_THRESHOLD, LEXICAL_TOP_K, RRF_K, SYMBOL_CONTEXT_TOP_K, SYMBOL_EXPAND_PER_HIT, SYMBOL_MAX_DEFINITIONS, READ_CONCURRENCY, READ_DETECT_SAMPLE_BYTES, SEARCH_CONCURRENCY, SEARCH_TOP_K, ANN_RERANK_FACTOR
+from .embedding_store import store_exists, load_store
+from .vector_index import get_folder_index
+from .ann_index import is_ann_enabled, get_nprobe
+from .scanner import scan_files, get_path_matcher
 
-def load_embeddings(file_path):
+PDF_PAGE_BREAK = '\n\f\n'
+
+# 토큰 수 메모이제이션: 이 길이 이상의 텍스트만 내용 해시로 캐시
+TOKEN_CACHE_MIN_LENGTH = 256
+TOKEN_CACHE_SIZE = 65536
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+# 여러 폴더를 검색할 때 폴더별 점수 계산을 동시에 실행 (NumPy 행렬 곱은 GIL을 놓는다)
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix='SageSearch')
+
+def load_embeddings(folder):
+    """ 폴더의 임베딩 저장소를 파일명별 dict로 반환. 'chunks'에는 청크 순서대로 레코드가 들어 있고,
+    각 청크의 embedding은 세그먼트 np.memmap의 행(정규화된 벡터)이다 """
     embeddings = {}
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                data = json.loads(line)
-                embeddings[data['filename']] = data
+    if store_exists(folder):
+        manifest, matrices = load_store(folder)
+        for record in manifest['records']:
+            data = embeddings.setdefault(record['filename'], {
+                'filename': record['filename'],
+                'content_hash': record['content_hash'],
+                'mtime': record['mtime'],
+                'chunks': []
+            })
+            data['chunks'].append(dict(record, embedding=matrices[record['segment']][record['row']]))
+        for data in embeddings.values():
+            data['chunks'].sort(key=lambda chunk: chunk.get('chunk', 0))
     return embeddings
 
-def find_most_similar(query_embedding, embeddings, similarity_threshold=SIMILARITY_THRESHOLD, top_k=100):
-    essential_files = {filename: 10 for filename in get_setting('essential_files')}
+def find_most_similar(query_embedding, index, similarity_threshold=SIMILARITY_THRESHOLD, top_k=100):
+    """ 유사도가 높은 청크의 (행 번호, 유사도) 목록. 필수 파일은 모든 청크가 유사도 10으로 맨 앞에 온다 """
+    essential_rows = [row for filename in get_setting('essential_files') for row in index.get_file_rows(filename)]
+    result = [(row, 10) for row in essential_rows]
 
-    similarities = {}
-    for filename, data in embeddings.items():
-        if filename in essential_files:
-            continue
-        
-        if not any(filename.endswith(ext) for ext in get_setting('extensions')):
-            continue
-        if filename in get_setting('ignore_files'):
-            continue
-        if any(ignore_folder in filename for ignore_folder in get_setting('ignore_folders')):
-            continue
-        
-        similarity = cosine_similarity([query_embedding], [data['embedding']])[0][0]
-        if similarity >= similarity_threshold:
-            similarities[filename] = similarity
+    limit = top_k - len(essential_rows)
+    if limit <= 0 or len(index) == 0:
+        return result[:top_k]
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    if query_norm > 0:
+        query = query / query_norm
+
+    ann = index.get_ann() if is_ann_enabled(index.folder) else None
+    if ann is not None:
+        # ANN 색인으로 고른 후보만 정확한 코사인 유사도로 다시 계산
+        rows = ann.search(query, limit * ANN_RERANK_FACTOR, get_nprobe(), index.get_mask())
+        similarities = index.score_rows(query, rows)
+        keep = similarities >= similarity_threshold
+        candidates, scores = rows[keep], similarities[keep]
+    else:
+        # 정규화된 행렬과의 행렬-벡터 곱 한 번으로 모든 청크의 코사인 유사도를 계산
+        similarities = index.score(query)
+        candidates = np.flatnonzero(index.get_mask() & (similarities >= similarity_threshold))
+        scores = similarities[candidates]
+
+    if len(candidates) > limit:
+        # argpartition으로 상위 후보만 고르되, 경계값과 같은 점수는 모두 남겨 기존 정렬과 동일한 결과를 보장
+        kth_score = scores[np.argpartition(-scores, limit - 1)[limit - 1]]
+        keep = scores >= kth_score
+        candidates, scores = candidates[keep], scores[keep]
+
+    # 유사도 내림차순, 같은 유사도는 행 순서대로 (sorted의 안정 정렬과 동일)
+    order = np.lexsort((candidates, -scores))[:limit]
+    result += [(int(row), float(score)) for row, score in zip(candidates[order], scores[order])]
 
-    sorted_files = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
-    
-    result = list(essential_files.items()) + sorted_files[:top_k - len(essential_files)]
-    
     return result[:top_k]
 
+def find_lexical_matches(question, index, top_k=LEXICAL_TOP_K):
+    """ 질문의 검색어로 BM25 점수가 높은 청크의 (행 번호, 점수) 목록. 필수 파일은 제외한다 """
+    if len(index) == 0:
+        return []
+    scores = index.get_lexical().score(question)
+    if scores is None:
+        return []
+
+    candidates = np.flatnonzero(index.get_mask() & (scores > 0))
+    if len(candidates) > top_k:
+        candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return [(int(row), float(scores[row])) for row in candidates[order]]
+
+def fuse_rankings(rankings, k=RRF_K):
+    """ 여러 순위 목록(행 번호 목록)을 reciprocal rank fusion으로 합친 행 번호 목록 """
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda row: -scores[row])
+
+def find_hybrid_matches(question, query_embedding, index, similar_chunks):
+    """ 벡터 검색 결과(find_most_similar)와 검색어 검색 결과를 RRF로 합쳐 (행 번호, 유사도, 순위 점수) 목록을 반환.
+    식별자나 오류 문자열처럼 임베딩에 잘 드러나지 않는 질문도 해당 청크를 앞쪽에 놓는다.
+    순위 점수는 합친 순서를 유지하도록 후보들의 유사도를 높은 것부터 차례로 다시 나눠 준 값이라, 답변 유사도와 함께 정렬할 수 있다 """
+    lexical_chunks = find_lexical_matches(question, index)
+    if not lexical_chunks:
+        return [(row, similarity, similarity) for row, similarity in similar_chunks]
+
+    essential = [(row, similarity, similarity) for row, similarity in similar_chunks if similarity >= 10]
+    vector_chunks = [(row, similarity) for row, similarity in similar_chunks if similarity < 10]
+    essential_rows = set(row for row, _, _ in essential)
+    similarities = dict(vector_chunks)
+
+    fused = [row for row in fuse_rankings([[row for row, _ in vector_chunks], [row for row, _ in lexical_chunks]]) if row not in essential_rows]
+    missing = [row for row in fused if row not in similarities]
+    if missing:
+        similarities.update(zip(missing, index.score_rows(normalize_query(query_embedding), missing).tolist()))
+
+    logging.debug(f"검색어로 찾은 청크: {[(index.records[row]['filename'], round(score, 2)) for row, score in lexical_chunks[:10]]}")
+    rank_scores = sorted((similarities[row] for row in fused), reverse=True)
+    return essential + [(row, similarities[row], rank_score) for row, rank_score in zip(fused, rank_scores)]
+
+def expand_with_definitions(query_embedding, index, chunks, top_k=SYMBOL_CONTEXT_TOP_K):
+    """ 상위 top_k개 청크만 남기고, 각 청크 바로 뒤에 그 청크가 참조하는(호출, import, 타입) 이름을 정의한 청크를 붙인다.
+    그 아래 순위의 청크는 뺀다. 정의 청크는 질문과의 유사도가 높은 것부터 청크당 SYMBOL_EXPAND_PER_HIT개까지 붙이고,
+    순위 점수는 참조한 청크와 같게 둔다. chunks와 결과는 (행 번호, 유사도, 순위 점수) 목록 """
+    essential = [chunk for chunk in chunks if chunk[1] >= 10]
+    hits = [chunk for chunk in chunks if chunk[1] < 10][:top_k]
+    symbols = index.get_symbols()
+    mask = index.get_mask()
+    selected = set(row for row, _, _ in essential + hits)
+
+    candidates = {}
+    for row, _, _ in hits:
+        definitions = []
+        for name in symbols.get_references(row):
+            rows = symbols.get_definitions(name)
+            if len(rows) <= SYMBOL_MAX_DEFINITIONS:
+                definitions.extend(definition for definition in rows if definition not in selected and mask[definition])
+        candidates[row] = list(dict.fromkeys(definitions))
+
+    all_candidates = list(set(definition for definitions in candidates.values() for definition in definitions))
+    similarities = dict(zip(all_candidates, index.score_rows(normalize_query(query_embedding), all_candidates).tolist())) if all_candidates else {}
+
+    result = list(essential)
+    for row, similarity, score in hits:
+        result.append((row, similarity, score))
+        added = 0
+        for definition in sorted(candidates[row], key=lambda definition: -similarities[definition]):
+            if added >= SYMBOL_EXPAND_PER_HIT:
+                break
+            if definition in selected:
+                continue
+            selected.add(definition)
+            result.append((definition, similarities[definition], score))
+            added += 1
+            logging.debug(f"{index.records[row]['filename']}에서 참조하는 정의 추가: {index.records[definition]['filename']}:{index.records[definition]['start_line']}")
+    return result
+
+def normalize_query(query_embedding):
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    return query / query_norm if query_norm > 0 else query
+
+def truncate_embeddings(embeddings, dimensions):
+    """ 벡터(또는 행렬의 각 행)의 앞 dimensions개만 남겨 다시 정규화. text-embedding-3 모델의 짧은 벡터(dimensions 요청)와 같다 """
+    embeddings = np.asarray(embeddings, dtype=np.float32)[..., :dimensions]
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
 def get_file_paths(folder_path):
-    file_paths = []
-    for root, dirs, files in os.walk(folder_path):
-        dirs[:] = [d for d in dirs if d not in get_setting('ignore_folders')]
-        for file in files:
-            if file not in get_setting('ignore_files') and any(file.endswith(ext) for ext in get_setting('extensions')):
-                file_paths.append(os.path.join(root, file))
-    return file_paths
+    return scan_files(folder_path)
+
+def is_indexed_path(relative_path):
+    """ get_file_paths와 같은 규칙으로, 폴더 기준 상대 경로의 파일이 임베딩 대상인지 판단 """
+    return get_path_matcher().accept_path(relative_path)
 
 def pdf_to_text(pdf_path):
     try:
         with open(pdf_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
+            # 페이지 경계를 '\f' 한 줄로 남겨 청크를 페이지 단위로 나눌 수 있게 한다
+            return PDF_PAGE_BREAK.join(page.extract_text() for page in pdf_reader.pages)
     except Exception as e:
         logging.error(f"Error processing PDF {pdf_path}: {str(e)}")
         return ""
@@ -70,173 +200,241 @@ def read_file(file_path):
     
     with open(file_path, 'rb') as file:
         raw_data = file.read()
-    
-    detected = chardet.detect(raw_data)
-    encodings = [detected['encoding'], 'utf-8', 'euc-kr', 'cp949']
+
+    # 소스 파일은 대부분 UTF-8(또는 ASCII)이므로 먼저 바로 디코딩하고, 실패한 경우에만 앞부분 표본으로 인코딩을 추정
+    if raw_data.startswith(codecs.BOM_UTF8):
+        return raw_data[len(codecs.BOM_UTF8):].decode('utf-8', errors='replace')
+    try:
+        return raw_data.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+
+    detected = chardet.detect(raw_data[:READ_DETECT_SAMPLE_BYTES])
+    encodings = [detected['encoding'], 'euc-kr', 'cp949']
     
     for encoding in encodings:
+        if not encoding:
+            continue
         try:
             return raw_data.decode(encoding)
-        except UnicodeDecodeError:
+        except (UnicodeDecodeError, LookupError):
             continue
     
     return raw_data.decode('utf-8', errors='replace')
 
+def read_files(file_paths, max_workers=None):
+    """ 파일들을 스레드 풀에서 읽어 입력 순서대로 (file_path, content, error)를 돌려준다.
+    미리 읽어 두는 파일 수는 max_workers의 두 배로 제한하여 메모리 사용량을 묶어 둔다 """
+    max_workers = max_workers or get_setting('read_concurrency', READ_CONCURRENCY)
+
+    def read(file_path):
+        try:
+            return file_path, read_file(file_path), None
+        except Exception as e:
+            return file_path, None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='SageRead') as executor:
+        in_flight = deque()
+        for file_path in file_paths:
+            in_flight.append(executor.submit(read, file_path))
+            if len(in_flight) >= max_workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
 def hash_content(content):
     return hashlib.md5(content.encode('utf-8', errors='replace')).hexdigest()
 
+@functools.lru_cache(maxsize=None)
+def get_encoder():
+    return tiktoken.encoding_for_model(TOKEN_COUNTER_MODEL)
+
+def _token_cache_key(text):
+    return hashlib.md5(text.encode('utf-8', errors='replace')).digest()
+
 def count_tokens(text):
-    encoding = tiktoken.encoding_for_model(TOKEN_COUNTER_MODEL)
-    return len(encoding.encode(text))
+    """ 토큰 수를 센다. 긴 텍스트는 내용 해시로 결과를 기억해 두어 같은 내용을 다시 토큰화하지 않는다 """
+    if len(text) < TOKEN_CACHE_MIN_LENGTH:
+        return len(get_encoder().encode_ordinary(text))
 
-def get_relevant_documents(folders, question_embedding, max_tokens=80000):
-    relevant_docs = []
-    total_tokens = 0
+    key = _token_cache_key(text)
+    with _token_cache_lock:
+        tokens = _token_cache.get(key)
+        if tokens is not None:
+            _token_cache.move_to_end(key)
+            return tokens
 
-    for folder in folders:
-        if not folder.endswith('/') and not folder.endswith('\\'):
-            folder += '/'
-        
-        embedding_file = os.path.join(folder, EMBEDDINGS_FILE)
-        logging.debug(f"임베딩 파일 로드: {embedding_file}")
-        
-        try:
-            embeddings = load_embeddings(embedding_file)
-        except Exception as e:
-            logging.error(f"Error loading embeddings from {embedding_file}: {str(e)}")
-            continue
+    tokens = len(get_encoder().encode_ordinary(text))
+    _remember_tokens(key, tokens)
+    return tokens
 
-        similar_files = find_most_similar(question_embedding, embeddings)
-        
-        logging.debug(f"{folder}에서 유사도로 선택된 파일:")
-        for filename, similarity in similar_files:
-            logging.debug(f"{filename}: {similarity}")
-        
-        for filename, similarity in similar_files:
-            if filename not in embeddings:
-                logging.warning(f"File {filename} not found in embeddings. Skipping.")
-                continue
+def count_tokens_batch(texts, num_threads=8):
+    """ 여러 텍스트의 토큰 수를 한 번에 센다. 캐시에 없는 텍스트만 tiktoken encode_batch로 여러 스레드에서 토큰화한다 """
+    results = [None] * len(texts)
+    missing = []
+    with _token_cache_lock:
+        for i, text in enumerate(texts):
+            if len(text) >= TOKEN_CACHE_MIN_LENGTH:
+                tokens = _token_cache.get(_token_cache_key(text))
+                if tokens is not None:
+                    results[i] = tokens
+                    continue
+            missing.append(i)
 
-            content = embeddings[filename]['content']
-            doc_tokens = count_tokens(filename + "\n\n" + content)
-            
-            if total_tokens + doc_tokens > max_tokens:
-                logging.info("최대 토큰 수 도달, 추가 파일 처리 중지")
-                return relevant_docs
-            
-            relevant_docs.append({
-                "tokens": doc_tokens,
-                "filename": filename,
-                "similarity": similarity,
-                "content": content
-            })
-            total_tokens += doc_tokens
+    if missing:
+        encoded = get_encoder().encode_ordinary_batch([texts[i] for i in missing], num_threads=num_threads)
+        for i, tokens in zip(missing, encoded):
+            results[i] = len(tokens)
+            if len(texts[i]) >= TOKEN_CACHE_MIN_LENGTH:
+                _remember_tokens(_token_cache_key(texts[i]), len(tokens))
+    return results
 
-    logging.debug(f"프롬프트 생성 정보:")
-    logging.debug(f"총 토큰 수: {total_tokens}")
-    logging.debug(f"사용된 파일: {[doc['filename'] for doc in relevant_docs]}")
+def _remember_tokens(key, tokens):
+    with _token_cache_lock:
+        _token_cache[key] = tokens
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
 
-    return relevant_docs
+def truncate_tokens(text, max_tokens):
+    """ max_tokens 토큰을 넘는 텍스트는 앞부분만 남긴다 """
+    tokens = get_encoder().encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_encoder().decode(tokens[:max_tokens])
+
+def merge_adjacent_chunks(docs):
+    """ 같은 파일에서 이어지는 청크들을 하나의 구간으로 합친다. docs는 한 폴더에서 선택된 청크 항목이며 순서는 유지된다 """
+    by_file = {}
+    for doc in docs:
+        by_file.setdefault(doc['filename'], []).append(doc)
+
+    merged = []
+    for doc in docs:
+        group = by_file.pop(doc['filename'], None)
+        if group is None:
+            continue
+        group.sort(key=lambda item: item['chunk'])
+        current = None
+        for item in group:
+            if current is not None and item['chunk'] == current['last_chunk'] + 1:
+                current['content'] += item['content']
+                current['tokens'] += item['tokens']
+                current['similarity'] = max(current['similarity'], item['similarity'])
+                current['score'] = max(current['score'], item['score'])
+                current['order'] = min(current['order'], item['order'])
+                current['end_line'] = item['end_line']
+                current['last_chunk'] = item['chunk']
+                continue
+            if current is not None:
+                merged.append(current)
+            current = dict(item, last_chunk=item['chunk'])
+        merged.append(current)
+
+    for doc in merged:
+        del doc['last_chunk']
+    return merged
 
-def get_git_branches(folder):
+def search_folder(folder, question_embedding, question=None):
+    """ 폴더(샤드) 하나에서 후보 청크를 찾아 (인덱스, [(행 번호, 유사도, 순위 점수)])를 반환. 저장소가 없거나 읽지 못하면 None """
     try:
-        branches = subprocess.check_output(['git', '-C', folder, 'branch', '--list'], encoding='utf-8')
-        return branches.split()
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"{folder}에서 Git 명령을 실행하는데 실패했습니다.") from e
-    
-def get_changed_files_in_diff(folder, analysis_type):
-    branches = get_git_branches(folder)
-    base_branch = 'main' if 'main' in branches else 'master' if 'master' in branches else None
-    if not base_branch:
-        raise Exception(f"{folder}에서 필요한 브랜치(main 또는 master)가 존재하지 않습니다.")
-
-    command = []
-    if analysis_type == 'main':
-        command = ['git', '-C', folder, 'diff', f'{base_branch}..HEAD', '--name-only']
-    elif analysis_type == 'recent':
-        command = ['git', '-C', folder, 'diff', 'HEAD^', 'HEAD', '--name-only']
+        index = get_folder_index(folder)
+    except Exception as e:
+        logging.error(f"Error loading embeddings from {folder}: {str(e)}")
+        return None
+
+    if index is None:
+        logging.warning(f"No embeddings found in {folder}. Skipping.")
+        return None
+    if index.dimensions is not None and len(question_embedding) != index.dimensions:
+        # embedding_dimensions를 바꾼 뒤 아직 다시 임베딩하지 않은 폴더. 질문 벡터가 더 길면 잘라서 쓸 수 있다
+        if len(question_embedding) < index.dimensions:
+            logging.warning(f"{folder} has {index.dimensions}-dimensional embeddings but the question has {len(question_embedding)}; refresh its embeddings. Skipping.")
+            return None
+        question_embedding = truncate_embeddings(question_embedding, index.dimensions)
+
+    similar_chunks = find_most_similar(question_embedding, index)
+    if question:
+        similar_chunks = find_hybrid_matches(question, question_embedding, index, similar_chunks)
     else:
-        raise Exception("분석 유형이 잘못 지정되었습니다.")
+        similar_chunks = [(row, similarity, similarity) for row, similarity in similar_chunks]
+    if get_setting('symbol_context') == 'on':
+        similar_chunks = expand_with_definitions(question_embedding, index, similar_chunks)
 
-    try:
-        output = subprocess.check_output(command, encoding='utf-8').strip().split('\n')
+    logging.debug(f"{folder}에서 유사도로 선택된 청크:")
+    for row, similarity, score in similar_chunks:
+        record = index.records[row]
+        logging.debug(f"{record['filename']}:{record['start_line']}-{record['end_line']}: {similarity} (score {score})")
+    return index, similar_chunks
 
-        logging.debug(f"command: {command}")
+def get_relevant_documents(folders, question_embedding, max_tokens=80000, merge_neighbors=True, question=None, top_k=SEARCH_TOP_K):
+    """ 질문과 관련된 청크를 고른다. 각 항목은 폴더와 파일명, 줄 범위('lines'), 해당 구간의 본문을 가진다.
+    max_tokens를 주면 점수순으로 그 예산까지만, None이면 상위 top_k개를 모두 반환한다 (예산 안의 선택은 context_packer가 한다).
+    merge_neighbors가 켜져 있으면 같은 파일에서 이어지는 청크는 하나의 구간으로 합친다.
+    폴더마다 하나의 샤드로 보고 스레드 풀에서 동시에 점수를 계산한 뒤, 모든 폴더의 후보를 점수순 상위 top_k개로 합쳐서
+    고른다. 앞 폴더가 예산을 다 써서 뒤 폴더가 빠지는 일 없이 폴더 사이에서도 점수로 경쟁한다.
+    question(질문 원문)을 주면 벡터 검색과 검색어(BM25) 검색을 합친 순서로 고르며, 'score'가 그 순서를 나타낸다.
+    symbol_context 설정이 켜져 있으면 상위 청크와 그 청크가 참조하는 정의만 모아, 관련 없는 나머지는 프롬프트에 넣지 않는다 """
+    shards = [folder if folder.endswith('/') or folder.endswith('\\') else folder + '/' for folder in folders]
+    if len(shards) > 1:
+        results = list(_search_executor.map(lambda folder: search_folder(folder, question_embedding, question), shards))
+    else:
+        results = [search_folder(folder, question_embedding, question) for folder in shards]
 
-        all_changed_files = [file for file in output if file]
+    # 전체 상위 top_k개. 점수가 같으면 폴더 순서, 그다음 폴더 안의 순서
+    candidates = heapq.nsmallest(top_k, (
+        (-score, shard, position, row, similarity)
+        for shard, result in enumerate(results) if result is not None
+        for position, (row, similarity, score) in enumerate(result[1])
+    ))
 
-        # TODO: 설정에서 확장자를 가져오도록 변경
-        programming_extensions = [
-            '.py', '.js', '.java', 'cs', '.c', '.cpp', '.h', '.hpp', '.ts', 
-            '.tsx', '.jsx', '.php', '.rb', '.go', '.rs', '.pas'
-        ]
+    total_tokens = 0
+    shard_docs = {}
+    for order, (negative_score, shard, _, row, similarity) in enumerate(candidates):
+        index = results[shard][0]
+        record = index.records[row]
+        content = index.get_content(row)
+        doc_tokens = index.get_tokens(row)
+        if doc_tokens is None:
+            doc_tokens = count_tokens(record['filename'] + "\n\n" + content)
 
-        # Filter the changed files based on settings
-        filtered_changed_files = []
-        for file in all_changed_files:
-            file_name = os.path.basename(file)
-            file_dir = os.path.dirname(file)
+        if max_tokens is not None and total_tokens + doc_tokens > max_tokens:
+            logging.info("최대 토큰 수 도달, 추가 파일 처리 중지")
+            break
 
-            # 확장자 필터링이 처음에 적용되도록 설정
-            if not any(file_name.endswith(ext) for ext in programming_extensions):
-                logging.debug(f"File ignored due to extensions: {file_name}")
-                continue
-            
-            if file_name in get_setting('ignore_files'):
-                logging.debug(f"File ignored due to ignore_files: {file_name}")
-                continue
-            if any(ignore_folder in file_dir.split(os.sep) for ignore_folder in get_setting('ignore_folders')):
-                logging.debug(f"File ignored due to ignore_folders: {file}")
-                continue
+        shard_docs.setdefault(shard, []).append({
+            "tokens": doc_tokens,
+            "filename": record['filename'],
+            "chunk": record.get('chunk', 0),
+            "start_line": record['start_line'],
+            "end_line": record['end_line'],
+            "similarity": similarity,
+            "score": -negative_score,
+            "content": content,
+            "order": order
+        })
+        total_tokens += doc_tokens
 
-            filtered_changed_files.append(file)
-        
-        if not filtered_changed_files:
-            logging.debug(f"Warning: No changed files found in {folder} for {analysis_type} analysis.")
-        else:
-            logging.debug(f"Found {len(filtered_changed_files)} changed files in {folder} for {analysis_type} analysis.")
-
-        return filtered_changed_files
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"{folder}에서 {analysis_type}에 해당하는 diff 계산 실패.") from e
-   
-def diff_between_branches(folder, analysis_type, specific_file=None):
-    branches = get_git_branches(folder)
-    logging.debug(f"Branches found: {branches}")
-
-    base_branch = 'main' if 'main' in branches else 'master' if 'master' in branches else None
-    logging.debug(f"Base branch: {base_branch}")
-    
-    if not base_branch:
-        raise Exception(f"{folder}에서 필요한 브랜치(main 또는 master)가 존재하지 않습니다.")
+    relevant_docs = []
+    for shard, folder_docs in shard_docs.items():
+        if merge_neighbors:
+            folder_docs = merge_adjacent_chunks(folder_docs)
+        for doc in folder_docs:
+            relevant_docs.append({
+                "tokens": doc['tokens'],
+                "folder": shards[shard],
+                "filename": doc['filename'],
+                "lines": f"{doc['start_line']}-{doc['end_line']}",
+                "similarity": doc['similarity'],
+                "score": doc['score'],
+                "content": doc['content'],
+                "order": doc['order']
+            })
+    # 합친 구간은 가장 먼저 뽑힌 청크의 순서를 따른다
+    relevant_docs.sort(key=lambda doc: doc.pop('order'))
 
-    if analysis_type == 'main':
-        diff_command = f'{base_branch}..HEAD'
-    elif analysis_type == 'recent':
-        diff_command = 'HEAD^..HEAD'
-    else:
-        raise Exception("분석 유형이 잘못 지정되었습니다.")
+    logging.debug(f"프롬프트 생성 정보:")
+    logging.debug(f"총 토큰 수: {total_tokens}")
+    logging.debug(f"사용된 파일: {[doc['folder'] + doc['filename'] + ':' + doc['lines'] for doc in relevant_docs]}")
 
-    if specific_file:
-        specific_file = os.path.join(folder, specific_file)
-        logging.debug(f"Specific file for diff: {specific_file}")
-        command = ['git', '-C', folder, 'diff', diff_command, '--', specific_file]
-    else:
-        logging.debug("No specific file provided, diffing entire branch.")
-        command = ['git', '-C', folder, 'diff', diff_command]
-    
-    try:
-        # UTF-8 디코딩을 시도합니다.
-        output = subprocess.check_output(command, encoding='utf-8')
-    except UnicodeDecodeError:
-        # UTF-8 디코딩에 실패하면 바이트 문자열로 출력을 가져옵니다.
-        raw_output = subprocess.check_output(command)
-        # chardet를 사용하여 인코딩을 감지합니다.
-        detected = chardet.detect(raw_output)
-        encoding = detected['encoding']
-        logging.debug(f"Detected encoding: {encoding}")
-        # 감지된 인코딩을 사용하여 디코딩합니다.
-        output = raw_output.decode(encoding)
-
-    return output
+    return relevant_docs
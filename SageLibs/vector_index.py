@@ -0,0 +1,318 @@
+import os
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .config import EMBEDDINGS_FILE, ANN_MIN_ROWS, ANN_MIN_COVERAGE, get_setting, get_settings_version
+from .embedding_store import store_exists, get_folder_lock, get_manifest_file, get_segment_path, load_store, upgrade_store, migrate_jsonl, write_atomic, QuantizedMatrix
+from .lexical_index import SegmentBuilder, LexicalIndex, load_segment
+from .symbol_index import SymbolBuilder, SymbolIndex, load_symbol_segment
+from .ann_index import load_ann_index, update_ann_index
+
+# 폴더별 임베딩 인덱스를 프로세스 전체에서 공유하기 위한 캐시
+_indexes = {}
+_lock = threading.Lock()
+# ANN 색인 생성/갱신은 백그라운드에서 한 번에 하나씩
+_ann_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='SageAnn')
+_ann_pending = set()
+_ann_pending_lock = threading.Lock()
+
+# float16 저장소는 이 행 수 단위로 float32로 올려서 계산 (메모리 사용량 제한)
+SCORE_BLOCK_ROWS = 65536
+
+class FolderIndex:
+    """ 한 폴더의 임베딩 세그먼트 행렬(np.memmap)과 청크별 파일명/해시/줄 범위/토큰 수/본문 위치 메타데이터를 함께 유지.
+    행 하나가 청크 하나이며, 각 행은 저장 시 정규화되어 있어 질문 벡터와의 내적이 곧 코사인 유사도가 된다.
+    세그먼트 본문 파일은 읽을 때마다 열고 닫으므로, 교체된 인덱스가 파일을 붙잡아 압축한 세그먼트를 지우지 못하는 일이 없다 """
+
+    def __init__(self, folder, signature, records, matrices, file_states=None):
+        self.folder = folder
+        self.signature = signature
+        self.records = records
+        self.file_states = file_states or {}
+        self.filenames = [record['filename'] for record in records]
+        self.norms = np.array([record['norm'] for record in records], dtype=np.float32)
+        # 세그먼트 순서대로 점수를 이어 붙인 배열에서 각 행(레코드)의 위치
+        self.segments = list(matrices.items())
+        offsets = {}
+        total = 0
+        for name, matrix in self.segments:
+            offsets[name] = total
+            total += len(matrix)
+        self.offsets = offsets
+        self.total_rows = total
+        self.positions = np.array([offsets[record['segment']] + record['row'] for record in records], dtype=np.int64)
+        self.matrices = matrices
+        # 파일명 -> 청크 순서대로 정렬된 행 번호 목록
+        self.files = {}
+        for row, record in enumerate(records):
+            self.files.setdefault(record['filename'], []).append(row)
+        for rows in self.files.values():
+            rows.sort(key=lambda row: self.records[row].get('chunk', 0))
+        self._mask = None
+        self._mask_version = None
+        self._mask_lock = threading.Lock()
+        self._lexical = None
+        self._lexical_lock = threading.Lock()
+        self._symbols = None
+        self._symbols_lock = threading.Lock()
+        self._ann = None
+        self._ann_loaded = False
+        self._ann_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dimensions(self):
+        """ 임베딩 차원. 세그먼트가 없으면 None """
+        return self.segments[0][1].shape[1] if self.segments else None
+
+    def __contains__(self, filename):
+        return filename in self.files
+
+    def get_hash(self, filename):
+        rows = self.files.get(filename)
+        return None if rows is None else self.records[rows[0]]['content_hash']
+
+    def get_file_state(self, filename):
+        return self.file_states.get(filename)
+
+    def get_file_rows(self, filename):
+        return self.files.get(filename, [])
+
+    def get_record(self, row):
+        return self.records[row]
+
+    def get_embedding(self, row):
+        record = self.records[row]
+        return np.asarray(self.matrices[record['segment']][record['row']], dtype=np.float32) * self.norms[row]
+
+    def get_tokens(self, row):
+        return self.records[row].get('tokens')
+
+    def get_content(self, row):
+        record = self.records[row]
+        try:
+            with open(get_segment_path(self.folder, record['segment'], 'bin'), 'rb') as blob:
+                blob.seek(record['offset'])
+                data = blob.read(record['length'])
+        except FileNotFoundError:
+            # 이 인덱스를 쓰는 동안 압축이 세그먼트를 지운 경우, 같은 청크를 현재 인덱스에서 읽는다
+            return read_moved_chunk(self, record)
+        return data.decode('utf-8', errors='replace')
+
+    def get_mask(self):
+        """ 확장자/무시 목록 필터를 적용한 행 마스크. 설정이 바뀐 경우에만 다시 만든다 """
+        version = get_settings_version()
+        with self._mask_lock:
+            if self._mask is None or self._mask_version != version:
+                self._mask = build_filter_mask(self.filenames)
+                self._mask_version = version
+            return self._mask
+
+    def score(self, query):
+        """ 정규화된 질문 벡터와 모든 행의 내적(코사인 유사도)을 계산. 세그먼트별로 계산한 뒤 살아 있는 행만 모은다 """
+        query = np.asarray(query, dtype=np.float32)
+        if not self.segments:
+            return np.zeros(0, dtype=np.float32)
+        scores = np.concatenate([score_matrix(matrix, query) for _, matrix in self.segments])
+        return scores[self.positions]
+
+    def get_vectors(self, rows):
+        """ 행들의 정규화된 벡터(float32). 세그먼트별로 모아 한 번에 읽는다 """
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = np.empty((len(rows), self.dimensions or 0), dtype=np.float32)
+        segments = np.array([self.records[row]['segment'] for row in rows])
+        for name in set(segments.tolist()):
+            selected = np.flatnonzero(segments == name)
+            segment_rows = np.array([self.records[row]['row'] for row in rows[selected]], dtype=np.int64)
+            order = np.argsort(segment_rows)
+            vectors[selected[order]] = self.matrices[name][segment_rows[order]]
+        return vectors
+
+    def score_rows(self, query, rows):
+        """ 일부 행만의 코사인 유사도 """
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return self.get_vectors(rows) @ np.asarray(query, dtype=np.float32)
+
+    def get_ann(self):
+        """ 폴더의 ANN 색인(AnnIndex). 색인이 없거나 색인에 든 청크가 ANN_MIN_COVERAGE보다 적으면 None을 반환하고,
+        색인에 없는 청크가 있으면 백그라운드에서 갱신한다 """
+        with self._ann_lock:
+            if not self._ann_loaded:
+                self._ann = load_ann_index(self) if len(self) >= ANN_MIN_ROWS else None
+                self._ann_loaded = True
+                if len(self) >= ANN_MIN_ROWS and (self._ann is None or len(self._ann.uncovered)):
+                    schedule_ann_update(self.folder)
+            if self._ann is None or self._ann.coverage < ANN_MIN_COVERAGE:
+                return None
+            return self._ann
+
+    def set_ann(self, ann):
+        with self._ann_lock:
+            self._ann = ann
+            self._ann_loaded = True
+
+    def get_lexical(self):
+        """ 세그먼트별 검색어 역색인을 묶은 LexicalIndex. 처음 필요할 때 읽는다 """
+        with self._lexical_lock:
+            if self._lexical is None:
+                segments = [(self.offsets[name], self.load_sidecar(name, 'lex', load_segment, SegmentBuilder)) for name, _ in self.segments]
+                self._lexical = LexicalIndex(segments, self.positions, self.total_rows)
+            return self._lexical
+
+    def get_symbols(self):
+        """ 세그먼트별 심볼 정의/참조 목록을 묶은 SymbolIndex. 처음 필요할 때 읽는다 """
+        with self._symbols_lock:
+            if self._symbols is None:
+                segments = {name: self.load_sidecar(name, 'sym', load_symbol_segment, SymbolBuilder) for name, _ in self.segments}
+                self._symbols = SymbolIndex(self.records, segments)
+            return self._symbols
+
+    def load_sidecar(self, name, extension, load, builder_class):
+        """ 세그먼트의 부가 색인 파일을 읽는다. 그 색인이 생기기 전에 만든 세그먼트는 본문으로 만들어 저장한다 """
+        path = get_segment_path(self.folder, name, extension)
+        try:
+            return load(path)
+        except FileNotFoundError:
+            pass
+
+        logging.info(f"Building .{extension} index for segment {name} in {self.folder}")
+        builder = builder_class()
+        for row, record in enumerate(self.records):
+            if record['segment'] == name:
+                builder.add(record['row'], record['filename'], self.get_content(row))
+        try:
+            write_atomic(path, builder.save)
+        except OSError as e:
+            logging.warning(f"Could not save .{extension} index for segment {name}: {str(e)}")
+        return builder.finish()
+
+def score_matrix(matrix, query):
+    if matrix.dtype == np.float32:
+        return matrix @ query
+
+    # int8 세그먼트는 코드와 질문의 내적에 행별 배율을 곱한다. 배율을 곱한 행렬을 따로 만들지 않는다
+    codes = matrix.codes if isinstance(matrix, QuantizedMatrix) else matrix
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+        block = np.asarray(codes[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+        scores[start:start + len(block)] = block @ query
+    if isinstance(matrix, QuantizedMatrix):
+        scores *= matrix.scales
+    return scores
+
+def build_filter_mask(filenames):
+    extensions = tuple(get_setting('extensions'))
+    ignore_files = set(get_setting('ignore_files'))
+    ignore_folders = get_setting('ignore_folders')
+    essential_files = set(get_setting('essential_files'))
+
+    mask = np.zeros(len(filenames), dtype=bool)
+    for row, filename in enumerate(filenames):
+        if filename in essential_files:
+            continue
+        if not filename.endswith(extensions):
+            continue
+        if filename in ignore_files:
+            continue
+        if any(ignore_folder in filename for ignore_folder in ignore_folders):
+            continue
+        mask[row] = True
+    return mask
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def _build_index(folder, signature):
+    manifest, matrices = load_store(folder)
+    return FolderIndex(folder, signature, manifest['records'], matrices, manifest.get('files'))
+
+def prepare_store(folder):
+    """ 이전 형식만 있는 폴더를 처음 한 번 변환하고 저장소가 있는지 반환.
+    변환은 폴더 잠금만 잡고 하므로 다른 폴더의 검색과 갱신은 기다리지 않는다 """
+    if not store_exists(folder):
+        with get_folder_lock(folder):
+            if not store_exists(folder):
+                if not os.path.exists(os.path.join(folder, EMBEDDINGS_FILE)):
+                    return False
+                # 이전 형식(embeddings.jsonl)만 있는 폴더는 처음 한 번 바이너리 저장소로 변환
+                migrate_jsonl(folder)
+    upgrade_store(folder)
+    return True
+
+def get_folder_index(folder):
+    """ 폴더의 임베딩 인덱스를 반환. 매니페스트가 교체된 경우에만 다시 로드한다.
+    변환과 로드는 전역 잠금 밖에서 하고, 전역 잠금은 캐시를 읽고 바꿀 때만 잡는다 """
+    folder = os.path.abspath(folder)
+
+    if not prepare_store(folder):
+        with _lock:
+            _indexes.pop(folder, None)
+        return None
+
+    for attempt in range(2):
+        try:
+            signature = _file_signature(get_manifest_file(folder))
+            with _lock:
+                index = _indexes.get(folder)
+            if index is not None and index.signature == signature:
+                return index
+
+            logging.debug(f"임베딩 인덱스 로드: {folder}")
+            index = _build_index(folder, signature)
+            break
+        except FileNotFoundError:
+            # 매니페스트를 읽은 직후 압축이 세그먼트를 지운 경우, 새 매니페스트로 한 번 더 시도
+            if attempt:
+                raise
+
+    with _lock:
+        current = _indexes.get(folder)
+        # 그 사이 다른 스레드가 지금의 매니페스트로 로드해 두었으면 그것을 쓴다
+        if current is not None and current.signature == _file_signature(get_manifest_file(folder)):
+            return current
+        _indexes[folder] = index
+    logging.debug(f"임베딩 인덱스 로드 완료: {len(index.files)}개 파일, {len(index)}개 청크")
+    return index
+
+def schedule_ann_update(folder):
+    """ 폴더의 ANN 색인 갱신을 백그라운드에 맡긴다. 이미 대기 중이면 다시 넣지 않는다 """
+    folder = os.path.abspath(folder)
+    with _ann_pending_lock:
+        if folder in _ann_pending:
+            return None
+        _ann_pending.add(folder)
+    logging.info(f"Scheduling ANN index update: {folder}")
+    return _ann_executor.submit(_update_ann, folder)
+
+def _update_ann(folder):
+    try:
+        with _ann_pending_lock:
+            _ann_pending.discard(folder)
+        index = get_folder_index(folder)
+        if index is None:
+            return
+        ann = update_ann_index(index)
+        if ann is not None:
+            index.set_ann(ann)
+    except Exception as e:
+        logging.error(f"ANN index update failed for {folder}: {str(e)}", exc_info=True)
+
+def read_moved_chunk(stale, record):
+    """ 교체된 인덱스(stale)의 청크 본문을 현재 인덱스에서 찾아 읽는다. 압축은 살아 있는 청크를 그대로 옮기므로
+    파일명, content_hash, 청크 번호가 같은 행을 찾는다. 파일이 바뀌었거나 지워졌으면 FileNotFoundError """
+    index = get_folder_index(stale.folder)
+    if index is not None and index is not stale:
+        for row in index.get_file_rows(record['filename']):
+            current = index.get_record(row)
+            if current['content_hash'] == record['content_hash'] and current.get('chunk', 0) == record.get('chunk', 0):
+                return index.get_content(row)
+    raise FileNotFoundError(f"Chunk {record.get('chunk', 0)} of {record['filename']} is no longer in the store: {stale.folder}")
+
+def invalidate_folder_index(folder):
+    with _lock:
+        _indexes.pop(os.path.abspath(folder), None)
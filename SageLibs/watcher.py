@@ -0,0 +1,354 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from .config import WATCH_DEBOUNCE_SECONDS, WATCH_MAX_DELAY_SECONDS, WATCH_POLL_INTERVAL
+from .utilities import get_file_paths, is_indexed_path
+from .scanner import get_path_matcher
+from .indexer import refresh_folder
+
+# inotify 이벤트 (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def walk_directories(folder, directory=None):
+    """ 무시 폴더를 건너뛰며 감시할 디렉터리 목록을 만든다 """
+    matcher = get_path_matcher()
+    for root, dirs, _ in os.walk(directory or folder):
+        relative = os.path.relpath(root, folder).replace(os.sep, '/')
+        dirs[:] = [d for d in dirs if not matcher.skip_folder(d, d if relative == '.' else f"{relative}/{d}")]
+        yield root
+
+class InotifyBackend:
+    """ 리눅스 inotify로 폴더 트리의 파일 변경을 감지. 하위 디렉터리마다 감시를 등록한다 """
+    mode = 'inotify'
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # 감시 번호 -> (감시 폴더, 디렉터리 경로)
+        self.watches = {}
+
+    def add_watch(self, folder, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, f"inotify_add_watch failed: {directory}")
+        self.watches[wd] = (folder, directory)
+
+    def add_folder(self, folder):
+        for directory in walk_directories(folder):
+            self.add_watch(folder, directory)
+
+    def remove_folder(self, folder):
+        for wd, (watched_folder, _) in list(self.watches.items()):
+            if watched_folder == folder:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+
+    def poll(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            self.handle_event(wd, mask, os.fsdecode(name))
+
+    def handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # 이벤트를 놓쳤으므로 모든 폴더를 전체 갱신
+            for folder in set(folder for folder, _ in self.watches.values()):
+                self.notify(folder, None)
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if wd not in self.watches:
+            return
+
+        folder, directory = self.watches[wd]
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if directory == folder:
+                self.notify(folder, None)
+            return
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if get_path_matcher().skip_folder(name, os.path.relpath(path, folder).replace(os.sep, '/')):
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                for subdirectory in walk_directories(folder, path):
+                    self.add_watch(folder, subdirectory)
+            # 디렉터리 단위 변경은 안쪽 파일 이벤트가 오지 않으므로 폴더 전체를 다시 확인 (stat 비교라 저렴)
+            self.notify(folder, None)
+            return
+
+        self.notify(folder, os.path.relpath(path, folder))
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingBackend:
+    """ inotify를 쓸 수 없을 때 주기적으로 파일의 mtime과 크기를 비교해 변경을 감지 """
+    mode = 'polling'
+
+    def __init__(self, notify, interval=WATCH_POLL_INTERVAL):
+        self.notify = notify
+        self.interval = interval
+        self.snapshots = {}
+        self.next_scan = 0
+
+    def snapshot(self, folder):
+        files = {}
+        for file_path in get_file_paths(folder):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            files[os.path.relpath(file_path, folder)] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def add_folder(self, folder):
+        self.snapshots[folder] = self.snapshot(folder)
+
+    def remove_folder(self, folder):
+        self.snapshots.pop(folder, None)
+
+    def poll(self, timeout):
+        wait = self.next_scan - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            return
+        self.next_scan = time.monotonic() + self.interval
+
+        for folder in list(self.snapshots):
+            previous = self.snapshots[folder]
+            current = self.snapshot(folder)
+            self.snapshots[folder] = current
+            for path in set(previous) | set(current):
+                if previous.get(path) != current.get(path):
+                    self.notify(folder, path)
+
+    def close(self):
+        self.snapshots.clear()
+
+class FolderWatcher:
+    """ 선택된 폴더를 감시하다가 바뀐 파일만 다시 임베딩하는 백그라운드 인덱서.
+    변경 이벤트는 폴더별로 모아 두었다가, 마지막 변경 후 WATCH_DEBOUNCE_SECONDS 동안 조용하거나
+    첫 변경 후 WATCH_MAX_DELAY_SECONDS가 지나면 한 번에 refresh_folder로 처리한다 """
+
+    def __init__(self):
+        self.folders = set()
+        # 폴더 -> 바뀐 상대 경로 집합. None이면 폴더 전체 갱신
+        self.pending = {}
+        self.first_event = None
+        self.last_event = None
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.backend = None
+        self.backend_lock = threading.Lock()
+
+        self.in_progress = 0
+        self.in_progress_since = None
+        self.last_refresh = None
+        self.last_error = None
+        self.refreshed_files = 0
+        self.embedded_files = 0
+        self.errors = 0
+
+        try:
+            self.backend = InotifyBackend(self.notify)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable, falling back to polling: {str(e)}")
+            self.backend = PollingBackend(self.notify)
+
+        self.watch_thread = threading.Thread(target=self.watch_loop, name='SageWatcher', daemon=True)
+        self.index_thread = threading.Thread(target=self.index_loop, name='SageIndexer', daemon=True)
+
+    def start(self, folders):
+        self.sync_folders(folders)
+        self.watch_thread.start()
+        self.index_thread.start()
+        logging.info(f"Folder watcher started ({self.backend.mode}): {sorted(self.folders)}")
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.watch_thread.join()
+        self.index_thread.join()
+        self.backend.close()
+        logging.info("Folder watcher stopped")
+
+    def sync_folders(self, folders):
+        """ 감시 대상 폴더를 선택된 폴더 목록과 맞춘다. 새 폴더는 감시 중이 아닐 때 바뀐 내용이 있을 수 있어 전체 갱신을 예약 """
+        folders = set(os.path.abspath(folder) for folder in folders if os.path.isdir(folder))
+        with self.backend_lock:
+            for folder in self.folders - folders:
+                self.backend.remove_folder(folder)
+            for folder in folders - self.folders:
+                try:
+                    self.backend.add_folder(folder)
+                except OSError as e:
+                    logging.warning(f"inotify watch failed for {folder}, falling back to polling: {str(e)}")
+                    self.switch_to_polling()
+                    self.backend.add_folder(folder)
+                self.notify(folder, None)
+            self.folders = folders
+
+        with self.condition:
+            for folder in list(self.pending):
+                if folder not in folders:
+                    del self.pending[folder]
+
+    def switch_to_polling(self):
+        self.backend.close()
+        self.backend = PollingBackend(self.notify)
+        for folder in self.folders:
+            self.backend.add_folder(folder)
+
+    def notify(self, folder, relative_path):
+        if relative_path is not None and not is_indexed_path(relative_path):
+            return
+        with self.condition:
+            now = time.monotonic()
+            if relative_path is None:
+                self.pending[folder] = None
+            elif self.pending.get(folder, set()) is not None:
+                self.pending.setdefault(folder, set()).add(relative_path)
+            if self.first_event is None:
+                self.first_event = now
+            self.last_event = now
+            self.condition.notify_all()
+
+    def watch_loop(self):
+        while not self.stopping:
+            try:
+                # 폴더 추가/제거와 겹치지 않도록 잠금 안에서 한 번씩 확인
+                with self.backend_lock:
+                    self.backend.poll(0.5)
+            except Exception as e:
+                logging.error(f"Folder watcher error: {str(e)}", exc_info=True)
+                time.sleep(1)
+
+    def take_batch(self):
+        """ 변경이 잠잠해지거나 최대 대기 시간이 지날 때까지 기다렸다가 모인 변경을 꺼낸다 """
+        with self.condition:
+            while not self.pending and not self.stopping:
+                self.condition.wait()
+            while not self.stopping:
+                now = time.monotonic()
+                quiet = now - self.last_event
+                waited = now - self.first_event
+                if quiet >= WATCH_DEBOUNCE_SECONDS or waited >= WATCH_MAX_DELAY_SECONDS:
+                    break
+                self.condition.wait(min(WATCH_DEBOUNCE_SECONDS - quiet, WATCH_MAX_DELAY_SECONDS - waited))
+
+            batch, self.pending = self.pending, {}
+            self.in_progress = count_queued(batch)
+            self.in_progress_since = self.first_event
+            self.first_event = None
+            return batch
+
+    def index_loop(self):
+        while not self.stopping:
+            batch = self.take_batch()
+            for folder, changed_paths in batch.items():
+                if self.stopping or folder not in self.folders:
+                    continue
+                try:
+                    error_files, stats = refresh_folder(folder, changed_paths)
+                    self.refreshed_files += stats['files']
+                    self.embedded_files += stats['embedded']
+                    if error_files:
+                        self.errors += len(error_files)
+                        self.last_error = f"{folder}: {', '.join(error_files)}"
+                except Exception as e:
+                    logging.error(f"Background refresh failed for {folder}: {str(e)}", exc_info=True)
+                    self.errors += 1
+                    self.last_error = f"{folder}: {str(e)}"
+            with self.condition:
+                self.in_progress = 0
+                self.in_progress_since = None
+                self.last_refresh = time.time()
+
+    def get_status(self):
+        with self.condition:
+            now = time.monotonic()
+            oldest = [since for since in (self.first_event, self.in_progress_since) if since is not None]
+            return {
+                'running': not self.stopping,
+                'mode': self.backend.mode,
+                'folders': sorted(self.folders),
+                'queue_depth': count_queued(self.pending),
+                'in_progress': self.in_progress,
+                'lag_seconds': round(now - min(oldest), 3) if oldest else 0.0,
+                'last_refresh': self.last_refresh,
+                'refreshed_files': self.refreshed_files,
+                'embedded_files': self.embedded_files,
+                'errors': self.errors,
+                'last_error': self.last_error
+            }
+
+def count_queued(pending):
+    """ 대기 중인 파일 수. 전체 갱신이 예약된 폴더는 1로 센다 """
+    return sum(1 if paths is None else len(paths) for paths in pending.values())
+
+def start_watcher(folders):
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = FolderWatcher()
+            _watcher.start(folders)
+        else:
+            _watcher.sync_folders(folders)
+        return _watcher
+
+def stop_watcher():
+    global _watcher
+    with _watcher_lock:
+        if _watcher is not None:
+            _watcher.stop()
+            _watcher = None
+
+def sync_watched_folders(folders):
+    with _watcher_lock:
+        if _watcher is not None:
+            _watcher.sync_folders(folders)
+
+def get_watcher_status():
+    with _watcher_lock:
+        if _watcher is None:
+            return {'running': False, 'queue_depth': 0, 'in_progress': 0, 'lag_seconds': 0.0}
+        return _watcher.get_status()
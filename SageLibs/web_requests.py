@@ -1,32 +1,73 @@
 import json
-import requests
 import logging
 from requests.exceptions import RequestException
-from .config import get_setting, API_URL, CHAT_API_URL, EMBEDDINGS_MODEL, CHAT_MODEL, CLAUDE_API_URL, CLAUDE_MODEL
-from SageLibs.Translator import translate_lines
+from .config import get_setting, API_URL, CHAT_API_URL, EMBEDDINGS_MODEL, EMBEDDINGS_DIMENSIONS, CHAT_MODEL, CLAUDE_API_URL, CLAUDE_MODEL, OLLAMA_API_URL, OLLAMA_MODEL
+from SageLibs.Translator import translate_texts
+from .http_client import post, record_usage, parse_retry_after
+from .embedding_cache import normalize_text, get_cache_key, get_cached_embedding, cache_embedding
 
-def get_embedding(text):
-    if get_setting('use_translator') == 'on':    
-        text = translate_lines(text)
+class RateLimitError(ValueError):
+    """ API가 429(요청 한도 초과)를 반환한 경우. retry_after는 서버가 알려준 대기 시간(초) """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def get_embedding_dimensions():
+    """ 요청할 임베딩 차원. 설정 embedding_dimensions가 없거나 잘못되면 모델의 기본 차원 """
+    try:
+        dimensions = int(get_setting('embedding_dimensions') or EMBEDDINGS_DIMENSIONS)
+    except (TypeError, ValueError):
+        logging.warning(f"Invalid embedding_dimensions '{get_setting('embedding_dimensions')}', using {EMBEDDINGS_DIMENSIONS}")
+        return EMBEDDINGS_DIMENSIONS
+    return dimensions if 0 < dimensions < EMBEDDINGS_DIMENSIONS else EMBEDDINGS_DIMENSIONS
+
+def get_embedding(text, use_cache=True):
+    """ 텍스트 하나(질문 등)의 임베딩. 공백을 정리한 텍스트와 모델(차원, 번역 설정 포함)을 키로 디스크 캐시를 먼저 찾고,
+    있으면 번역과 API 호출 없이 돌려준다 """
+    if not use_cache:
+        return get_embeddings([text])[0]
+
+    text = normalize_text(text)
+    dimensions = get_embedding_dimensions()
+    model = f"{EMBEDDINGS_MODEL}{f'@{dimensions}' if dimensions != EMBEDDINGS_DIMENSIONS else ''}{'+translated' if get_setting('use_translator') == 'on' else ''}"
+    key = get_cache_key(model, text)
+    embedding = get_cached_embedding(key)
+    if embedding is None:
+        embedding = get_embeddings([text])[0]
+        cache_embedding(key, model, embedding)
+    return embedding
+
+def get_embeddings(texts):
+    """ 여러 텍스트의 임베딩을 한 번의 요청으로 생성. 결과는 입력 순서와 같다 """
+    if get_setting('use_translator') == 'on':
+        texts = translate_texts(texts)
 
     headers = {
         "Authorization": f"Bearer {get_setting('openai_api_key')}",
         "Content-Type": "application/json"
     }
 
-    data = json.dumps({
-        "input": text,
+    request = {
+        "input": texts,
         "model": EMBEDDINGS_MODEL,
         "encoding_format": "float"
-    })
+    }
+    dimensions = get_embedding_dimensions()
+    if dimensions != EMBEDDINGS_DIMENSIONS:
+        # text-embedding-3 모델은 앞부분만 남겨 다시 정규화한 짧은 벡터를 돌려준다
+        request["dimensions"] = dimensions
+    data = json.dumps(request)
 
     try:
-        response = requests.post(API_URL, headers=headers, data=data)
+        # 429는 embedding_pipeline이 동시 요청 수를 줄이며 직접 재시도한다
+        response = post('openai', API_URL, headers=headers, data=data, retry_rate_limit=False)
         response.raise_for_status()
         result = response.json()
-        if 'data' not in result or not result['data']:
+        record_usage('openai', result.get('usage'))
+        if 'data' not in result or len(result['data']) != len(texts):
             raise ValueError(f"Unexpected API response structure: {result}")
-        return result['data'][0]['embedding']
+        return [item['embedding'] for item in sorted(result['data'], key=lambda item: item['index'])]
     except RequestException as e:
         # API 요청 실패
         error_message = "API 요청 실패"
@@ -35,6 +76,10 @@ def get_embedding(text):
             server_message = e.response.text
             if status_code == 401:
                 error_message = "API 키 인증 실패. API 키를 확인하세요."
+            elif status_code == 429:
+                retry_after = e.response.headers.get('Retry-After')
+                logging.warning(f"API 요청 한도 초과 (Retry-After: {retry_after})")
+                raise RateLimitError("API 요청 한도 초과", parse_retry_after(retry_after)) from e
             else:
                 error_message = f"API 요청 실패 (상태 코드: {status_code})"
             logging.error(f"{error_message}\n서버 응답: {server_message}")
@@ -50,7 +95,7 @@ def summarize_content(question, text):
     api_key = get_setting('openai_api_key')
 
     system_message = "You are an AI assistant specialized in extracting relevant information."
-    user_message = f"""Return 'Related' if the content of 'text:' is related to 'question:'.
+    user_message = f"""Return 'Related' if the content of 'text:' is related to 'question:', otherwise return 'Unrelated'.
 
 text:
 {text}
@@ -72,14 +117,16 @@ question:
     data = json.dumps({
         "model": "gpt-4o-mini",
         "messages": messages,
-        "temperature": 0
+        "temperature": 0,
+        "max_tokens": 3
     })
 
     try:
-        response = requests.post(CHAT_API_URL, headers=headers, data=data)
+        response = post('openai', CHAT_API_URL, headers=headers, data=data, idempotent=False)
         response.raise_for_status()
-
-        return response.json()['choices'][0]['message']['content']
+        result = response.json()
+        record_usage('openai', result.get('usage'))
+        return result['choices'][0]['message']['content']
     except RequestException as e:
         logging.error(f"Chat API 요청 실패: {str(e)}")
         return ""
@@ -87,7 +134,12 @@ question:
         logging.error(f"Chat API 응답 처리 오류: {str(e)}")
         return ""
 
-def get_chat_response(user_message):    
+def get_chat_model():
+    """ get_chat_response가 쓰는 모델. Claude API 키가 있으면 Claude를 쓴다 """
+    return CLAUDE_MODEL if get_setting('claude_api_key', '') else CHAT_MODEL
+
+def get_chat_response(user_message, stream=False):
+    """ 질문에 대한 답변을 생성. stream=True이면 답변 텍스트 조각을 생성되는 대로 돌려주는 이터레이터를 반환 """
     system_message = """You are an AI assistant specialized in answering questions based on provided context. 
     Your task is to:
         1. Analyze the full content of the relevant_docs and relevant_answers provided in the context.
@@ -96,15 +148,35 @@ def get_chat_response(user_message):
         4. Cite the filenames of relevant documents and the titles of relevant answers in your response.
         5. If appropriate, provide code snippets or examples from the context to support your answer.
         6. Refer to the JowFlow.md document for the Jow Flow diagram.
-        7. When creating diagrams, use mermaid syntax, except when creating a Jow Flow diagram."""
+        7. When creating diagrams, use mermaid syntax, except when creating a Jow Flow diagram.
+        8. A relevant_docs item may be an excerpt of a file; its 'lines' field gives the line range of the excerpt."""
 
     claude_api_key = get_setting('claude_api_key', '')
     if claude_api_key:
-        return get_chat_response_claude(claude_api_key, system_message, user_message)
+        return get_chat_response_claude(claude_api_key, system_message, user_message, stream)
     else:
-        return get_chat_response_openai(get_setting('openai_api_key'), system_message, user_message)
+        return get_chat_response_openai(get_setting('openai_api_key'), system_message, user_message, stream)
 
-def get_chat_response_openai(api_key, system_message, user_message):
+def iter_sse_events(response):
+    """ text/event-stream 응답을 (event, data) 단위로 나눈다 """
+    # charset이 없는 text/event-stream은 requests가 ISO-8859-1로 디코딩하므로 UTF-8로 고정
+    response.encoding = 'utf-8'
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == '':
+            if data:
+                yield event, '\n'.join(data)
+            event, data = None, []
+        elif line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data.append(line[5:].lstrip())
+    if data:
+        yield event, '\n'.join(data)
+
+def get_chat_response_openai(api_key, system_message, user_message, stream=False):
     logging.debug("OpenAI API 호출 시작")
 
     headers = {
@@ -117,16 +189,26 @@ def get_chat_response_openai(api_key, system_message, user_message):
         {"role": "user", "content": user_message}
     ]
 
-    data = json.dumps({
+    payload = {
         "model": CHAT_MODEL,
         "messages": messages,
-        "temperature": 0
-    })
+        "temperature": 0,
+        "stream": stream
+    }
+    if stream:
+        # 마지막 조각으로 토큰 사용량을 받는다
+        payload["stream_options"] = {"include_usage": True}
+    data = json.dumps(payload)
+
+    if stream:
+        return stream_chat_response_openai(headers, data)
 
     try:
-        response = requests.post(CHAT_API_URL, headers=headers, data=data)
+        response = post('openai', CHAT_API_URL, headers=headers, data=data, idempotent=False)
         response.raise_for_status()
-        return response.json()['choices'][0]['message']['content']
+        result = response.json()
+        record_usage('openai', result.get('usage'))
+        return result['choices'][0]['message']['content']
     except RequestException as e:
         logging.error(f"Chat API 요청 실패: {str(e)}")
         raise
@@ -134,7 +216,27 @@ def get_chat_response_openai(api_key, system_message, user_message):
         logging.error(f"Chat API 응답 처리 오류: {str(e)}")
         raise
 
-def get_chat_response_claude(api_key, system_message, user_message):
+def stream_chat_response_openai(headers, data):
+    try:
+        with post('openai', CHAT_API_URL, headers=headers, data=data, stream=True, idempotent=False) as response:
+            response.raise_for_status()
+            for _, payload in iter_sse_events(response):
+                if payload == '[DONE]':
+                    break
+                chunk = json.loads(payload)
+                record_usage('openai', chunk.get('usage'))
+                choices = chunk.get('choices') or [{}]
+                text = choices[0].get('delta', {}).get('content')
+                if text:
+                    yield text
+    except RequestException as e:
+        logging.error(f"Chat API 요청 실패: {str(e)}")
+        raise
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        logging.error(f"Chat API 응답 처리 오류: {str(e)}")
+        raise
+
+def get_chat_response_claude(api_key, system_message, user_message, stream=False):
     logging.debug("Claude API 호출 시작")
 
     headers = {
@@ -147,6 +249,7 @@ def get_chat_response_claude(api_key, system_message, user_message):
         "model": CLAUDE_MODEL,
         "max_tokens": 4000,
         "temperature": 0,
+        "stream": stream,
         "system": system_message,
         "messages": [
             {
@@ -160,34 +263,71 @@ def get_chat_response_claude(api_key, system_message, user_message):
             }
         ],
     })
+
+    if stream:
+        return stream_chat_response_claude(headers, data)
     
-    response = requests.post(CLAUDE_API_URL, headers=headers, data=data)
-    response_json = response.json()
-    
+    try:
+        response = post('claude', CLAUDE_API_URL, headers=headers, data=data, idempotent=False)
+        response_json = response.json()
+    except (RequestException, ValueError) as e:
+        logging.error(f"Claude API 요청 실패: {str(e)}")
+        return f"Error: {str(e)}"
+    record_usage('claude', response_json.get('usage'))
+
     if 'content' in response_json:
         return response_json['content'][0]['text']
     elif 'error' in response_json:
         return f"Error: {response_json['error']['message']}"
     else:
         return "Unexpected response structure from Claude API"
+
+def stream_chat_response_claude(headers, data):
+    with post('claude', CLAUDE_API_URL, headers=headers, data=data, stream=True, idempotent=False) as response:
+        if response.status_code != 200:
+            try:
+                message = response.json()['error']['message']
+            except (ValueError, KeyError):
+                message = response.text
+            logging.error(f"Claude API 요청 실패: {message}")
+            raise ValueError(f"Claude API error ({response.status_code}): {message}")
+
+        for event, payload in iter_sse_events(response):
+            if event == 'message_stop':
+                break
+            message = json.loads(payload)
+            if message.get('type') == 'message_start':
+                # output_tokens는 message_delta에서 누적값으로 온다
+                usage = message.get('message', {}).get('usage') or {}
+                record_usage('claude', {'input_tokens': usage.get('input_tokens', 0)})
+            elif message.get('type') == 'message_delta':
+                record_usage('claude', message.get('usage'))
+            elif message.get('type') == 'content_block_delta':
+                text = message.get('delta', {}).get('text')
+                if text:
+                    yield text
+            elif message.get('type') == 'error':
+                logging.error(f"Claude API 스트림 오류: {message['error']['message']}")
+                raise ValueError(f"Claude API error: {message['error']['message']}")
     
 def get_chat_response_ollama(message):
     logging.debug("Ollama API 호출 시작")
 
-    url = "http://localhost:11434/api/generate"
+    url = OLLAMA_API_URL
     headers = {
         "Content-Type": "application/json"
     }
     data = json.dumps({
-        "model": "gemma2",
+        "model": OLLAMA_MODEL,
         "prompt": message,
         "stream": False
     })
 
     try:
-        response = requests.post(url, headers=headers, data=data)
+        response = post('ollama', url, headers=headers, data=data, idempotent=False)
         response.raise_for_status()
         result = response.json()
+        record_usage('ollama', result)
         return result.get('response', "Unexpected response structure from Ollama API")
     except RequestException as e:
         logging.error(f"Ollama API 요청 실패: {str(e)}")
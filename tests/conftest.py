@@ -0,0 +1,55 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SageLibs import config, utilities
+
+class WordEncoder:
+    """ 테스트용 토크나이저. 공백으로 나눈 단어 하나를 토큰 하나로 센다 (tiktoken 인코딩 파일을 내려받지 않는다) """
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [text.split() for text in texts]
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """ 설정 파일과 데이터베이스는 작업 디렉터리에 만들어지므로 테스트마다 임시 디렉터리에서 기본 설정으로 실행한다 """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, 'settings', {})
+    monkeypatch.setattr(utilities, 'get_encoder', WordEncoder)
+    utilities._token_cache.clear()
+    yield
+    utilities._token_cache.clear()
+
+@pytest.fixture
+def questions_db(monkeypatch):
+    """ 작업 디렉터리의 새 SageQuestions.db를 쓰는 questions 모듈. 연결과 임베딩 캐시는 모듈 전역이므로 테스트마다 비우고,
+    질문+답변 임베딩은 API 대신 고정 벡터를 쓴다 """
+    import threading
+    from SageLibs import questions
+    monkeypatch.setattr(questions, '_local', threading.local())
+    monkeypatch.setattr(questions, '_initialized', False)
+    monkeypatch.setattr(questions, '_history', None)
+    monkeypatch.setattr(questions, '_question_cache', None)
+    monkeypatch.setattr(questions, 'get_embedding', lambda text: [1.0, 0.0, 0.0])
+    yield questions
+    connection = getattr(questions._local, 'connection', None)
+    if connection is not None:
+        connection.close()
+
+@pytest.fixture
+def jobs_db(monkeypatch):
+    """ 작업 디렉터리의 새 SageJobs.db를 쓰는 jobs 모듈. 연결과 초기화 여부, 실행 중인 작업 목록은 모듈 전역이므로 테스트마다 비운다 """
+    import threading
+    from SageLibs import jobs
+    monkeypatch.setattr(jobs, '_local', threading.local())
+    monkeypatch.setattr(jobs, '_initialized', False)
+    monkeypatch.setattr(jobs, '_jobs', {})
+    yield jobs
+    connection = getattr(jobs._local, 'connection', None)
+    if connection is not None:
+        connection.close()
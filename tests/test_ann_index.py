@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+from SageLibs import ann_index, embedding_store
+from SageLibs.ann_index import update_ann_index, load_ann_index, load_ann_arrays
+from SageLibs.embedding_store import StoreWriter
+from SageLibs.vector_index import get_folder_index
+
+DIMENSIONS = 16
+
+def clustered(rng, count, centers):
+    """ 몇 개의 중심 주변에 모인 벡터 (실제 임베딩처럼 고르게 퍼져 있지 않다) """
+    return centers[rng.integers(len(centers), size=count)] + rng.normal(scale=0.3, size=(count, DIMENSIONS))
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """ 2000행 저장소와 같은 분포에서 벡터를 더 뽑는 함수. ANN 최소 행 수와 PQ 부분 벡터 수는 테스트 크기에 맞춰 줄인다 """
+    monkeypatch.setattr(ann_index, 'ANN_MIN_ROWS', 100)
+    monkeypatch.setattr(ann_index, 'ANN_PQ_SUBVECTORS', 8)
+    monkeypatch.setattr(embedding_store, 'schedule_compaction', lambda folder: None)
+    rng = np.random.default_rng(42)
+    centers = rng.normal(size=(20, DIMENSIONS))
+    folder = str(tmp_path)
+
+    def commit(vectors, keep=False, prefix='a'):
+        writer = StoreWriter(folder, 'float32')
+        if keep:
+            for record in writer.base['records']:
+                writer.keep(record)
+        for i, vector in enumerate(vectors):
+            writer.add(f"{prefix}{i}.py", f"x = {i}\n", f"hash-{prefix}{i}", vector.astype(np.float32))
+        writer.commit()
+        return get_folder_index(folder)
+
+    commit(clustered(rng, 2000, centers))
+    return folder, commit, lambda count: clustered(rng, count, centers)
+
+def normalized(vector):
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+def test_too_small_index_is_skipped(store, monkeypatch):
+    folder, _, _ = store
+    monkeypatch.setattr(ann_index, 'ANN_MIN_ROWS', 5000)
+    assert update_ann_index(get_folder_index(folder)) is None
+    assert load_ann_arrays(folder) is None
+
+def test_search_recall_against_exact(store):
+    folder, _, sample = store
+    index = get_folder_index(folder)
+    ann = update_ann_index(index)
+    assert ann.coverage == 1.0 and len(ann.uncovered) == 0
+    mask = np.ones(len(index), dtype=bool)
+
+    hits = total = 0
+    for query in sample(20):
+        query = normalized(query)
+        exact = set(np.argsort(-index.score(query))[:10].tolist())
+        candidates = set(ann.search(query, 40, 8, mask).tolist())
+        hits += len(exact & candidates)
+        total += len(exact)
+    assert hits / total >= 0.9
+
+    # 모든 목록을 보고 후보 수가 충분하면 정확한 검색과 같다
+    query = normalized(sample(1)[0])
+    everything = ann.search(query, len(index), len(ann.centroids), mask)
+    assert sorted(everything.tolist()) == list(range(len(index)))
+
+def test_search_respects_mask(store):
+    folder, _, sample = store
+    index = get_folder_index(folder)
+    ann = update_ann_index(index)
+    mask = np.zeros(len(index), dtype=bool)
+    mask[::2] = True
+    candidates = ann.search(normalized(sample(1)[0]), 50, len(ann.centroids), mask)
+    assert len(candidates) == 50 and mask[candidates].all()
+
+def test_incremental_update_reuses_codes(store):
+    folder, commit, sample = store
+    first = update_ann_index(get_folder_index(folder))
+    before = load_ann_arrays(folder)
+
+    index = commit(sample(100), keep=True, prefix='b')
+    # 색인 이후에 추가된 청크는 갱신 전까지 항상 후보에 든다
+    stale = load_ann_index(index)
+    assert len(stale.uncovered) == 100 and stale.coverage == pytest.approx(2000 / 2100)
+    mask = np.ones(len(index), dtype=bool)
+    assert set(stale.uncovered.tolist()) <= set(stale.search(normalized(sample(1)[0]), 5, 1, mask).tolist())
+
+    ann = update_ann_index(index)
+    after = load_ann_arrays(folder)
+    assert len(ann.uncovered) == 0 and ann.coverage == 1.0
+    # 다시 학습하지 않고 기존 청크의 코드는 그대로 쓴다
+    np.testing.assert_array_equal(after['centroids'], before['centroids'])
+    assert int(after['trained_rows']) == 2000
+    old = np.isin(after['keys'], before['keys'])
+    assert old.sum() == 2000
+    order = np.argsort(before['keys'])
+    positions = order[np.searchsorted(before['keys'][order], after['keys'][old])]
+    np.testing.assert_array_equal(after['codes'][old], before['codes'][positions])
+    assert len(first.rows) == 2000
+
+def test_growth_beyond_limit_retrains(store, monkeypatch):
+    folder, commit, sample = store
+    monkeypatch.setattr(ann_index, 'ANN_RETRAIN_GROWTH', 1.04)
+    update_ann_index(get_folder_index(folder))
+    index = commit(sample(100), keep=True, prefix='b')
+    update_ann_index(index)
+    assert int(load_ann_arrays(folder)['trained_rows']) == 2100
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from SageLibs.embedding_store import StoreWriter
+
+def commit_store(folder, files):
+    """ 파일명 -> content_hash로 폴더 저장소의 새 세대를 만든다 """
+    writer = StoreWriter(folder, 'float32')
+    for filename, content_hash in files.items():
+        writer.add(filename, f"{filename} body\n", content_hash, [1.0, 0.0])
+    writer.commit()
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = str(tmp_path / 'repo')
+    commit_store(folder, {'a.py': 'hash-a', 'b.py': 'hash-b'})
+    return folder
+
+def store_answer(questions, folder, embedding, filenames=('a.py',)):
+    sources = questions.get_sources([{'folder': folder, 'filename': filename} for filename in filenames])
+    return questions.insert_question("How does a work?", "It works.", np.asarray(embedding, dtype=np.float32), sources)
+
+def test_hit_for_similar_question_with_unchanged_sources(questions_db, folder):
+    doc_id = store_answer(questions_db, folder, [1.0, 0.0, 0.0])
+    record, similarity = questions_db.find_cached_answer(np.array([1.0, 0.01, 0.0], dtype=np.float32), [folder])
+    assert record['doc_id'] == doc_id and record['answer'] == "It works."
+    assert similarity > 0.99
+
+def test_miss_below_threshold(questions_db, folder):
+    store_answer(questions_db, folder, [1.0, 0.0, 0.0])
+    record, reason = questions_db.find_cached_answer(np.array([1.0, 0.5, 0.0], dtype=np.float32), [folder])
+    assert record is None and reason.startswith('no similar question')
+
+def test_miss_when_source_changed_or_removed(questions_db, folder):
+    store_answer(questions_db, folder, [1.0, 0.0, 0.0], ('a.py', 'b.py'))
+    query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+    commit_store(folder, {'a.py': 'hash-a', 'b.py': 'hash-b2'})
+    record, reason = questions_db.find_cached_answer(query, [folder])
+    assert record is None and 'b.py has changed' in reason
+
+    commit_store(folder, {'a.py': 'hash-a'})
+    record, reason = questions_db.find_cached_answer(query, [folder])
+    assert record is None and 'b.py is no longer indexed' in reason
+
+def test_miss_when_source_folder_not_selected(questions_db, folder, tmp_path):
+    store_answer(questions_db, folder, [1.0, 0.0, 0.0])
+    record, reason = questions_db.find_cached_answer(np.array([1.0, 0.0, 0.0], dtype=np.float32), [str(tmp_path / 'other')])
+    assert record is None and 'is not selected' in reason
+
+def test_answer_without_documents_is_never_served(questions_db, folder):
+    questions_db.insert_question("General question", "General answer.", np.array([0.0, 1.0, 0.0], dtype=np.float32), [])
+    record, reason = questions_db.find_cached_answer(np.array([0.0, 1.0, 0.0], dtype=np.float32), [folder])
+    assert record is None and 'used no documents' in reason
+
+def test_most_similar_valid_answer_wins(questions_db, folder):
+    store_answer(questions_db, folder, [1.0, 0.0, 0.0], ('b.py',))
+    newer = store_answer(questions_db, folder, [1.0, 0.0, 0.0])
+    commit_store(folder, {'a.py': 'hash-a', 'b.py': 'hash-b2'})
+    record, _ = questions_db.find_cached_answer(np.array([1.0, 0.0, 0.0], dtype=np.float32), [folder])
+    assert record['doc_id'] == newer
+
+def test_dimension_change(questions_db, folder):
+    store_answer(questions_db, folder, [1.0, 0.0, 0.0])
+    # embedding_dimensions를 바꾼 뒤의 질문은 이전 차원의 질문과 비교하지 않는다
+    record, reason = questions_db.find_cached_answer(np.array([1.0, 0.0], dtype=np.float32), [folder])
+    assert record is None and reason == "no stored questions with the same embedding dimensions"
+
+    doc_id = store_answer(questions_db, folder, [1.0, 0.0])
+    record, _ = questions_db.find_cached_answer(np.array([1.0, 0.0], dtype=np.float32), [folder])
+    assert record['doc_id'] == doc_id
+    # 원래 차원으로 돌아가면 그 차원의 질문을 다시 읽는다
+    record, _ = questions_db.find_cached_answer(np.array([1.0, 0.0, 0.0], dtype=np.float32), [folder])
+    assert record['doc_id'] == doc_id - 1
+
+def test_deleted_question_is_not_served(questions_db, folder):
+    doc_id = store_answer(questions_db, folder, [1.0, 0.0, 0.0])
+    query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    assert questions_db.find_cached_answer(query, [folder])[0]['doc_id'] == doc_id
+    questions_db.delete_question(doc_id)
+    assert questions_db.find_cached_answer(query, [folder])[0] is None
+
+def test_empty_history(questions_db, folder):
+    assert questions_db.find_cached_answer(np.array([1.0, 0.0, 0.0], dtype=np.float32), [folder]) == (None, "no stored questions")
@@ -0,0 +1,55 @@
+import pytest
+from SageLibs import change_analysis
+
+@pytest.fixture
+def diffs(monkeypatch):
+    """ git과 API 호출 없이 파일 두 개의 변경을 분석하게 한다. reviews에 파일별 리뷰나 예외를 넣는다 """
+    reviews = {}
+    file_diffs = [{'path': 'a.py', 'old_path': 'a.py', 'status': 'modified', 'text': 'diff a'},
+                  {'path': 'b.py', 'old_path': 'b.py', 'status': 'modified', 'text': 'diff b'}]
+    monkeypatch.setattr(change_analysis, 'get_base_branch', lambda folder: 'main')
+    monkeypatch.setattr(change_analysis, 'get_file_diffs', lambda folder, analysis_type, base_branch: file_diffs)
+    monkeypatch.setattr(change_analysis, 'embed_diffs', lambda file_diffs: {i: ([1.0], None) for i in range(len(file_diffs))})
+
+    def review_file(folder, question, base_revision, file_diff, embedding, on_text=None):
+        review = reviews[file_diff['path']]
+        if isinstance(review, Exception):
+            raise review
+        if on_text is not None:
+            for word in review.split(' '):
+                on_text(word + ' ')
+        return review
+    monkeypatch.setattr(change_analysis, 'review_file', review_file)
+    return reviews
+
+def test_reviews_are_joined_in_file_order(diffs):
+    diffs.update({'a.py': 'review a', 'b.py': 'review b'})
+    assert change_analysis.analyze_changes('/repo', 'main', 'question') == "# File: a.py\n\nreview a\n\n# File: b.py\n\nreview b\n\n"
+
+def test_failed_file_leaves_an_error_note(diffs):
+    diffs.update({'a.py': RuntimeError('timeout'), 'b.py': 'review b'})
+    answer = change_analysis.analyze_changes('/repo', 'main', 'question')
+    assert "> Error processing a.py: timeout" in answer
+    assert "review b" in answer
+
+def test_all_files_failing_raises(diffs):
+    diffs.update({'a.py': RuntimeError('timeout'), 'b.py': RuntimeError('rate limited')})
+    with pytest.raises(ValueError, match='All 2 file reviews failed'):
+        change_analysis.analyze_changes('/repo', 'main', 'question')
+
+def test_reviews_stream_through_the_job_output(diffs, jobs_db):
+    diffs.update({'a.py': 'review a', 'b.py': RuntimeError('timeout')})
+    job = jobs_db.Job('analyze', 'analyze:main:/repo', 'Analyze')
+    answer = change_analysis.analyze_changes('/repo', 'main', 'question', progress=job)
+    assert "review a" in answer
+    assert job.output == [{'item': 'a.py', 'text': 'review '}, {'item': 'a.py', 'text': 'a '}]
+    assert (job.total, job.done) == (2, 2)
+    assert job.errors == [{'item': 'b.py', 'error': 'timeout'}]
+
+def test_cancelling_stops_a_streaming_review(diffs, jobs_db):
+    diffs.update({'a.py': 'review a', 'b.py': 'review b'})
+    job = jobs_db.Job('analyze', 'analyze:main:/repo', 'Analyze')
+    job.cancel_event.set()
+    with pytest.raises(jobs_db.JobCancelled):
+        change_analysis.analyze_changes('/repo', 'main', 'question', progress=job)
+    assert job.output == []
@@ -0,0 +1,49 @@
+from SageLibs.chunker import chunk_file
+from SageLibs.utilities import count_tokens
+
+def check_spans(chunks, content):
+    """ 청크를 이어 붙이면 원본이고 줄 번호가 빈틈없이 이어지는지 """
+    assert ''.join(chunk['content'] for chunk in chunks) == content
+    assert [chunk['chunk'] for chunk in chunks] == list(range(len(chunks)))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk['start_line'] == previous['end_line'] + 1
+    for chunk in chunks:
+        assert chunk['end_line'] - chunk['start_line'] + 1 == chunk['content'].count('\n') + (not chunk['content'].endswith('\n'))
+
+def test_empty_file_is_one_empty_chunk():
+    assert chunk_file('empty.py', '') == [{'chunk': 0, 'start_line': 1, 'end_line': 1, 'content': ''}]
+
+def test_small_file_is_one_chunk():
+    content = "def a():\n    return 1\n\ndef b():\n    return 2"
+    chunks = chunk_file('small.py', content, max_tokens=100)
+    assert len(chunks) == 1
+    assert (chunks[0]['start_line'], chunks[0]['end_line']) == (1, 5)
+    check_spans(chunks, content)
+
+def test_python_sections_keep_decorators_and_comments():
+    content = "import os\n\n# first\n@decorator\ndef a():\n    return 1\n\nclass B:\n    def c(self):\n        return 2\n"
+    chunks = chunk_file('module.py', content, max_tokens=6)
+    check_spans(chunks, content)
+    assert any(chunk['content'].startswith("# first\n@decorator\ndef a():") for chunk in chunks)
+    assert all(count_tokens(chunk['content']) <= 6 for chunk in chunks)
+
+def test_oversized_section_is_split_by_lines():
+    # 경계가 없는 한 구간이 예산을 넘으면 줄 단위로 나눈다
+    content = ''.join(f"    word{i} a b c d\n" for i in range(10))
+    chunks = chunk_file('notes.txt', content, max_tokens=12)
+    check_spans(chunks, content)
+    assert len(chunks) == 5
+    assert all(count_tokens(chunk['content']) <= 12 for chunk in chunks)
+
+def test_single_line_over_budget_stays_whole():
+    content = ' '.join(['token'] * 50) + '\n'
+    chunks = chunk_file('long.txt', content, max_tokens=10)
+    assert len(chunks) == 1
+    check_spans(chunks, content)
+
+def test_line_numbers_follow_newlines_only():
+    # \f 같은 문자에서는 줄을 나누지 않는다
+    content = "a\fb c\n" + "d e f\n" * 4
+    chunks = chunk_file('form.txt', content, max_tokens=6)
+    check_spans(chunks, content)
+    assert chunks[-1]['end_line'] == 5
@@ -0,0 +1,121 @@
+from SageLibs import config, context_packer
+from SageLibs.context_packer import pack_context, get_context_budget
+from SageLibs.utilities import count_tokens
+
+def document(filename, similarity, tokens, folder='/repo', content=None, lines='1-10'):
+    return {'filename': filename, 'folder': folder, 'similarity': similarity, 'tokens': tokens,
+            'content': content if content is not None else f"{filename} body\n", 'lines': lines}
+
+def answer(title, similarity, tokens):
+    return {'title': title, 'answer': f"{title} answer", 'similarity': similarity, 'tokens': tokens}
+
+def decisions(report):
+    return {entry['name']: entry['decision'] for entry in report['items']}
+
+def test_budget_selects_by_value_per_token():
+    items = [document('large.py', 0.9, 300), document('dense.py', 0.8, 200), answer('old answer', 0.5, 400)]
+    selected, report = pack_context('question', items, 500)
+    # 토큰당 가치: dense 0.004 > large 0.003 > answer 0.00125. 선택한 항목은 관련도순
+    assert [item.get('filename', item.get('title')) for item in selected] == ['large.py', 'dense.py']
+    assert report['used_tokens'] == 500 and report['budget'] == 500
+    assert decisions(report) == {'/repo/large.py:1-10': 'selected', '/repo/dense.py:1-10': 'selected', 'old answer': 'over_budget'}
+
+def test_small_items_do_not_win_on_density_alone():
+    # CONTEXT_MIN_ITEM_TOKENS보다 작은 항목은 그 크기로 보고 계산한다
+    items = [document('tiny.py', 0.3, 10), document('relevant.py', 0.9, 200)]
+    _, report = pack_context('question', items, 200)
+    assert decisions(report) == {'/repo/relevant.py:1-10': 'selected', '/repo/tiny.py:1-10': 'over_budget'}
+
+def test_oversized_document_contributes_best_region():
+    lines = [f"filler line number {i} with some more words here\n" for i in range(100)]
+    lines[70] = "def parse_config(path): return load parse_config\n"
+    content = ''.join(lines)
+    item = document('big.py', 0.9, count_tokens('big.py\n\n' + content), content=content, lines='11-110')
+    selected, report = pack_context('where is parse_config defined', [item], 600)
+
+    [part] = selected
+    assert part['partial'] is True
+    assert 'parse_config' in part['content']
+    assert part['tokens'] <= 600
+    start, end = (int(value) for value in part['lines'].split('-'))
+    # 원본의 줄 번호(11부터)에 맞춘 구간이고, 검색어가 나온 줄(81번째 줄)을 포함한다
+    assert 11 <= start <= 81 <= end <= 110
+    assert part['content'] == ''.join(lines[start - 11:end - 10])
+    [entry] = report['items']
+    assert entry['decision'] == 'partial' and entry['tokens'] == part['tokens']
+    assert report['used_tokens'] == part['tokens']
+
+def test_partial_needs_minimum_remaining_budget():
+    content = ''.join(f"word {i} a b c d e f g h\n" for i in range(100))
+    item = document('big.py', 0.9, 1000, content=content)
+    selected, report = pack_context('question', [item], config.CONTEXT_PARTIAL_MIN_TOKENS - 1)
+    assert selected == []
+    assert report['items'][0]['decision'] == 'over_budget'
+
+def test_duplicates_across_folders_keep_most_relevant():
+    items = [document('util.py', 0.7, 100, folder='/fork', content='same\n'),
+             document('util.py', 0.8, 100, folder='/main', content='same\n'),
+             document('other.py', 0.6, 100, folder='/main')]
+    selected, report = pack_context('question', items, 1000)
+    assert [(item['folder'], item['filename']) for item in selected] == [('/main', 'util.py'), ('/main', 'other.py')]
+    duplicate = next(entry for entry in report['items'] if entry['decision'] == 'duplicate')
+    assert duplicate['name'] == '/fork/util.py:1-10'
+    assert duplicate['reason'] == 'same content as /main/util.py:1-10'
+
+def test_unrelated_items_free_budget_for_others(monkeypatch):
+    judged = []
+
+    def judge(question, items, timeout):
+        judged.append([item.get('filename') for item in items])
+        return [item['filename'] != 'noise.py' for item in items]
+    monkeypatch.setattr(context_packer, 'judge_items', judge)
+
+    items = [document('noise.py', 0.9, 300), document('useful.py', 0.8, 300)]
+    selected, report = pack_context('question', items, 300, filter_related=True)
+    assert [item['filename'] for item in selected] == ['useful.py']
+    assert decisions(report) == {'/repo/noise.py:1-10': 'unrelated', '/repo/useful.py:1-10': 'selected'}
+    # 다시 채운 항목만 추가로 판정한다
+    assert judged == [['noise.py'], ['useful.py']]
+
+def test_unjudged_items_are_kept_after_deadline(monkeypatch):
+    monkeypatch.setattr(context_packer, 'judge_items', lambda question, items, timeout: [None] * len(items))
+    selected, report = pack_context('question', [document('slow.py', 0.9, 100)], 300, filter_related=True, deadline=0)
+    assert len(selected) == 1
+    assert report['items'][0]['reason'].endswith('relevance not judged before the deadline')
+
+def test_context_budget_uses_setting_and_model_window():
+    assert get_context_budget('gpt-4o-2024-08-06') == min(config.CONTEXT_MAX_TOKENS, 128000 - config.CONTEXT_RESERVED_TOKENS)
+    config.get_settings()['context_max_tokens'] = 500000
+    assert get_context_budget('claude-3-sonnet-20240229') == 200000 - config.CONTEXT_RESERVED_TOKENS
+    config.get_settings()['context_max_tokens'] = 'not a number'
+    assert get_context_budget('unknown-model') == min(config.CONTEXT_MAX_TOKENS, config.DEFAULT_CONTEXT_WINDOW - config.CONTEXT_RESERVED_TOKENS)
+
+def test_partial_region_is_what_gets_judged(monkeypatch):
+    judged = []
+
+    def judge(question, items, timeout):
+        judged.extend(items)
+        return [True] * len(items)
+    monkeypatch.setattr(context_packer, 'judge_items', judge)
+
+    content = ''.join(f"filler line {i} a b c d e f g\n" for i in range(200))
+    item = document('big.py', 0.9, count_tokens('big.py\n\n' + content), content=content, lines='1-200')
+    [part], _ = pack_context('question', [item], 600, filter_related=True)
+    assert [judged_item['content'] for judged_item in judged] == [part['content']]
+    assert len(part['content']) < len(content)
+
+def test_retrieval_leaves_the_budget_to_the_packer(tmp_path):
+    from SageLibs.embedding_store import StoreWriter
+    from SageLibs.utilities import get_relevant_documents
+
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    for i, similarity in enumerate([1.0, 0.9, 0.8]):
+        body = ' '.join(['word'] * 300) + '\n'
+        writer.add(f'f{i}.py', body, f'h{i}', [similarity, (1 - similarity ** 2) ** 0.5], tokens=301)
+    writer.commit()
+
+    query = [1.0, 0.0]
+    # 예산을 넘는 후보도 모두 넘겨야 pack_context가 토큰당 가치로 고르거나 일부만 넣을 수 있다
+    assert [doc['filename'] for doc in get_relevant_documents([folder], query, max_tokens=None)] == ['f0.py', 'f1.py', 'f2.py']
+    assert [doc['filename'] for doc in get_relevant_documents([folder], query, max_tokens=700)] == ['f0.py', 'f1.py']
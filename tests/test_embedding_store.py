@@ -0,0 +1,126 @@
+import os
+import numpy as np
+import pytest
+from SageLibs import embedding_store
+from SageLibs.embedding_store import StoreWriter, load_store, read_content, compact_store, get_store_dir, get_segment_path
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    """ 커밋이 요청한 백그라운드 압축을 실행하지 않고 기록만 한다 """
+    folders = []
+    monkeypatch.setattr(embedding_store, 'schedule_compaction', folders.append)
+    return folders
+
+def vector(*values):
+    return np.array(values, dtype=np.float32)
+
+def segment_files(folder):
+    return sorted(name for name in os.listdir(get_store_dir(folder)) if name.startswith('seg-'))
+
+def stored(folder):
+    """ 파일명마다 (본문, 원래 크기로 되돌린 벡터) 목록 """
+    manifest, matrices = load_store(folder)
+    result = {}
+    for record in manifest['records']:
+        embedding = np.asarray(matrices[record['segment']][record['row']], dtype=np.float32) * record['norm']
+        result.setdefault(record['filename'], []).append((read_content(folder, record), embedding))
+    return manifest, result
+
+def test_round_trip(tmp_path, scheduled):
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    writer.add('a.py', 'def a():\n', 'hash-a', vector(3, 4), chunk=0)
+    writer.add('a.py', '    return 1\n', 'hash-a', vector(0, 2), chunk=1, start_line=2)
+    writer.add('b.py', 'b = 2\n', 'hash-b', vector(1, 0))
+    writer.set_file_state('a.py', {'content_hash': 'hash-a'})
+    writer.commit()
+
+    manifest, files = stored(folder)
+    assert manifest['generation'] == 1
+    assert [content for content, _ in files['a.py']] == ['def a():\n', '    return 1\n']
+    np.testing.assert_allclose(files['a.py'][0][1], [3, 4], rtol=1e-6)
+    assert manifest['records'][0]['norm'] == pytest.approx(5.0)
+    assert manifest['records'][1]['start_line'] == 2
+    assert manifest['files'] == {'a.py': {'content_hash': 'hash-a'}}
+    assert scheduled == []
+
+def test_keep_and_delete_reuse_old_segments(tmp_path, scheduled):
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    writer.add('a.py', 'a = 1\n', 'hash-a', vector(1, 0))
+    writer.add('b.py', 'b = 2\n', 'hash-b', vector(0, 1))
+    writer.commit()
+
+    # a.py는 그대로 두고, b.py는 지우고, c.py를 추가
+    writer = StoreWriter(folder, 'float32')
+    writer.keep(next(record for record in writer.base['records'] if record['filename'] == 'a.py'), mtime=42)
+    writer.add('c.py', 'c = 3\n', 'hash-c', vector(1, 1))
+    writer.commit()
+
+    manifest, files = stored(folder)
+    assert sorted(files) == ['a.py', 'c.py']
+    assert files['a.py'][0][0] == 'a = 1\n'
+    assert manifest['records'][0]['segment'] == 'seg-000001' and manifest['records'][0]['mtime'] == 42
+    assert [segment['name'] for segment in manifest['segments']] == ['seg-000001', 'seg-000002']
+    # 죽은 행(b.py)이 COMPACTION_DEAD_RATIO를 넘었으므로 압축을 예약한다
+    assert scheduled == [folder]
+
+    # 첫 세그먼트를 참조하는 청크가 없어지면 그 파일들을 지운다
+    writer = StoreWriter(folder, 'float32')
+    writer.keep(next(record for record in writer.base['records'] if record['filename'] == 'c.py'))
+    writer.commit()
+    assert all(name.startswith('seg-000002.') for name in segment_files(folder))
+    assert sorted(stored(folder)[1]) == ['c.py']
+
+def test_compact_rewrites_live_rows_into_one_segment(tmp_path, scheduled):
+    folder = str(tmp_path)
+    for generation in range(3):
+        writer = StoreWriter(folder, 'float32')
+        for record in writer.base['records']:
+            writer.keep(record)
+        writer.add(f'f{generation}.py', f'x = {generation}\n', f'hash-{generation}', vector(generation + 1, 1, -1))
+        writer.commit()
+    _, before = stored(folder)
+
+    assert compact_store(folder, force=True, dtype='int8')
+    manifest, after = stored(folder)
+    assert [segment['name'] for segment in manifest['segments']] == ['seg-000004']
+    assert manifest['segments'][0]['dtype'] == 'int8'
+    assert os.path.exists(get_segment_path(folder, 'seg-000004', 'scl'))
+    assert segment_files(folder) == ['seg-000004.bin', 'seg-000004.lex', 'seg-000004.npy', 'seg-000004.scl', 'seg-000004.sym']
+    assert sorted(after) == sorted(before)
+    for filename, [(content, embedding)] in before.items():
+        assert after[filename][0][0] == content
+        np.testing.assert_allclose(after[filename][0][1], embedding, atol=0.02)
+
+def test_compact_skips_store_that_does_not_need_it(tmp_path, scheduled):
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    writer.add('a.py', 'a = 1\n', 'hash-a', vector(1, 0))
+    writer.commit()
+    assert compact_store(folder) is False
+    assert load_store(folder)[0]['generation'] == 1
+
+def test_abort_and_failed_commit_leave_no_segment_files(tmp_path, scheduled):
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    writer.add('a.py', 'a = 1\n', 'hash-a', vector(1, 0))
+    writer.abort()
+    assert segment_files(folder) == []
+
+    writer = StoreWriter(folder, 'int8')
+    writer.add('a.py', 'a = 1\n', 'hash-a', vector(1, 0))
+
+    def fail(f):
+        raise OSError(28, 'No space left on device')
+    writer.symbols.save = fail
+    with pytest.raises(OSError):
+        writer.commit()
+    assert segment_files(folder) == []
+    assert writer.content_file.closed
+
+    # 잠금이 풀렸으므로 다음 커밋은 같은 세대로 성공한다
+    writer = StoreWriter(folder, 'float32')
+    writer.add('a.py', 'a = 1\n', 'hash-a', vector(1, 0))
+    writer.commit()
+    assert load_store(folder)[0]['generation'] == 1
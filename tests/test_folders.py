@@ -0,0 +1,29 @@
+import json
+from SageLibs import folders
+
+def test_reads_the_file_tinydb_wrote():
+    with open(folders.FOLDERS_FILE, 'w', encoding='utf-8') as file:
+        json.dump({'_default': {}, 'folders': {'1': {'path': '/b', 'selected': True}, '2': {'path': '/a', 'selected': False},
+                                               '10': {'path': '/c', 'selected': True}}}, file)
+    assert folders.get_all_folders() == ['/a', '/b', '/c']
+    assert folders.get_selected_folders() == ['/b', '/c']
+
+    assert folders.add_folder('/d') == (True, "Folder added successfully")
+    with open(folders.FOLDERS_FILE, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    assert data['folders']['11'] == {'path': '/d', 'selected': False}
+    assert data['_default'] == {}
+
+def test_add_select_delete():
+    assert folders.get_all_folders() == []
+    assert folders.add_folder('/a')[0]
+    assert folders.add_folder('/b')[0]
+    assert folders.add_folder('/a') == (False, "Folder already exists in the list")
+
+    assert folders.update_selected_folders(['/b'])[0]
+    assert folders.get_selected_folders() == ['/b']
+
+    assert folders.delete_folder('/b')[0]
+    assert folders.delete_folder('/b') == (False, "Folder not found in the list")
+    assert folders.get_all_folders() == ['/a']
+    assert folders.get_selected_folders() == []
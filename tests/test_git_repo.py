@@ -0,0 +1,113 @@
+from SageLibs.git_repo import parse_diff
+
+def diff(*files):
+    return '\n'.join(files).encode('utf-8') + b'\n'
+
+MODIFIED = """diff --git a/src/app.py b/src/app.py
+index 587be6b..b77b4eb 100644
+--- a/src/app.py
++++ b/src/app.py
+@@ -1,3 +1,4 @@ def main():
+ a
+-b
++B
++c
+ d
+@@ -10 +11 @@
+-x
++y"""
+
+RENAMED = """diff --git a/old.txt b/new.txt
+similarity index 75%
+rename from old.txt
+rename to new.txt
+index b2f931a..b80f223 100644
+--- a/old.txt
++++ b/new.txt
+@@ -2 +2 @@
+-three
++THREE"""
+
+PURE_RENAME = """diff --git a/docs/a.md b/docs/b.md
+similarity index 100%
+rename from docs/a.md
+rename to docs/b.md"""
+
+BINARY = """diff --git a/logo.png b/logo.png
+index 0000001..8352675 100644
+Binary files a/logo.png and b/logo.png differ"""
+
+ADDED_BINARY_WITH_SPACE = """diff --git a/sp ace.png b/sp ace.png
+new file mode 100644
+index 0000000..8835708
+Binary files /dev/null and b/sp ace.png differ"""
+
+DELETED = """diff --git a/gone.txt b/gone.txt
+deleted file mode 100644
+index 2fa992c..0000000
+--- a/gone.txt
++++ /dev/null
+@@ -1 +0,0 @@
+-keep"""
+
+QUOTED = """diff --git "a/qu\\"ote.txt" "b/qu\\"ote.txt"
+new file mode 100644
+index 0000000..b680253
+--- /dev/null
++++ "b/qu\\"ote.txt"
+@@ -0,0 +1 @@
++z"""
+
+OCTAL_QUOTED_BINARY = """diff --git "a/\\303\\257con.png" "b/\\303\\257con.png"
+new file mode 100644
+index 0000000..8835708
+Binary files /dev/null and "b/\\303\\257con.png" differ"""
+
+TAB_TERMINATED = """diff --git a/with space.txt b/with space.txt
+new file mode 100644
+index 0000000..bca70f3
+--- /dev/null
++++ b/with space.txt\t
+@@ -0,0 +1 @@
++q"""
+
+def test_modified_file_hunks():
+    [file_diff] = parse_diff(diff(MODIFIED))
+    assert (file_diff['path'], file_diff['old_path'], file_diff['status']) == ('src/app.py', 'src/app.py', 'modified')
+    first, second = file_diff['hunks']
+    assert (first['old_start'], first['old_lines'], first['new_start'], first['new_lines']) == (1, 3, 1, 4)
+    assert first['header'] == 'def main():'
+    assert first['lines'] == [' a', '-b', '+B', '+c', ' d']
+    # 줄 수를 생략한 hunk는 한 줄이다
+    assert (second['old_start'], second['old_lines'], second['new_start'], second['new_lines']) == (10, 1, 11, 1)
+    assert file_diff['text'].startswith('diff --git a/src/app.py')
+
+def test_renames():
+    renamed, pure = parse_diff(diff(RENAMED, PURE_RENAME))
+    assert (renamed['path'], renamed['old_path'], renamed['status']) == ('new.txt', 'old.txt', 'renamed')
+    assert renamed['hunks'][0]['lines'] == ['-three', '+THREE']
+    assert (pure['path'], pure['old_path'], pure['status'], pure['hunks']) == ('docs/b.md', 'docs/a.md', 'renamed', [])
+
+def test_binary_files_use_header_path():
+    binary, added = parse_diff(diff(BINARY, ADDED_BINARY_WITH_SPACE))
+    assert (binary['path'], binary['status'], binary['hunks']) == ('logo.png', 'binary', [])
+    assert (added['path'], added['status']) == ('sp ace.png', 'binary')
+
+def test_deleted_file_keeps_old_path():
+    [file_diff] = parse_diff(diff(DELETED))
+    assert (file_diff['path'], file_diff['old_path'], file_diff['status']) == ('gone.txt', 'gone.txt', 'deleted')
+
+def test_quoted_paths():
+    quoted, octal, tab = parse_diff(diff(QUOTED, OCTAL_QUOTED_BINARY, TAB_TERMINATED))
+    assert (quoted['path'], quoted['old_path'], quoted['status']) == ('qu"ote.txt', None, 'added')
+    assert (octal['path'], octal['status']) == ('ïcon.png', 'binary')
+    assert tab['path'] == 'with space.txt'
+
+def test_files_are_split_and_decoded_separately():
+    latin1 = diff(MODIFIED.replace('+c', '+caf\xe9')).replace('caf\xe9'.encode('utf-8'), 'caf\xe9'.encode('latin-1'))
+    file_diffs = parse_diff(latin1 + diff(DELETED))
+    assert [file_diff['path'] for file_diff in file_diffs] == ['src/app.py', 'gone.txt']
+    assert file_diffs[1]['hunks'][0]['lines'] == ['-keep']
+
+def test_empty_diff():
+    assert parse_diff(b'') == []
@@ -0,0 +1,88 @@
+import numpy as np
+from SageLibs.embedding_store import StoreWriter
+from SageLibs.lexical_index import SegmentBuilder, LexicalIndex, tokenize
+from SageLibs.vector_index import get_folder_index
+from SageLibs.utilities import fuse_rankings, find_hybrid_matches
+
+def test_fuse_rankings_prefers_rows_in_both_lists():
+    assert fuse_rankings([[1, 2, 3], [3, 4]]) == [3, 1, 2, 4]
+
+def test_fuse_rankings_ties_keep_first_list_order():
+    assert fuse_rankings([[1, 2], [3, 4]]) == [1, 3, 2, 4]
+
+def test_fuse_rankings_k_controls_rank_weight():
+    # k가 작을수록 한 목록의 1위가 두 목록 중간 순위보다 앞선다
+    rankings = [[1, 2, 3], [4, 5, 3]]
+    assert fuse_rankings(rankings, k=60)[0] == 3
+    assert fuse_rankings(rankings, k=0)[0] in (1, 4)
+
+def test_fuse_rankings_empty():
+    assert fuse_rankings([]) == []
+    assert fuse_rankings([[], []]) == []
+
+def test_tokenize_splits_identifiers():
+    terms = tokenize("FolderIndex.get_relevant_documents(x) 42 검색어")
+    assert {'folderindex', 'folder', 'index', 'get_relevant_documents', 'relevant', 'documents', '42', '검색어'} <= set(terms)
+    # 한 글자 토큰은 버린다
+    assert 'x' not in terms
+
+def build_lexical(documents, live=None):
+    builder = SegmentBuilder()
+    for row, (filename, content) in enumerate(documents):
+        builder.add(row, filename, content)
+    positions = np.arange(len(documents)) if live is None else np.asarray(live)
+    return LexicalIndex([(0, builder.finish())], positions, len(documents))
+
+def test_bm25_ranks_rare_terms_and_skips_dead_rows():
+    documents = [
+        ('a.py', 'def load(): return config'),
+        ('b.py', 'class FolderIndex: config config'),
+        ('c.py', 'config = load_config()'),
+    ]
+    scores = build_lexical(documents).score('FolderIndex config')
+    assert scores.argmax() == 1
+    assert scores[0] > 0 and scores[2] > 0
+
+    # 지워진 행(레코드에 없는 행)은 점수 배열에서 빠지고 문서 빈도에도 세지 않는다
+    scores = build_lexical(documents, live=[0, 2]).score('FolderIndex')
+    assert scores is None
+    assert len(build_lexical(documents, live=[0, 2]).score('config')) == 2
+
+def test_bm25_without_terms_returns_none():
+    lexical = build_lexical([('a.py', 'alpha beta')])
+    assert lexical.score('?!') is None
+    assert lexical.score('gamma') is None
+
+def test_hybrid_matches_add_lexical_hits_missed_by_vectors(tmp_path):
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    writer.add('vector.py', 'def helper(): pass\n', 'h0', [1, 0, 0])
+    writer.add('other.py', 'def unrelated(): pass\n', 'h1', [0.8, 0.6, 0])
+    writer.add('config.py', 'def parse_config(path): pass\n', 'h2', [0, 0, 1])
+    writer.commit()
+    index = get_folder_index(folder)
+
+    query = np.array([1, 0, 0], dtype=np.float32)
+    similar = [(0, 1.0), (1, 0.8)]
+    matches = find_hybrid_matches('where is parse_config', query, index, similar)
+    rows = [row for row, _, _ in matches]
+    assert sorted(rows) == [0, 1, 2]
+    # 벡터 검색에 없던 행도 실제 유사도를 받는다
+    assert dict((row, similarity) for row, similarity, _ in matches)[2] == 0.0
+    # 순위 점수는 합친 순서대로 내림차순이다
+    rank_scores = [score for _, _, score in matches]
+    assert rank_scores == sorted(rank_scores, reverse=True)
+    assert rows[0] == 0 and rows[1] == 2
+
+def test_hybrid_matches_keep_essential_files_first(tmp_path):
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    writer.add('README.md', 'project readme\n', 'h0', [0, 1])
+    writer.add('config.py', 'def parse_config(): pass\n', 'h1', [1, 0])
+    writer.commit()
+    index = get_folder_index(folder)
+
+    # 필수 파일은 유사도 10 이상으로 표시된다
+    matches = find_hybrid_matches('parse_config', np.array([1, 0], dtype=np.float32), index, [(0, 10.0)])
+    assert matches[0] == (0, 10.0, 10.0)
+    assert [row for row, _, _ in matches[1:]] == [1]
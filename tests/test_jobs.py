@@ -0,0 +1,116 @@
+import time
+import threading
+import pytest
+
+def wait_until_finished(jobs, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get_job(job_id)
+        if job['status'] not in jobs.ACTIVE_STATUSES:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+@pytest.fixture
+def blocking(jobs_db):
+    """ release가 설정될 때까지 끝나지 않는 작업 함수. started는 작업이 시작됐는지 알려준다 """
+    started, release = threading.Event(), threading.Event()
+
+    def run(job):
+        started.set()
+        release.wait(5)
+        return {'ok': True}
+    yield run, started, release
+    release.set()
+
+def test_same_key_is_not_submitted_twice(jobs_db, blocking):
+    run, started, release = blocking
+    job_id, created = jobs_db.submit_job('refresh', 'refresh:/a', 'Refresh /a', run)
+    assert created
+    assert jobs_db.submit_job('refresh', 'refresh:/a', 'Refresh /a', run) == (job_id, False)
+    other_id, created = jobs_db.submit_job('refresh', 'refresh:/b', 'Refresh /b', run)
+    assert created and other_id != job_id
+
+    release.set()
+    assert wait_until_finished(jobs_db, job_id)['result'] == {'ok': True}
+    wait_until_finished(jobs_db, other_id)
+    # 끝난 작업과 같은 key는 새 작업이 된다
+    new_id, created = jobs_db.submit_job('refresh', 'refresh:/a', 'Refresh /a', run)
+    assert created and new_id != job_id
+    wait_until_finished(jobs_db, new_id)
+
+def test_cancel_running_job(jobs_db):
+    started = threading.Event()
+
+    def run(job):
+        job.set_total(1000)
+        started.set()
+        for i in range(1000):
+            time.sleep(0.005)
+            job.advance(f"file{i}.py")
+        return {'ok': True}
+
+    job_id, _ = jobs_db.submit_job('refresh', 'refresh:/a', 'Refresh /a', run)
+    assert started.wait(5)
+    assert jobs_db.cancel_job(job_id)
+    job = wait_until_finished(jobs_db, job_id)
+    assert job['status'] == 'cancelled' and job['result'] is None
+    assert job['done'] < 1000
+    # 끝난 작업은 취소할 수 없다
+    assert not jobs_db.cancel_job(job_id)
+
+def test_cancelled_key_can_be_submitted_again(jobs_db, blocking):
+    run, started, release = blocking
+    job_id, _ = jobs_db.submit_job('refresh', 'refresh:/a', 'Refresh /a', run)
+    assert started.wait(5)
+    jobs_db.cancel_job(job_id)
+    # 취소를 요청한 작업이 아직 멈추지 않았어도 같은 key로 새 작업을 만들 수 있다
+    new_id, created = jobs_db.submit_job('refresh', 'refresh:/a', 'Refresh /a', run)
+    assert created and new_id != job_id
+    release.set()
+    wait_until_finished(jobs_db, job_id)
+    wait_until_finished(jobs_db, new_id)
+
+def test_cancel_before_start(jobs_db):
+    job = jobs_db.Job('refresh', 'refresh:/a', 'Refresh /a')
+    job.cancel_event.set()
+    jobs_db.run_job(job, lambda job: pytest.fail("cancelled job must not run"))
+    assert jobs_db.get_job(job.id)['status'] == 'cancelled'
+    assert jobs_db.get_job(job.id)['message'] == 'Cancelled before start'
+
+def test_failed_job_keeps_message_and_errors(jobs_db):
+    def run(job):
+        job.set_total(2)
+        job.advance('a.py', ValueError('bad encoding'))
+        raise RuntimeError('disk full')
+
+    job_id, _ = jobs_db.submit_job('refresh', 'refresh:/a', 'Refresh /a', run)
+    job = wait_until_finished(jobs_db, job_id)
+    assert job['status'] == 'failed' and job['message'] == 'disk full'
+    assert job['errors'] == [{'item': 'a.py', 'error': 'bad encoding'}]
+    assert [item['id'] for item in jobs_db.list_jobs()] == [job_id]
+
+def test_unfinished_jobs_are_marked_interrupted_on_startup(jobs_db, monkeypatch):
+    running = jobs_db.Job('refresh', 'refresh:/a', 'Refresh /a')
+    running.status = 'running'
+    running.persist(force=True)
+    done = jobs_db.Job('refresh', 'refresh:/b', 'Refresh /b')
+    done.finish('done', result={'ok': True})
+
+    # 프로세스를 다시 시작한 것처럼 연결과 초기화 상태를 비운다
+    monkeypatch.setattr(jobs_db, '_local', threading.local())
+    monkeypatch.setattr(jobs_db, '_initialized', False)
+    job = jobs_db.get_job(running.id)
+    assert job['status'] == 'interrupted' and job['finished_at'] is not None
+    assert jobs_db.get_job(done.id)['status'] == 'done'
+
+def test_wait_for_change_returns_new_output(jobs_db, blocking):
+    run, started, release = blocking
+    job_id, _ = jobs_db.submit_job('analyze', 'analyze:/a', 'Analyze /a', run)
+    assert started.wait(5)
+    job = jobs_db._jobs[job_id]
+    job.write('a.py', 'first ')
+    job.write('a.py', 'second')
+    state, output = jobs_db.wait_for_change(job_id, job.version, output_offset=1, timeout=1)
+    assert output == [{'item': 'a.py', 'text': 'second'}]
+    assert state['status'] == 'running'
@@ -0,0 +1,81 @@
+import json
+import sqlite3
+import threading
+import numpy as np
+import pytest
+from SageLibs import config
+
+@pytest.fixture
+def history_on(monkeypatch):
+    monkeypatch.setattr(config, 'settings', {'use_question_history': 'on'})
+
+def restart(questions, monkeypatch):
+    """ 프로세스를 다시 시작한 것처럼 연결, 초기화 상태, 캐시를 비운다 """
+    questions._local.connection.close()
+    monkeypatch.setattr(questions, '_local', threading.local())
+    monkeypatch.setattr(questions, '_initialized', False)
+    monkeypatch.setattr(questions, '_history', None)
+    monkeypatch.setattr(questions, '_question_cache', None)
+
+def write_legacy_file(documents):
+    with open('SageQuestions.json', 'w', encoding='utf-8') as file:
+        json.dump({'_default': documents}, file)
+
+def test_tinydb_history_is_migrated_once(questions_db, history_on, monkeypatch):
+    write_legacy_file({
+        '1': {'title': 'First', 'question': 'First question', 'answer': 'one two three', 'content_hash': 'h1', 'embedding': [1.0, 0.0, 0.0]},
+        '3': {'title': 'Third', 'question': 'Third question', 'answer': 'four five', 'embedding': [0.0, 1.0, 0.0]},
+        '4': {'title': 'No embedding', 'question': 'Fourth question', 'answer': 'six'}
+    })
+    assert questions_db.get_all_questions() == [{'doc_id': 1, 'title': 'First'}, {'doc_id': 3, 'title': 'Third'},
+                                                {'doc_id': 4, 'title': 'No embedding'}]
+    assert questions_db.get_question_by_id(1)['content_hash'] == 'h1'
+
+    # 토큰 수는 제목과 답변으로 다시 세고, 임베딩이 있는 질문만 이전 답변으로 찾는다
+    answers = questions_db.get_relevant_answers(np.array([1.0, 0.0, 0.0], dtype=np.float32), similarity_threshold=0.5)
+    assert [(answer['title'], answer['tokens']) for answer in answers] == [('First', 4)]
+
+    # 옮긴 id 뒤로 새 질문이 이어진다
+    assert questions_db.insert_question("New question", "answer") == 5
+
+    restart(questions_db, monkeypatch)
+    assert len(questions_db.get_all_questions()) == 4
+
+def test_old_database_gains_answer_cache_columns(questions_db):
+    connection = sqlite3.connect(questions_db.QUESTIONS_DB_FILE)
+    with connection:
+        connection.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, question TEXT NOT NULL, '
+                           'answer TEXT NOT NULL, content_hash TEXT, tokens INTEGER, embedding BLOB)')
+        connection.execute("INSERT INTO questions (title, question, answer) VALUES ('Old', 'Old question', 'old answer')")
+    connection.close()
+    # 데이터베이스에 이력이 있으면 JSON 파일은 다시 옮기지 않는다
+    write_legacy_file({'1': {'title': 'Legacy', 'question': 'Legacy question', 'answer': 'legacy'}})
+
+    doc_id = questions_db.insert_question("New question", "answer", np.array([1.0, 0.0], dtype=np.float32), [])
+    columns = set(row['name'] for row in questions_db.get_connection().execute('PRAGMA table_info(questions)'))
+    assert {'question_embedding', 'sources'} <= columns
+    assert [item['title'] for item in questions_db.get_all_questions()] == ['Old', 'New question']
+    assert questions_db.get_connection().execute('SELECT sources FROM questions WHERE id = ?', (doc_id,)).fetchone()['sources'] == '[]'
+
+def test_history_limit_trims_oldest_questions_and_caches(questions_db, history_on, monkeypatch):
+    monkeypatch.setattr(questions_db, 'MAX_HISTORY_COUNT', 3)
+    query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    doc_id = questions_db.insert_question("Question 1", "answer", query, [])
+    # 캐시를 먼저 읽어 두고, 이후 추가와 삭제가 캐시에 반영되는지 본다
+    assert len(questions_db.get_relevant_answers(query)) == 1
+    assert questions_db.get_question_cache(3)['ids'].tolist() == [doc_id]
+
+    for i in range(2, 6):
+        questions_db.insert_question(f"Question {i}", "answer", query, [])
+
+    assert [item['doc_id'] for item in questions_db.get_all_questions()] == [3, 4, 5]
+    assert sorted(answer['title'] for answer in questions_db.get_relevant_answers(query)) == ['Question 3', 'Question 4', 'Question 5']
+    assert questions_db.get_history()['ids'].tolist() == [3, 4, 5]
+    assert questions_db.get_question_cache(3)['ids'].tolist() == [3, 4, 5]
+
+def test_history_limit_keeps_everything_below_the_limit(questions_db, monkeypatch):
+    monkeypatch.setattr(questions_db, 'MAX_HISTORY_COUNT', 3)
+    for i in range(3):
+        questions_db.insert_question(f"Question {i}", "answer")
+    questions_db.maintain_history_limit()
+    assert len(questions_db.get_all_questions()) == 3
@@ -0,0 +1,54 @@
+import os
+import re
+import pytest
+from SageLibs.scanner import glob_to_regex, PathMatcher, scan_files
+
+def matches(pattern, path):
+    return re.fullmatch(glob_to_regex(pattern), path) is not None
+
+@pytest.mark.parametrize('pattern, path, expected', [
+    ('*.pyc', 'module.pyc', True),
+    ('*.pyc', 'pkg/module.pyc', False),
+    ('*.pyc', 'module.py', False),
+    ('?.txt', 'a.txt', True),
+    ('?.txt', 'ab.txt', False),
+    ('a?b', 'a/b', False),
+    ('gen/**/*.py', 'gen/a.py', True),
+    ('gen/**/*.py', 'gen/x/y/a.py', True),
+    ('gen/**/*.py', 'gen2/a.py', False),
+    ('gen/**/*.py', 'gen/x/a.pyc', False),
+    ('docs/**', 'docs/a/b.md', True),
+    ('**/build', 'build', True),
+    ('**/build', 'a/b/build', True),
+    ('[abc].txt', 'b.txt', True),
+    ('[abc].txt', 'd.txt', False),
+    ('[!abc].txt', 'd.txt', True),
+    ('[!abc].txt', 'a.txt', False),
+    ('a.txt', 'abtxt', False),
+    ('a+b(1).txt', 'a+b(1).txt', True),
+    ('[unclosed', '[unclosed', True),
+])
+def test_glob_to_regex(pattern, path, expected):
+    assert matches(pattern, path) is expected
+
+def test_path_matcher_rules():
+    matcher = PathMatcher(['.py', '.md'], ['*_pb2.py', 'setup.py', 'gen/**/*.py'], ['*.egg-info', 'node_modules', 'docs/build'])
+    assert matcher.accept_path('pkg/module.py')
+    assert not matcher.accept_path('pkg/module.txt')
+    assert not matcher.accept_path('pkg/api_pb2.py')
+    assert not matcher.accept_path('setup.py')
+    assert not matcher.accept_path('gen/deep/x.py')
+    assert not matcher.accept_path('pkg.egg-info/PKG-INFO.md')
+    assert not matcher.accept_path('web/node_modules/a/readme.md')
+    assert not matcher.accept_path('docs/build/index.md')
+    assert matcher.accept_path('docs/source/index.md')
+    # 이름 규칙은 경로의 일부가 아니라 이름 전체와 비교한다
+    assert matcher.accept_path('my_setup.py')
+
+def test_scan_files_applies_rules(tmp_path):
+    for path in ['a.py', 'b.txt', 'pkg/c.py', 'pkg/c_pb2.py', 'docs/build/d.md', 'docs/e.md', 'node_modules/f.py', 'SageIndex/g.py']:
+        os.makedirs(os.path.dirname(tmp_path / path), exist_ok=True)
+        (tmp_path / path).write_text('x')
+    matcher = PathMatcher(['.py', '.md'], ['*_pb2.py'], ['node_modules', 'docs/build'])
+    found = sorted(os.path.relpath(path, tmp_path).replace(os.sep, '/') for path in scan_files(str(tmp_path), matcher))
+    assert found == ['a.py', 'docs/e.md', 'pkg/c.py']
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+from SageLibs import embedding_store
+from SageLibs.embedding_store import StoreWriter, compact_store
+from SageLibs.vector_index import get_folder_index
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    """ 세그먼트 두 개(두 번째 커밋에서 b.py를 지움)로 된 저장소. 백그라운드 압축은 실행하지 않는다 """
+    monkeypatch.setattr(embedding_store, 'schedule_compaction', lambda folder: None)
+    folder = str(tmp_path)
+    writer = StoreWriter(folder, 'float32')
+    writer.add('a.py', 'a = 1\n', 'hash-a', np.array([1, 0], dtype=np.float32))
+    writer.add('b.py', 'b = 2\n', 'hash-b', np.array([0, 1], dtype=np.float32))
+    writer.commit()
+    writer = StoreWriter(folder, 'float32')
+    writer.keep(next(record for record in writer.base['records'] if record['filename'] == 'a.py'))
+    writer.add('c.py', 'c = 3\n', 'hash-c', np.array([1, 1], dtype=np.float32))
+    writer.commit()
+    return folder
+
+def open_segment_files():
+    fd_dir = '/proc/self/fd'
+    if not os.path.isdir(fd_dir):
+        pytest.skip("needs /proc to list open files")
+    paths = []
+    for fd in os.listdir(fd_dir):
+        try:
+            paths.append(os.readlink(os.path.join(fd_dir, fd)))
+        except OSError:
+            pass
+    return [path for path in paths if os.path.basename(path).startswith('seg-') and path.endswith('.bin')]
+
+def test_index_does_not_keep_segment_bodies_open(folder):
+    index = get_folder_index(folder)
+    assert index.get_content(index.get_file_rows('a.py')[0]) == 'a = 1\n'
+    assert open_segment_files() == []
+
+def test_replaced_index_reads_chunks_moved_by_compaction(folder):
+    stale = get_folder_index(folder)
+    assert compact_store(folder, force=True)
+    # 압축으로 원래 세그먼트가 지워져도, 이전 인덱스는 옮겨진 같은 청크를 읽는다
+    assert stale.get_content(stale.get_file_rows('c.py')[0]) == 'c = 3\n'
+    assert get_folder_index(folder) is not stale
+
+def test_replaced_index_fails_for_changed_file(folder):
+    stale = get_folder_index(folder)
+    writer = StoreWriter(folder, 'float32')
+    writer.keep(next(record for record in writer.base['records'] if record['filename'] == 'a.py'))
+    writer.add('c.py', 'c = 4\n', 'hash-c2', np.array([1, 1], dtype=np.float32))
+    writer.commit()
+    assert compact_store(folder, force=True)
+    with pytest.raises(FileNotFoundError, match='c.py'):
+        stale.get_content(stale.get_file_rows('c.py')[0])